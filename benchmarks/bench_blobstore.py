@@ -0,0 +1,89 @@
+"""
+Retained memory of a speciation batch with images kept inline vs. in a
+blob store (in-memory and on-disk), measured with tracemalloc.
+
+	python benchmarks/bench_blobstore.py --chemicals 50
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('CTS_JCHEM_SERVER', 'http://localhost:8080')
+
+import fixtures
+
+from cts_calcs import blobstore
+from cts_calcs.jchem_properties import Pka, Tautomerization
+
+
+def response_texts(n_chemicals):
+	"""
+	Raw response bodies: pKa results share images across chemicals
+	(common microspecies), tautomer images are unique per chemical.
+	"""
+	pka_text = json.dumps(fixtures.jchem_pka_response(8))
+	texts = []
+	for chem_index in range(n_chemicals):
+		tautomers = fixtures.jchem_tautomer_response(20)
+		for taut_index, taut in enumerate(tautomers['result']):
+			taut['image']['image'] = fixtures.fake_image('{}-{}'.format(chem_index, taut_index))
+		texts.append((pka_text, json.dumps(tautomers)))
+	return texts
+
+
+def run_batch(texts):
+	results = []
+	for pka_text, taut_text in texts:
+		pka = Pka()
+		pka.results = json.loads(pka_text)
+		tautomer = Tautomerization()
+		tautomer.results = json.loads(taut_text)
+		results.append({
+			'pka_parent': pka.getParent(test=True),
+			'pka_microspecies': pka.getMicrospecies(test=True),
+			'tautomers': tautomer.getTautomers(test=True)
+		})
+	return results
+
+
+def measure(texts, store):
+	blobstore.set_blob_store(store)
+	gc.collect()
+	tracemalloc.start()
+	results = run_batch(texts)
+	gc.collect()
+	retained, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del results
+	return retained, peak
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--chemicals', type=int, default=50)
+	args = parser.parse_args()
+
+	texts = response_texts(args.chemicals)
+	blob_path = os.path.join(tempfile.mkdtemp(), 'images.blob')
+	stores = [
+		('inline strings', None),
+		('memory blob store', blobstore.MemoryBlobStore()),
+		('disk blob store', blobstore.DiskBlobStore(blob_path)),
+	]
+	print("{:<20} {:>16} {:>16}".format('images', 'retained', 'peak'))
+	baseline = None
+	for name, store in stores:
+		retained, peak = measure(texts, store)
+		baseline = baseline or retained
+		print("{:<20} {:>13.1f} MB {:>13.1f} MB   ({:.0%} of inline)".format(name, retained / 1e6, peak / 1e6, float(retained) / baseline))
+	os.remove(blob_path)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+"""
+Measures gzip/deflate wire savings and CPU cost on realistic payloads
+(SPARC multiProperty request, speciation and tautomer responses), and
+reports the break-even link speed: compression pays off on links slower
+than saved bits / (compress + decompress time).
+
+	python benchmarks/bench_compression.py
+"""
+
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fixtures
+
+
+def sparc_multi_request():
+	from cts_calcs.calculator_sparc import SparcCalc
+	return SparcCalc('CC(=O)Oc1ccccc1C(O)=O').get_sparc_query()
+
+
+def payloads():
+	return [
+		('sparc multiProperty request', sparc_multi_request()),
+		('sparc logd response', fixtures.sparc_logd_response()),
+		('jchem pKa response (4 ms)', fixtures.jchem_pka_response(4)),
+		('jchem tautomers (10)', fixtures.jchem_tautomer_response(10)),
+		('jchem tautomers (100)', fixtures.jchem_tautomer_response(100)),
+		('jchem tautomers (1000)', fixtures.jchem_tautomer_response(1000)),
+	]
+
+
+CODECS = [
+	('gzip-1', lambda raw: gzip.compress(raw, 1), gzip.decompress),
+	('gzip-6', lambda raw: gzip.compress(raw, 6), gzip.decompress),
+	('deflate-6', lambda raw: zlib.compress(raw, 6), zlib.decompress),
+]
+
+
+def best_time(func, arg, repeat=5):
+	best = None
+	for _ in range(repeat):
+		start_time = time.perf_counter()
+		result = func(arg)
+		elapsed = time.perf_counter() - start_time
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+
+def main():
+	header = "{:<30} {:<10} {:>12} {:>12} {:>7} {:>10} {:>10} {:>14}"
+	print(header.format('payload', 'codec', 'raw bytes', 'wire bytes', 'ratio', 'comp ms', 'decomp ms', 'break-even'))
+	for name, payload in payloads():
+		raw = json.dumps(payload).encode('utf-8')
+		for codec_name, compress, decompress in CODECS:
+			compress_time, wire = best_time(compress, raw)
+			decompress_time, _ = best_time(decompress, wire)
+			saved_bits = 8.0 * (len(raw) - len(wire))
+			break_even = saved_bits / (compress_time + decompress_time) / 1e6  # Mbit/s
+			print(header.format(name, codec_name, len(raw), len(wire), "{:.2f}".format(float(len(wire)) / len(raw)),
+				"{:.3f}".format(1000 * compress_time), "{:.3f}".format(1000 * decompress_time),
+				"{:.0f} Mbit/s".format(break_even)))
+
+
+if __name__ == '__main__':
+	main()
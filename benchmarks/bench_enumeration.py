@@ -0,0 +1,120 @@
+"""
+Peak memory and time for large tautomer and stereoisomer enumerations:
+the whole response parsed at once (make_data_request + getTautomers)
+vs. streamed (iterTautomers/iterStereoisomers), and streamed with an
+early stop at a count cap or distribution threshold.
+
+	python benchmarks/bench_enumeration.py --structures 1000
+
+The stand-in server runs in a subprocess so tracemalloc only sees the
+client's allocations. Streamed cases consume the generator without
+keeping the structures, as a caller writing each one out would.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standin_server.py')
+
+
+def start_standin_process(structures):
+	sock = socket.socket()
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	process = subprocess.Popen([sys.executable, STANDIN, '--port', str(port), '--latency', '0', '--jitter', '0',
+		'--tautomers', str(structures), '--stereoisomers', str(structures)],
+		stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)  # early-closed connections log tracebacks
+	for _ in range(100):
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+			break
+		except OSError:
+			time.sleep(0.05)
+	return process, "http://127.0.0.1:{}".format(port)
+
+
+def consume(structures):
+	count = 0
+	for _ in structures:
+		count += 1
+	return count
+
+
+def build_cases(smiles, cap, threshold):
+	from cts_calcs.jchem_properties import Tautomerization, Stereoisomer
+
+	def prop(prop_class):
+		prop_obj = prop_class()
+		prop_obj.use_cache = False
+		return prop_obj
+
+	def full_tautomers():
+		taut = prop(Tautomerization)
+		taut.make_data_request(smiles, taut)
+		return len(taut.getTautomers(test=True))
+
+	def full_stereoisomers():
+		stereo = prop(Stereoisomer)
+		stereo.make_data_request(smiles, stereo)
+		return len(stereo.getStereoisomers(test=True))
+
+	return [
+		('tautomers, whole response', full_tautomers),
+		('tautomers, streamed', lambda: consume(prop(Tautomerization).iterTautomers(smiles, test=True))),
+		('tautomers, streamed, cap {}'.format(cap), lambda: consume(prop(Tautomerization).iterTautomers(smiles, max_count=cap, test=True))),
+		('tautomers, streamed, dist {:g}'.format(threshold),
+			lambda: consume(prop(Tautomerization).iterTautomers(smiles, min_distribution=threshold, test=True))),
+		('stereoisomers, whole response', full_stereoisomers),
+		('stereoisomers, streamed', lambda: consume(prop(Stereoisomer).iterStereoisomers(smiles, test=True))),
+		('stereoisomers, streamed, cap {}'.format(cap), lambda: consume(prop(Stereoisomer).iterStereoisomers(smiles, max_count=cap, test=True))),
+	]
+
+
+def measure(func, repeat=3):
+	"""
+	Returns (best seconds, peak traced bytes, structures returned).
+	"""
+	best = None
+	for _ in range(repeat):
+		start_time = time.time()
+		count = func()
+		elapsed = time.time() - start_time
+		best = elapsed if best is None else min(best, elapsed)
+	tracemalloc.start()
+	func()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return best, peak, count
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--structures', type=int, default=1000, help="structures per enumeration response")
+	parser.add_argument('--cap', type=int, default=50)
+	parser.add_argument('--threshold', type=float, default=0.9, help="cumulative dominantTautomerDistribution")
+	args = parser.parse_args()
+
+	process, base_url = start_standin_process(args.structures)
+	os.environ['CTS_JCHEM_SERVER'] = base_url
+	try:
+		cases = build_cases('CC(O)=CC', args.cap, args.threshold)
+		cases[0][1]()  # warms up the connection and the server's cached bodies
+		print("{:<34} {:>10} {:>10} {:>14}".format('case', 'structures', 'time', 'peak memory'))
+		for name, func in cases:
+			best, peak, count = measure(func)
+			print("{:<34} {:>10} {:>8.3f} s {:>11.1f} MB".format(name, count, best, peak / 1e6))
+	finally:
+		process.terminate()
+		process.wait()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,83 @@
+"""
+Time to first result and total latency for a p-chem table (chemaxon
+and SPARC props for one chemical), calling the calculators one after
+the other vs. orchestrator.fan_out, against the stand-in backends.
+
+	python benchmarks/bench_fanout.py --latency 0.1 --chemicals 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from standin_server import start_standin
+
+CALC_PROPS = {
+	'chemaxon': ['water_sol', 'ion_con', 'kow_no_ph', 'kow_wph'],
+	'sparc': ['water_sol', 'vapor_press', 'henrys_law_con', 'boiling_point', 'ion_con', 'kow_wph'],
+}
+
+
+def sequential(smiles, ph=7.0):
+	"""
+	Filters per calculator and runs each call in turn, as
+	callers did before fan_out. Yields data objects.
+	"""
+	from cts_calcs.smilesfilter import SMILESFilter
+	from cts_calcs.jchem_properties import JchemProperty
+	from cts_calcs.calculator_sparc import SparcCalc
+	chemaxon_smiles = SMILESFilter().parseSmilesByCalculator(smiles, 'chemaxon')
+	for prop in CALC_PROPS['chemaxon']:
+		methods = ['KLOP', 'VG', 'PHYS'] if prop.startswith('kow') else [None]
+		for method in methods:
+			yield JchemProperty().getJchemPropData({'chemical': chemaxon_smiles, 'prop': prop, 'ph': ph, 'method': method})
+	sparc_smiles = SMILESFilter().parseSmilesByCalculator(smiles, 'sparc')
+	request_dict = {'chemical': sparc_smiles, 'calc': 'sparc', 'ph': ph}
+	multi_props = [prop for prop in CALC_PROPS['sparc'] if not prop in ['ion_con', 'kow_wph']]
+	for data_obj in SparcCalc(sparc_smiles).data_request_handler(dict(request_dict, props=multi_props)):
+		yield data_obj
+	for prop in ['ion_con', 'kow_wph']:
+		response = SparcCalc(sparc_smiles).data_request_handler(dict(request_dict, prop=prop))
+		yield {'calc': 'sparc', 'prop': prop, 'data': response.get('data')}
+
+
+def timed(results):
+	start_time = time.time()
+	first, count = None, 0
+	for _ in results:
+		count += 1
+		if first is None:
+			first = time.time() - start_time
+	return first, time.time() - start_time, count
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--latency', type=float, default=0.1)
+	parser.add_argument('--chemicals', type=int, default=5)
+	args = parser.parse_args()
+
+	server, base_url = start_standin(latency=args.latency, jitter=args.latency / 10)
+	for name in ('CTS_SPARC_SERVER', 'CTS_JCHEM_SERVER', 'CTS_EFS_SERVER'):
+		os.environ[name] = base_url
+	from cts_calcs import orchestrator
+
+	print("{:<12} {:>14} {:>12} {:>9}".format('mode', 'first result', 'total', 'results'))
+	for name, run in (('sequential', sequential), ('fan-out', lambda smiles: orchestrator.fan_out(smiles, CALC_PROPS))):
+		firsts, totals = [], []
+		for index in range(args.chemicals):
+			smiles = 'C' * (index + 2) + 'O'  # unique per run, so no cache hits
+			if name == 'fan-out':
+				smiles += 'C'
+			first, total, count = timed(run(smiles))
+			firsts.append(first)
+			totals.append(total)
+		print("{:<12} {:>11.3f} s {:>10.3f} s {:>9}".format(name, sum(firsts) / len(firsts), sum(totals) / len(totals), count))
+	server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,63 @@
+"""
+Compares request latency with and without hedging against the
+fault-injecting stand-in (slow tail on a fraction of requests).
+
+	python benchmarks/bench_hedging.py --requests 400 --tail-rate 0.02
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cts_calcs import transport
+from cts_calcs.limiter import configure_backend
+from cts_calcs.latency import get_latency_tracker
+
+from standin_server import start_standin
+
+
+def percentile(values, pct):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run(url, n_requests, concurrency, hedge):
+	def timed_request(_):
+		start_time = time.time()
+		transport.post(url, data='{}', headers={'Content-Type': 'application/json'}, timeout=10, hedge=hedge)
+		return time.time() - start_time
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+		return list(executor.map(timed_request, range(n_requests)))
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--requests', type=int, default=400)
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--tail-rate', type=float, default=0.02)
+	parser.add_argument('--tail-latency', type=float, default=0.5)
+	args = parser.parse_args()
+
+	server, base_url = start_standin(tail_rate=args.tail_rate, tail_latency=args.tail_latency, seed=1)
+	configure_backend(base_url, initial_limit=64, max_limit=256)
+	url = base_url + '/webservices/rest-v0/util/calculate/logP'
+
+	run(url, 100, args.concurrency, hedge=False)  # latency samples for p95/p99
+	print("endpoint stats after warm-up: {}".format(get_latency_tracker().stats()))
+
+	for hedge in (False, True):
+		sent_before = server.request_count
+		latencies = run(url, args.requests, args.concurrency, hedge)
+		print("hedge={:<5} p50={:.3f}s p95={:.3f}s p99={:.3f}s max={:.3f}s backend requests={}".format(
+			str(hedge), percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+			max(latencies), server.request_count - sent_before))
+	server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,180 @@
+"""
+Microbenchmarks for the response parse paths, run against a corpus of
+backend responses from small molecules up to 1000-tautomer results.
+
+	python benchmarks/bench_parse.py                        # run and print
+	python benchmarks/bench_parse.py --save-baseline b.json  # store timings/memory
+	python benchmarks/bench_parse.py --compare b.json        # flag regressions
+
+The corpus is generated from fixtures unless --corpus points at a
+directory of recorded responses named <endpoint>-<label>.json, where
+endpoint is one of: sparc_multi, sparc_pka, sparc_logd, jchem_pka,
+jchem_isoelectric, jchem_tautomer. --compare exits 1 if any case is
+slower (or peaks higher in memory) than the baseline by more than
+--threshold.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('CTS_JCHEM_SERVER', 'http://localhost:8080')
+
+import fixtures
+
+from cts_calcs.calculator import Calculator
+from cts_calcs.calculator_sparc import SparcCalc
+from cts_calcs.jchem_properties import Pka, IsoelectricPoint, Tautomerization
+
+
+
+class OfflineCalculator(Calculator):
+	"""
+	Calculator whose image requests are answered from fixtures,
+	so popupBuilder can be timed without a JChem server.
+	"""
+
+	def __init__(self):
+		Calculator.__init__(self)
+		self.detail_response = fixtures.jchem_detail_response()
+
+	def smilesToImage(self, request_obj):
+		return self.detail_response
+
+
+
+def generated_corpus():
+	return {
+		'sparc_multi': {'small': fixtures.sparc_multi_response()},
+		'sparc_pka': {'small': fixtures.sparc_pka_response(1), 'large': fixtures.sparc_pka_response(12)},
+		'sparc_logd': {'small': fixtures.sparc_logd_response()},
+		'jchem_pka': {'small': fixtures.jchem_pka_response(2), 'medium': fixtures.jchem_pka_response(8), 'large': fixtures.jchem_pka_response(32)},
+		'jchem_isoelectric': {'small': fixtures.jchem_isoelectric_response()},
+		'jchem_tautomer': {'1': fixtures.jchem_tautomer_response(1), '10': fixtures.jchem_tautomer_response(10),
+			'100': fixtures.jchem_tautomer_response(100), '1000': fixtures.jchem_tautomer_response(1000)},
+	}
+
+
+def load_corpus(corpus_dir):
+	corpus = {}
+	for path in sorted(glob.glob(os.path.join(corpus_dir, '*.json'))):
+		endpoint, _, label = os.path.basename(path)[:-len('.json')].partition('-')
+		with open(path) as corpus_file:
+			corpus.setdefault(endpoint, {})[label or 'recorded'] = json.load(corpus_file)
+	return corpus
+
+
+def with_results(prop_obj, results):
+	prop_obj.results = results
+	return prop_obj
+
+
+def build_cases(corpus):
+	"""
+	Returns [(case name, callable)] for every parse path and corpus entry.
+	"""
+	sparc = SparcCalc('CCC')
+	calc = OfflineCalculator()
+	request_dict = {'props': ['water_sol', 'vapor_press', 'henrys_law_con', 'mol_diss', 'boiling_point']}
+	cases = []
+	for label, response in corpus.get('sparc_multi', {}).items():
+		cases.append(('parseMultiPropResponse[{}]'.format(label),
+			lambda response=response: sparc.parseMultiPropResponse(response['calculationResults'], request_dict)))
+	for label, response in corpus.get('sparc_pka', {}).items():
+		cases.append(('getPkaResults[{}]'.format(label), lambda response=response: sparc.getPkaResults(response)))
+	for label, response in corpus.get('sparc_logd', {}).items():
+		cases.append(('getLogDForPH[{}]'.format(label), lambda response=response: sparc.getLogDForPH(response, 7.0)))
+	for label, response in corpus.get('jchem_pka', {}).items():
+		pka = with_results(Pka(), response)
+		cases.append(('Pka.getChartData[{}]'.format(label), pka.getChartData))
+	for label, response in corpus.get('jchem_isoelectric', {}).items():
+		isoelectric = with_results(IsoelectricPoint(), response)
+		cases.append(('IsoelectricPoint.getChartData[{}]'.format(label), isoelectric.getChartData))
+	for label, response in corpus.get('jchem_tautomer', {}).items():
+		tautomer = with_results(Tautomerization(), response)
+		cases.append(('getTautomers[{}]'.format(label), lambda tautomer=tautomer: tautomer.getTautomers(test=True)))
+
+	root = {'smiles': 'CC(=O)Oc1ccccc1C(O)=O', 'formula': 'C9H8O4', 'iupac': '2-acetyloxybenzoic acid', 'mass': 180.159, 'exactMass': 180.042}
+	param_keys = ['smiles', 'formula', 'iupac', 'mass', 'exactMass']
+	cases.append(('popupBuilder', lambda: calc.popupBuilder(root, param_keys, 'parent', 'Parent')))
+	cases.append(('popupBuilder[product]', lambda: calc.popupBuilder(root, param_keys, 'node1', 'Product', isProduct=True)))
+	img_data = {'key': 'parent', 'smiles': root['smiles'], 'img': fixtures.fake_image(1), 'width': 100, 'height': 100}
+	cases.append(('imgTmpl2', lambda: calc.imgTmpl2(img_data, False)))
+	valid_response = fixtures.jchem_detail_response()
+	error_response = fixtures.jchem_error_response()
+	cases.append(('check_response_for_errors[valid]', lambda: calc.check_response_for_errors(valid_response)))
+	cases.append(('check_response_for_errors[error]', lambda: calc.check_response_for_errors(error_response)))
+	return cases
+
+
+def measure(func, repeat=5):
+	"""
+	Returns (best seconds per call, peak traced bytes for one call).
+	"""
+	timer = timeit.Timer(func)
+	number, _ = timer.autorange()
+	best = min(timer.repeat(repeat=repeat, number=number)) / number
+	tracemalloc.start()
+	func()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return best, peak
+
+
+def compare(results, baseline, threshold):
+	"""
+	Returns list of regression messages beyond threshold (e.g., 0.2 = 20%).
+	"""
+	regressions = []
+	for name, result in results.items():
+		base = baseline.get(name)
+		if not base:
+			continue
+		for metric in ('time', 'peak_bytes'):
+			if base[metric] and result[metric] > base[metric] * (1.0 + threshold):
+				regressions.append("{} {}: {:.6g} -> {:.6g} (+{:.0f}%)".format(
+					name, metric, base[metric], result[metric], 100.0 * (result[metric] / base[metric] - 1.0)))
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="CTS parse path microbenchmarks")
+	parser.add_argument('--corpus', help="directory of recorded responses (default: generated fixtures)")
+	parser.add_argument('--filter', help="only run cases containing this string")
+	parser.add_argument('--save-baseline', help="write results to this baseline file")
+	parser.add_argument('--compare', help="baseline file to compare against")
+	parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown fraction (default 0.2)")
+	args = parser.parse_args()
+
+	corpus = load_corpus(args.corpus) if args.corpus else generated_corpus()
+	results = {}
+	print("{:<40} {:>14} {:>14}".format('case', 'time/call', 'peak memory'))
+	for name, func in build_cases(corpus):
+		if args.filter and args.filter not in name:
+			continue
+		best, peak = measure(func)
+		results[name] = {'time': best, 'peak_bytes': peak}
+		print("{:<40} {:>11.1f} us {:>11} B".format(name, best * 1e6, peak))
+
+	if args.save_baseline:
+		with open(args.save_baseline, 'w') as baseline_file:
+			json.dump(results, baseline_file, indent=2, sort_keys=True)
+		print("baseline saved to {}".format(args.save_baseline))
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			regressions = compare(results, json.load(baseline_file), args.threshold)
+		for message in regressions:
+			print("REGRESSION " + message)
+		if regressions:
+			sys.exit(1)
+		print("no regressions beyond {:.0f}%".format(100 * args.threshold))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,87 @@
+"""
+Interactive request latency while a batch backlog saturates the same
+backend, with and without priority classes (see cts_calcs.scheduler).
+
+	python benchmarks/bench_priority.py --batch-threads 32 --duration 5
+
+In the 'single class' run every request is sent at batch priority, so
+interactive requests queue behind the backlog first come first served;
+in the 'priority' run they're sent as interactive.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cts_calcs import transport
+from cts_calcs.limiter import configure_backend, get_backend_limiter
+from cts_calcs.scheduler import PRIORITY_INTERACTIVE, PRIORITY_BATCH
+
+from standin_server import start_standin
+
+
+def percentile(values, pct):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def post(url, priority):
+	start_time = time.time()
+	transport.post(url, data='{}', headers={'Content-Type': 'application/json'}, timeout=30, priority=priority)
+	return time.time() - start_time
+
+
+def run(base_url, url, batch_threads, duration, interactive_interval, interactive_priority):
+	configure_backend(base_url, initial_limit=8, min_limit=8, max_limit=8)  # fixed capacity
+	stop = threading.Event()
+	batch_done = []
+
+	def batch_loop():
+		while not stop.is_set():
+			post(url, PRIORITY_BATCH)
+			batch_done.append(1)
+
+	threads = [threading.Thread(target=batch_loop) for _ in range(batch_threads)]
+	for thread in threads:
+		thread.start()
+	time.sleep(0.5)  # let the backlog build
+	interactive = []
+	end_time = time.time() + duration
+	while time.time() < end_time:
+		interactive.append(post(url, interactive_priority))
+		time.sleep(interactive_interval)
+	stats = get_backend_limiter(url).stats()['priorities']
+	stop.set()
+	for thread in threads:
+		thread.join()
+	return interactive, len(batch_done) / (duration + 0.5), stats
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--batch-threads', type=int, default=32)
+	parser.add_argument('--duration', type=float, default=5.0)
+	parser.add_argument('--interactive-interval', type=float, default=0.05)
+	parser.add_argument('--verbose', action='store_true', help="print per-class queue stats")
+	args = parser.parse_args()
+
+	server, base_url = start_standin(latency=0.05, jitter=0.005)
+	url = base_url + '/webservices/rest-v0/util/calculate/logP'
+	print("unloaded interactive latency: {:.3f}s".format(post(url, PRIORITY_INTERACTIVE)))
+	for name, interactive_priority in (('single class', PRIORITY_BATCH), ('priority', PRIORITY_INTERACTIVE)):
+		latencies, batch_rate, stats = run(base_url, url, args.batch_threads, args.duration,
+			args.interactive_interval, interactive_priority)
+		print("{:<13} interactive p50={:.3f}s p99={:.3f}s max={:.3f}s   batch {:.0f} req/s   batch queue depth {}".format(
+			name, percentile(latencies, 50), percentile(latencies, 99), max(latencies), batch_rate, stats[PRIORITY_BATCH]['depth']))
+		if args.verbose:
+			print(json.dumps(stats, indent=2, sort_keys=True))
+	server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
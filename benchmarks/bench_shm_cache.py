@@ -0,0 +1,123 @@
+"""
+Hit rate, backend calls and memory for a pool of worker processes
+with per-process result caches (LocalCache) vs. one shared-memory
+cache (shm_cache.SharedMemoryCache) mapped by all of them.
+
+	python benchmarks/bench_shm_cache.py --workers 4 --keys 20000 --lookups 20000
+
+Each worker looks up keys drawn from the same Zipf-like popularity
+(hot chemicals are requested by every worker) and on a miss "computes"
+the result (a SPARC-sized fixture, --miss-cost ms) and stores it.
+Memory is what the caches hold: the size of each worker's LocalCache
+entries, summed over workers, vs. the pages of the shared file that
+have been written (tmpfs blocks, counted once).
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fixtures
+
+from cts_calcs.cache import ResultCache, LocalCache
+from cts_calcs.shm_cache import SharedMemoryCache
+
+
+def result_for(index):
+	response = fixtures.sparc_multi_response('C' * (index % 40 + 1) + 'O')
+	response['request_id'] = index  # distinct bodies
+	return response
+
+
+def local_cache_size(client):
+	"""
+	Returns bytes held by a LocalCache's entries (keys, values, tuples).
+	"""
+	size = sys.getsizeof(client._data)
+	for name, item in client._data.items():
+		size += sys.getsizeof(name) + sys.getsizeof(item) + sys.getsizeof(item[0])
+	return size
+
+
+def worker(args):
+	mode, path, worker_index, keys, lookups, skew, miss_cost, seed = args
+	if mode == 'shared':
+		cache = ResultCache(SharedMemoryCache(path))
+	else:
+		cache = ResultCache(LocalCache(max_entries=keys))
+	rng = random.Random(seed + worker_index)
+	popularity = [1.0 / (rank ** skew) for rank in range(1, keys + 1)]
+	draws = rng.choices(range(keys), popularity, k=lookups)
+	get_time = 0.0
+	backend_calls = 0
+	start_time = time.time()
+	for index in draws:
+		key = cache.make_key('sparc', 'bench', index)
+		lookup_start = time.time()
+		value = cache.get(key)
+		get_time += time.time() - lookup_start
+		if value is None:
+			backend_calls += 1
+			if miss_cost:
+				time.sleep(miss_cost / 1000.0)
+			cache.set(key, result_for(index))
+	elapsed = time.time() - start_time
+	memory = 0 if mode == 'shared' else local_cache_size(cache.client)
+	return {'hits': cache.hits, 'misses': cache.misses, 'backend_calls': backend_calls,
+		'get_time': get_time, 'elapsed': elapsed, 'memory': memory}
+
+
+def run(mode, args, path):
+	context = multiprocessing.get_context('fork')
+	jobs = [(mode, path, index, args.keys, args.lookups, args.skew, args.miss_cost, args.seed) for index in range(args.workers)]
+	start_time = time.time()
+	with context.Pool(args.workers) as pool:
+		results = pool.map(worker, jobs)
+	wall = time.time() - start_time
+	hits = sum(result['hits'] for result in results)
+	lookups = hits + sum(result['misses'] for result in results)
+	memory = sum(result['memory'] for result in results)
+	if mode == 'shared':
+		memory += os.stat(path).st_blocks * 512  # pages actually written
+	return {
+		'hit_rate': float(hits) / lookups,
+		'backend_calls': sum(result['backend_calls'] for result in results),
+		'memory': memory,
+		'get_us': 1e6 * sum(result['get_time'] for result in results) / lookups,
+		'wall': wall,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--keys', type=int, default=20000, help="distinct results")
+	parser.add_argument('--lookups', type=int, default=20000, help="lookups per worker")
+	parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of key popularity")
+	parser.add_argument('--miss-cost', type=float, default=0.0, help="ms to compute a missed result")
+	parser.add_argument('--shm-mb', type=int, default=16)
+	parser.add_argument('--slot-size', type=int, default=1024, help="shared cache record size")
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+	path = os.path.join(shm_dir, 'cts-bench-cache-{}'.format(os.getpid()))
+	SharedMemoryCache(path, size=args.shm_mb * 1024 * 1024, slot_size=args.slot_size).close()  # lays out the file before workers map it
+	print("{:<12} {:>9} {:>14} {:>12} {:>10} {:>8}".format('mode', 'hit rate', 'backend calls', 'cache memory', 'get', 'wall'))
+	try:
+		for mode in ('per-process', 'shared'):
+			result = run(mode, args, path)
+			print("{:<12} {:>8.1%} {:>14} {:>9.1f} MB {:>7.1f} us {:>6.2f} s".format(
+				mode, result['hit_rate'], result['backend_calls'], result['memory'] / 1e6, result['get_us'], result['wall']))
+	finally:
+		os.remove(path)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,109 @@
+"""
+Cold-start cost of a short-lived cts_calcs process: import time of the
+calculator modules and latency of the first SPARC request, measured in
+fresh interpreters against the stand-in server (with a per-connection
+handshake delay standing in for TLS setup).
+
+	python benchmarks/bench_startup.py                   # run, check budget
+	python benchmarks/bench_startup.py --save-budget      # record new budget
+
+Runs are compared with:
+	eager   - requests and pytz imported up front, as before lazy imports
+	lazy    - default fast-start imports
+	warm    - lazy imports plus transport.warm_up() at startup
+
+startup_budget.json holds the tracked budget (milliseconds, medians);
+the script exits 1 if the lazy import or warmed first request goes over.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standin_server import start_standin
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+start_time = time.perf_counter()
+if {eager!r}:
+	import requests, pytz
+from cts_calcs.calculator_sparc import SparcCalc
+from cts_calcs.jchem_properties import JchemProperty
+from cts_calcs.smilesfilter import SMILESFilter
+from cts_calcs import transport
+import_time = time.perf_counter() - start_time
+if {warm!r}:
+	transport.warm_up()
+time.sleep({startup_work!r})  # rest of the application's startup
+start_time = time.perf_counter()
+SparcCalc('CCC').data_request_handler({{'chemical': 'CCC', 'calc': 'sparc', 'props': ['water_sol'], 'ph': 7.0}})
+first_request = time.perf_counter() - start_time
+print(json.dumps({{'import_ms': 1e3 * import_time, 'first_request_ms': 1e3 * first_request}}))
+"""
+
+MODES = [
+	('eager', True, False),
+	('lazy', False, False),
+	('warm', False, True),
+]
+
+
+def run_child(base_url, eager, warm, startup_work):
+	env = dict(os.environ, CTS_SPARC_SERVER=base_url, CTS_JCHEM_SERVER=base_url, CTS_EFS_SERVER=base_url)
+	env.pop('CTS_WARM_UP', None)
+	code = CHILD.format(root=ROOT, eager=eager, warm=warm, startup_work=startup_work)
+	output = subprocess.check_output([sys.executable, '-c', code], env=env)
+	return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--runs', type=int, default=7)
+	parser.add_argument('--handshake-latency', type=float, default=0.15, help="per-connection delay (s)")
+	parser.add_argument('--startup-work', type=float, default=0.3, help="seconds between import and first request")
+	parser.add_argument('--budget', default=BUDGET_PATH)
+	parser.add_argument('--save-budget', action='store_true', help="write measured medians (with headroom) as budget")
+	parser.add_argument('--headroom', type=float, default=1.5)
+	args = parser.parse_args()
+
+	server, base_url = start_standin(latency=0.01, jitter=0.0, handshake_latency=args.handshake_latency)
+	results = {}
+	print("{:<8} {:>12} {:>18}".format('mode', 'import', 'first request'))
+	for name, eager, warm in MODES:
+		runs = [run_child(base_url, eager, warm, args.startup_work) for _ in range(args.runs)]
+		results[name] = dict((key, statistics.median(run[key] for run in runs)) for key in runs[0])
+		print("{:<8} {:>9.1f} ms {:>15.1f} ms".format(name, results[name]['import_ms'], results[name]['first_request_ms']))
+	server.shutdown()
+
+	measured = {'import_ms': results['lazy']['import_ms'], 'first_request_ms': results['warm']['first_request_ms']}
+	if args.save_budget:
+		budget = dict((key, round(value * args.headroom, 1)) for key, value in measured.items())
+		with open(args.budget, 'w') as budget_file:
+			json.dump(budget, budget_file, indent=2, sort_keys=True)
+		print("budget saved to {}: {}".format(args.budget, budget))
+		return
+	if not os.path.exists(args.budget):
+		return
+	with open(args.budget) as budget_file:
+		budget = json.load(budget_file)
+	over = ["{} {:.1f} ms > budget {:.1f} ms".format(key, measured[key], limit)
+		for key, limit in sorted(budget.items()) if measured.get(key, 0) > limit]
+	for message in over:
+		print("OVER BUDGET " + message)
+	if over:
+		sys.exit(1)
+	print("within budget {}".format(budget))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,185 @@
+"""
+Response fixtures shaped like SPARC, JChem WS and CTSWS responses.
+
+Used by the stand-in backend server and the benchmarks. Builders are
+deterministic for a given size so timings compare across runs.
+"""
+
+import base64
+import random
+
+
+def fake_image(seed, size=6000):
+	"""
+	Base64 string the size of a typical structure png.
+	"""
+	rng = random.Random(seed)
+	return base64.b64encode(bytes(rng.getrandbits(8) for _ in range(size))).decode('ascii')
+
+
+def ph_range(step=0.1, upper=14.0):
+	return [round(i * step, 1) for i in range(int(upper / step) + 1)]
+
+
+def structure_data(smiles):
+	return {'structure': smiles, 'format': 'smiles'}
+
+
+##### SPARC #####
+
+SPARC_MULTI_TYPES = [
+	('VAPOR_PRESSURE', 3.2e-2), ('BOILING_POINT', 98.4), ('WATER_DIFFUSION', 8.1e-6),
+	('AIR_DIFFUSION', 7.2e-2), ('VOLUME', 101.3), ('DENSITY', 0.93), ('POLARIZABLITY', 10.4),
+	('INDEX_OF_REFRACTION', 1.41), ('HENRYS_CONSTANT', 1.3e-3), ('SOLUBILITY', 1540.0),
+	('ACTIVITY', 2.1), ('ELECTRON_AFFINITY', 0.4), ('DISTRIBUTION', 2.34)
+]
+
+
+def sparc_multi_response(smiles='CCC'):
+	return {
+		'smiles': smiles,
+		'type': 'MULTIPLE_PROPERTY',
+		'calculationResults': [
+			{'type': sparc_type, 'result': value, 'units': 'dummy', 'messages': []}
+			for sparc_type, value in SPARC_MULTI_TYPES
+		]
+	}
+
+
+def sparc_pka_response(n_pka=3):
+	rng = random.Random(n_pka)
+	return {
+		'type': 'FULL_SPECIATION',
+		'macroPkaResults': [
+			{'macroPkaType': rng.choice(['Acid', 'Base', 'Both']), 'macroPka': round(rng.uniform(0, 14), 2)}
+			for _ in range(n_pka)
+		] + [{'macroPkaType': 'Acid', 'macroPka': -1000}],
+		'plotCoordinates': [[ph, rng.random()] for ph in ph_range(0.5)]
+	}
+
+
+def sparc_logd_response():
+	return {
+		'type': 'LOGD',
+		'plotCoordinates': [[ph, round(2.0 - 0.1 * ph, 3)] for ph in ph_range()]
+	}
+
+
+##### JChem WS #####
+
+def jchem_pka_response(n_microspecies=4, image_size=6000):
+	rng = random.Random(n_microspecies)
+	return {
+		'mostAcidic': [round(rng.uniform(0, 7), 2) for _ in range(2)],
+		'mostBasic': [round(rng.uniform(7, 14), 2) for _ in range(2)],
+		'result': {'image': {'image': fake_image(0, image_size)}, 'structureData': structure_data('CC(O)=O')},
+		'microspecies': [
+			{'key': 'microspecies{}'.format(i + 1), 'image': {'image': fake_image(i + 1, image_size)}, 'structureData': structure_data('CC([O-])=O')}
+			for i in range(n_microspecies)
+		],
+		'chartData': [
+			{'key': 'microspecies{}'.format(i + 1), 'values': [{'pH': ph, 'concentration': rng.random()} for ph in ph_range()]}
+			for i in range(n_microspecies)
+		]
+	}
+
+
+def jchem_isoelectric_response():
+	return {
+		'isoelectricPoint': 5.42,
+		'chartData': {'values': [{'pH': ph, 'charge': round(1.0 - ph / 7.0, 3)} for ph in ph_range()]}
+	}
+
+
+def jchem_tautomer_response(n_tautomers=10, image_size=6000):
+	weights = [1.0 / (i + 1) for i in range(n_tautomers)]
+	total = sum(weights)
+	return {
+		'result': [
+			{
+				'image': {'image': fake_image(i, image_size)},
+				'structureData': structure_data('CC(O)=CC{}'.format(i)),
+				'dominantTautomerDistribution': weights[i] / total
+			}
+			for i in range(n_tautomers)
+		]
+	}
+
+
+def jchem_stereoisomer_response(n_stereoisomers=8, image_size=6000):
+	return {
+		'result': [
+			{'image': {'image': fake_image(i, image_size)}, 'structureData': structure_data('C[C@H](O)CC{}'.format(i))}
+			for i in range(n_stereoisomers)
+		]
+	}
+
+
+def jchem_solubility_response():
+	return {
+		'intrinsicSolubility': 1.54,
+		'pHDependentSolubility': {'values': [{'pH': ph, 'solubility': 1.54} for ph in ph_range()]}
+	}
+
+
+def jchem_logp_response():
+	return {'logpnonionic': 2.31}
+
+
+def jchem_logd_response():
+	return {'chartData': {'values': [{'pH': ph, 'logD': round(2.3 - 0.05 * ph, 3)} for ph in ph_range()]}}
+
+
+def jchem_elemental_response():
+	return {'composition': ['C (81.71%)', 'H (18.29%)']}
+
+
+def jchem_detail_response(smiles='CCC', image_size=6000):
+	return {
+		'data': [{
+			'formula': 'C3H8',
+			'iupac': 'propane',
+			'mass': 44.097,
+			'exactMass': 44.0626,
+			'smiles': smiles,
+			'preferredName': 'propane',
+			'structureData': {'structure': smiles},
+			'image': {'image': fake_image(smiles, image_size), 'width': 100, 'height': 100}
+		}]
+	}
+
+
+def jchem_error_response():
+	return {'errorMessage': "Cannot parse molecule", 'errorCode': 3}
+
+
+##### CTSWS #####
+
+def ctsws_standardizer_response(smiles='CCC'):
+	return {'results': [smiles, smiles]}
+
+
+def ctsws_isvalid_response(valid=True):
+	return {'result': "true" if valid else "false"}
+
+
+# path suffix: response builder, for the stand-in server
+ENDPOINT_RESPONSES = {
+	'/sparc-integration/rest/calc/multiProperty': sparc_multi_response,
+	'/sparc-integration/rest/calc/fullSpeciation': sparc_pka_response,
+	'/sparc-integration/rest/calc/logd': sparc_logd_response,
+	'/webservices/rest-v0/util/calculate/pKa': jchem_pka_response,
+	'/webservices/rest-v0/util/calculate/isoelectricPoint': jchem_isoelectric_response,
+	'/webservices/rest-v0/util/calculate/majorMicrospecies': lambda: {'result': jchem_pka_response(1)['result']},
+	'/webservices/rest-v0/util/calculate/tautomerization': jchem_tautomer_response,
+	'/webservices/rest-v0/util/calculate/stereoisomer': jchem_stereoisomer_response,
+	'/webservices/rest-v0/util/calculate/solubility': jchem_solubility_response,
+	'/webservices/rest-v0/util/calculate/logP': jchem_logp_response,
+	'/webservices/rest-v0/util/calculate/logD': jchem_logd_response,
+	'/webservices/rest-v0/util/calculate/elementalAnalysis': jchem_elemental_response,
+	'/webservices/rest-v0/util/calculate/molExport': lambda: {'structure': 'CCC'},
+	'/webservices/rest-v0/util/detail': jchem_detail_response,
+	'/webservices/rest-v0/util/analyze': lambda: {'type': 'smiles'},
+	'/ctsws/rest/standardizer': ctsws_standardizer_response,
+	'/ctsws/rest/isvalidchemical': ctsws_isvalid_response,
+}
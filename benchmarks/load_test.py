@@ -0,0 +1,411 @@
+"""
+Load generator replaying a p-chem request mix against stand-in backends.
+
+Each log entry has the shape of test_class.main's params dict,
+{"chemical", "calc", "props" (or "prop"), "ph", "method"}, one JSON
+object per line (or a JSON list). SPARC entries go through
+SparcCalc.data_request_handler, chemaxon entries through
+JchemProperty.getJchemPropData (one call per prop). Without --log, a
+synthetic mix is generated (--save-log writes it out for reuse).
+
+Open loop, a fixed arrival rate whatever the response times (latency
+is measured from each request's scheduled start, so a backlog shows up
+as latency instead of a lower offered rate):
+
+	python benchmarks/load_test.py --rate 50 --duration 20
+
+Closed loop, a fixed number of callers each waiting for its response:
+
+	python benchmarks/load_test.py --concurrency 16 --duration 20
+
+The stand-in server runs in this process unless --target points at one
+started separately (python benchmarks/standin_server.py --port 8099),
+which keeps its work off the load generator's GIL at higher rates.
+
+Reports achieved throughput, latency percentiles and error rate per
+request kind, upstream requests per entry, and backend saturation:
+limiter slots in use vs. the AIMD limit and slot queue depth, sampled
+while the load runs.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from standin_server import start_standin
+
+SPARC_MULTI_PROPS = ["water_sol", "vapor_press", "henrys_law_con", "mol_diss", "boiling_point"]
+
+# (weight, request template) for the synthetic mix
+DEFAULT_MIX = [
+	(30, {'calc': 'sparc', 'props': SPARC_MULTI_PROPS}),
+	(10, {'calc': 'sparc', 'prop': 'ion_con'}),
+	(10, {'calc': 'sparc', 'prop': 'kow_wph'}),
+	(15, {'calc': 'chemaxon', 'props': ['water_sol']}),
+	(15, {'calc': 'chemaxon', 'props': ['ion_con']}),
+	(10, {'calc': 'chemaxon', 'props': ['kow_no_ph'], 'method': 'KLOP'}),
+	(10, {'calc': 'chemaxon', 'props': ['kow_wph'], 'method': 'KLOP'}),
+]
+
+ERROR_DATA = ["request timed out", "calc server not found", "prop not supported", "error filtering chemical"]
+
+
+
+def synthetic_chemicals(count):
+	"""
+	Returns count distinct SMILES (alkanes, alcohols, amines, alkylbenzenes).
+	"""
+	patterns = ['{}', '{}O', '{}N', 'c1ccccc1{}']
+	chemicals = []
+	for length in itertools.count(1):
+		for pattern in patterns:
+			chemicals.append(pattern.format('C' * length))
+			if len(chemicals) == count:
+				return chemicals
+
+
+def synthetic_log(size, chemicals=200, seed=0, ph_values=(7.0,)):
+	"""
+	Returns size request entries drawn from DEFAULT_MIX, with chemical
+	popularity falling off as 1/rank like a production mix.
+	"""
+	rng = random.Random(seed)
+	pool = synthetic_chemicals(chemicals)
+	popularity = [1.0 / rank for rank in range(1, len(pool) + 1)]
+	weights = [weight for weight, _ in DEFAULT_MIX]
+	log = []
+	for _ in range(size):
+		template = rng.choices([template for _, template in DEFAULT_MIX], weights)[0]
+		entry = dict(template, chemical=rng.choices(pool, popularity)[0], ph=rng.choice(ph_values))
+		log.append(entry)
+	return log
+
+
+def load_log(path):
+	with open(path) as log_file:
+		text = log_file.read().strip()
+	if text.startswith('['):
+		return json.loads(text)
+	return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def save_log(log, path):
+	with open(path, 'w') as log_file:
+		for entry in log:
+			log_file.write(json.dumps(entry) + '\n')
+
+
+def entry_kind(entry):
+	props = entry.get('props') or [entry.get('prop')]
+	return "{}:{}".format(entry['calc'], props[0] if len(props) == 1 else 'multi')
+
+
+
+def response_error(data_objs):
+	"""
+	Returns the first error in a calculator response, or None.
+	"""
+	if data_objs is None:
+		return "no response"
+	if isinstance(data_objs, dict):
+		data_objs = [data_objs]
+	for data_obj in data_objs:
+		data = data_obj.get('data')
+		if data is None:
+			return "no data"
+		if isinstance(data, str) and data in ERROR_DATA:
+			return data
+	return None
+
+
+def run_entry(entry, use_cache=True):
+	"""
+	Runs one log entry through its calculator. Returns error or None.
+	"""
+	from cts_calcs.calculator_sparc import SparcCalc
+	from cts_calcs.jchem_properties import JchemProperty
+	if entry['calc'] == 'sparc':
+		calc = SparcCalc(entry['chemical'])
+		calc.use_cache = use_cache
+		return response_error(calc.data_request_handler(dict(entry)))
+	if entry['calc'] == 'chemaxon':
+		for prop in entry.get('props') or [entry.get('prop')]:
+			calc = JchemProperty()
+			calc.use_cache = use_cache
+			request_dict = dict(entry, prop=prop)
+			request_dict.pop('props', None)
+			error = response_error(calc.getJchemPropData(request_dict))
+			if error:
+				return error
+		return None
+	return "calc {} not replayed".format(entry['calc'])
+
+
+
+class Results(object):
+	"""
+	Latencies and errors per request kind.
+	"""
+
+	def __init__(self):
+		self.latencies = collections.defaultdict(list)
+		self.errors = collections.defaultdict(collections.Counter)
+		self._lock = threading.Lock()
+
+	def record(self, kind, latency, error):
+		with self._lock:
+			self.latencies[kind].append(latency)
+			if error:
+				self.errors[kind][error] += 1
+
+	def count(self):
+		return sum(len(latencies) for latencies in self.latencies.values())
+
+
+
+def timed_entry(entry, results, scheduled, use_cache):
+	try:
+		error = run_entry(entry, use_cache)
+	except Exception as e:
+		error = "{}: {}".format(type(e).__name__, e)
+	results.record(entry_kind(entry), time.time() - scheduled, error)
+
+
+def open_loop(log, rate, duration, max_requests, results, use_cache, poisson=False, max_workers=256, seed=0):
+	"""
+	Starts entries at rate per second, each on a pool thread,
+	regardless of how many are still running.
+	"""
+	rng = random.Random(seed)
+	entries = itertools.cycle(log)
+	start_time = time.time()
+	scheduled = start_time
+	futures = []
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+		for index in itertools.count():
+			if scheduled - start_time >= duration or (max_requests and index >= max_requests):
+				break
+			delay = scheduled - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			futures.append(executor.submit(timed_entry, next(entries), results, scheduled, use_cache))
+			scheduled += rng.expovariate(rate) if poisson else 1.0 / rate
+	return time.time() - start_time
+
+
+def closed_loop(log, concurrency, duration, max_requests, results, use_cache):
+	"""
+	Runs concurrency callers, each starting its next entry as soon as
+	the previous one returns.
+	"""
+	entries = itertools.cycle(log)
+	counter = itertools.count()
+	lock = threading.Lock()
+	start_time = time.time()
+	end_time = start_time + duration
+
+	def caller():
+		while time.time() < end_time:
+			with lock:
+				index, entry = next(counter), next(entries)
+			if max_requests and index >= max_requests:
+				return
+			timed_entry(entry, results, time.time(), use_cache)
+
+	threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return time.time() - start_time
+
+
+
+class SaturationSampler(object):
+	"""
+	Samples every backend limiter's slots in use, limit and queue
+	depth while the load runs.
+	"""
+
+	def __init__(self, interval=0.1):
+		self.interval = interval
+		self.samples = collections.defaultdict(list)  # backend: [(inflight, limit, depth)]
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self.run)
+		self._thread.daemon = True
+
+	def run(self):
+		from cts_calcs.limiter import backend_stats
+		while not self._stop.wait(self.interval):
+			for stats in backend_stats():
+				depth = sum(queue_stats['depth'] for queue_stats in stats['priorities'].values())
+				self.samples[stats['backend']].append((stats['inflight'], stats['limit'], depth))
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def report(self):
+		from cts_calcs.limiter import backend_stats
+		timed_out = dict((stats['backend'], sum(queue_stats['timed_out'] for queue_stats in stats['priorities'].values()))
+			for stats in backend_stats())
+		report = {}
+		for backend, samples in self.samples.items():
+			if not samples:
+				continue
+			report[backend] = {
+				'utilization': sum(min(1.0, inflight / max(1, int(limit))) for inflight, limit, _ in samples) / len(samples),
+				'saturated': sum(1 for inflight, limit, _ in samples if inflight >= int(limit)) / float(len(samples)),
+				'mean_limit': sum(limit for _, limit, _ in samples) / len(samples),
+				'mean_queue_depth': sum(depth for _, _, depth in samples) / float(len(samples)),
+				'max_queue_depth': max(depth for _, _, depth in samples),
+				'slot_timeouts': timed_out.get(backend, 0),
+			}
+		return report
+
+
+
+def percentile(values, pct):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def summarize(latencies, errors, elapsed):
+	count = len(latencies)
+	error_count = sum(errors.values())
+	return {
+		'requests': count,
+		'throughput': count / elapsed if elapsed else 0.0,
+		'p50': percentile(latencies, 50),
+		'p90': percentile(latencies, 90),
+		'p99': percentile(latencies, 99),
+		'max': max(latencies),
+		'error_rate': error_count / float(count),
+		'errors': dict(errors.most_common(3)),
+	}
+
+
+def upstream_counts():
+	"""
+	Returns {status: count} of upstream responses so far (see metrics).
+	"""
+	from cts_calcs import metrics
+	counts = collections.Counter()
+	for _, _, labels, value in metrics.UPSTREAM_RESPONSES.samples():
+		counts[str(labels[-1])] += value
+	return counts
+
+
+def build_report(results, elapsed, saturation, upstream):
+	all_latencies = [latency for latencies in results.latencies.values() for latency in latencies]
+	all_errors = collections.Counter()
+	for errors in results.errors.values():
+		all_errors.update(errors)
+	return {
+		'elapsed': elapsed,
+		'overall': summarize(all_latencies, all_errors, elapsed),
+		'kinds': dict((kind, summarize(latencies, results.errors[kind], elapsed))
+			for kind, latencies in sorted(results.latencies.items())),
+		'upstream': {
+			'responses': dict(upstream),
+			'per_entry': sum(upstream.values()) / float(len(all_latencies)),
+		},
+		'backends': saturation,
+	}
+
+
+def print_report(report, label):
+	print("{}: {:.1f}s".format(label, report['elapsed']))
+	print("{:<22} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7}".format(
+		'kind', 'requests', 'req/s', 'p50', 'p90', 'p99', 'max', 'errors'))
+	rows = sorted(report['kinds'].items()) + [('all', report['overall'])]
+	for kind, summary in rows:
+		print("{:<22} {:>8} {:>9.1f} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>6.1%}".format(
+			kind, summary['requests'], summary['throughput'], summary['p50'], summary['p90'],
+			summary['p99'], summary['max'], summary['error_rate']))
+	for kind, summary in rows:
+		if summary['errors']:
+			print("  {} errors: {}".format(kind, summary['errors']))
+	print("upstream responses: {} ({:.2f} per entry)".format(report['upstream']['responses'], report['upstream']['per_entry']))
+	for backend, stats in sorted(report['backends'].items()):
+		print("backend {}: {:.0%} of slots in use, saturated {:.0%} of the time, mean limit {:.1f}, "
+			"queue depth mean {:.1f} max {}, slot timeouts {}".format(backend, stats['utilization'], stats['saturated'],
+			stats['mean_limit'], stats['mean_queue_depth'], stats['max_queue_depth'], stats['slot_timeouts']))
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	mode = parser.add_mutually_exclusive_group(required=True)
+	mode.add_argument('--rate', type=float, help="open loop: requests started per second")
+	mode.add_argument('--concurrency', type=int, help="closed loop: concurrent callers")
+	parser.add_argument('--log', help="request log (JSON lines or JSON list); synthetic mix if not given")
+	parser.add_argument('--save-log', help="write the synthetic log here")
+	parser.add_argument('--log-size', type=int, default=1000)
+	parser.add_argument('--chemicals', type=int, default=200, help="distinct chemicals in the synthetic log")
+	parser.add_argument('--duration', type=float, default=10.0)
+	parser.add_argument('--requests', type=int, default=0, help="stop after this many entries")
+	parser.add_argument('--poisson', action='store_true', help="open loop: exponential inter-arrival times")
+	parser.add_argument('--max-workers', type=int, default=256, help="open loop: threads for in-flight entries")
+	parser.add_argument('--no-cache', action='store_true', help="skip the result cache, so every entry reaches a backend")
+	parser.add_argument('--target', help="url of a stand-in server already running")
+	parser.add_argument('--latency', type=float, default=0.05)
+	parser.add_argument('--jitter', type=float, default=0.01)
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	parser.add_argument('--tail-rate', type=float, default=0.0)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--json', help="write the report here as JSON")
+	args = parser.parse_args()
+
+	server = None
+	base_url = args.target
+	if not base_url:
+		server, base_url = start_standin(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+			tail_rate=args.tail_rate, seed=args.seed)
+	for name in ('CTS_SPARC_SERVER', 'CTS_JCHEM_SERVER', 'CTS_EFS_SERVER'):
+		os.environ[name] = base_url
+
+	log = load_log(args.log) if args.log else synthetic_log(args.log_size, args.chemicals, args.seed)
+	if args.save_log:
+		save_log(log, args.save_log)
+
+	results = Results()
+	upstream_before = upstream_counts()
+	sampler = SaturationSampler().start()
+	if args.rate:
+		label = "open loop at {:g} req/s".format(args.rate)
+		elapsed = open_loop(log, args.rate, args.duration, args.requests, results, not args.no_cache,
+			args.poisson, args.max_workers, args.seed)
+	else:
+		label = "closed loop with {} callers".format(args.concurrency)
+		elapsed = closed_loop(log, args.concurrency, args.duration, args.requests, results, not args.no_cache)
+	sampler.stop()
+	upstream = upstream_counts()
+	upstream.subtract(upstream_before)
+
+	if not results.count():
+		print("no requests completed")
+		return
+	report = build_report(results, elapsed, sampler.report(), +upstream)
+	print_report(report, label)
+	if args.json:
+		with open(args.json, 'w') as report_file:
+			json.dump(report, report_file, indent=2, sort_keys=True)
+	if server:
+		server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,185 @@
+"""
+Fault-injecting stand-in for the SPARC, JChem WS and CTSWS backends.
+
+Serves fixture responses for every endpoint the calculators call, with
+configurable latency, slow-tail, 5xx and hang rates, plus an optional
+handshake delay on each new connection (standing in for TLS setup). Responses are
+gzipped for clients that accept it (unless --no-gzip), and gzipped
+request bodies are accepted. Run it standalone:
+
+	python benchmarks/standin_server.py --port 8181 --tail-rate 0.05 --tail-latency 2.0
+
+or in-process with start_standin(), which returns (server, base_url).
+Point CTS_JCHEM_SERVER/CTS_EFS_SERVER (and SparcCalc.base_url) at it.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+	from . import fixtures
+except ImportError:
+	import fixtures
+
+
+
+class Faults(object):
+	"""
+	Latency and failure injection settings.
+	"""
+
+	def __init__(self, latency=0.02, jitter=0.01, tail_rate=0.0, tail_latency=1.0, error_rate=0.0, hang_rate=0.0, hang_latency=30.0, seed=None, handshake_latency=0.0):
+		self.latency = latency
+		self.jitter = jitter
+		self.tail_rate = tail_rate
+		self.tail_latency = tail_latency
+		self.error_rate = error_rate
+		self.hang_rate = hang_rate
+		self.hang_latency = hang_latency
+		self.handshake_latency = handshake_latency
+		self.rng = random.Random(seed)
+		self.lock = threading.Lock()
+
+	def draw(self):
+		"""
+		Returns (delay seconds, status code) for one request.
+		"""
+		with self.lock:
+			roll = self.rng.random()
+			delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+		if roll < self.hang_rate:
+			return self.hang_latency, 200
+		if roll < self.hang_rate + self.error_rate:
+			return delay, 500
+		if roll < self.hang_rate + self.error_rate + self.tail_rate:
+			return self.tail_latency, 200
+		return delay, 200
+
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+	protocol_version = 'HTTP/1.1'
+
+	def setup(self):
+		BaseHTTPRequestHandler.setup(self)
+		time.sleep(self.server.faults.handshake_latency)  # once per connection
+
+	def do_HEAD(self):
+		# connection warm-up, answered without injected latency
+		self.send_response(200)
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+	def do_GET(self):
+		self.respond()
+
+	def do_POST(self):
+		self.respond()
+
+	def respond(self):
+		length = int(self.headers.get('Content-Length') or 0)
+		if length:
+			body = self.rfile.read(length)
+			if self.headers.get('Content-Encoding') == 'gzip':
+				gzip.decompress(body)
+		self.server.request_count += 1
+		delay, status = self.server.faults.draw()
+		time.sleep(delay)
+		path = self.path.split('?')[0]
+		builder = None
+		for suffix, endpoint_builder in fixtures.ENDPOINT_RESPONSES.items():
+			if path.endswith(suffix):
+				builder = endpoint_builder
+				break
+		if builder is None:
+			status, body = 404, {'error': "unknown endpoint {}".format(path)}
+		elif status != 200:
+			body = {'error': "injected failure"}
+		else:
+			body = self.server.cached_body(path, builder)
+		raw = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+		gzipped = self.server.gzip_responses and 'gzip' in (self.headers.get('Accept-Encoding') or '')
+		if gzipped:
+			raw = self.server.gzipped_body(raw)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		if gzipped:
+			self.send_header('Content-Encoding', 'gzip')
+		self.send_header('Content-Length', str(len(raw)))
+		self.end_headers()
+		self.wfile.write(raw)
+
+	def log_message(self, format, *args):
+		pass
+
+
+
+class StandinServer(ThreadingHTTPServer):
+
+	daemon_threads = True
+
+	def __init__(self, address, faults=None, gzip_responses=True):
+		ThreadingHTTPServer.__init__(self, address, StandinHandler)
+		self.faults = faults or Faults()
+		self.gzip_responses = gzip_responses
+		self.request_count = 0
+		self._bodies = {}
+		self._gzipped = {}
+
+	def cached_body(self, path, builder):
+		if path not in self._bodies:
+			self._bodies[path] = json.dumps(builder()).encode('utf-8')
+		return self._bodies[path]
+
+	def gzipped_body(self, raw):
+		if raw not in self._gzipped:
+			self._gzipped[raw] = gzip.compress(raw)
+		return self._gzipped[raw]
+
+
+
+def start_standin(port=0, gzip_responses=True, **fault_kwargs):
+	"""
+	Starts stand-in server in a background thread.
+	Returns (server, base_url).
+	"""
+	server = StandinServer(('127.0.0.1', port), Faults(**fault_kwargs), gzip_responses)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Fault-injecting stand-in for CTS calculator backends")
+	parser.add_argument('--port', type=int, default=8181)
+	parser.add_argument('--latency', type=float, default=0.02)
+	parser.add_argument('--jitter', type=float, default=0.01)
+	parser.add_argument('--tail-rate', type=float, default=0.0)
+	parser.add_argument('--tail-latency', type=float, default=1.0)
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	parser.add_argument('--hang-rate', type=float, default=0.0)
+	parser.add_argument('--handshake-latency', type=float, default=0.0)
+	parser.add_argument('--no-gzip', action='store_true')
+	parser.add_argument('--tautomers', type=int, default=10, help="structures in tautomerization responses")
+	parser.add_argument('--stereoisomers', type=int, default=8, help="structures in stereoisomer responses")
+	args = parser.parse_args()
+	fixtures.ENDPOINT_RESPONSES['/webservices/rest-v0/util/calculate/tautomerization'] = lambda: fixtures.jchem_tautomer_response(args.tautomers)
+	fixtures.ENDPOINT_RESPONSES['/webservices/rest-v0/util/calculate/stereoisomer'] = lambda: fixtures.jchem_stereoisomer_response(args.stereoisomers)
+	faults = Faults(args.latency, args.jitter, args.tail_rate, args.tail_latency, args.error_rate, args.hang_rate,
+		handshake_latency=args.handshake_latency)
+	server = StandinServer(('0.0.0.0', args.port), faults, not args.no_gzip)
+	print("stand-in backends on port {}".format(args.port))
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,167 @@
+"""
+Alias index from raw user inputs to filtered SMILES.
+
+Names, CAS numbers, MRV and SMILES variants of one compound all end up
+as the same filtered SMILES after SMILESFilter.filterSMILES or
+parseSmilesByCalculator. The index maps (raw input, filter path) to that
+final SMILES, and (name, CAS or MRV, conversion) to the SMILES that
+Calculator.convertToSMILES and get_smiles_from_name get from JChem, so
+repeat inputs skip the conversion and filter round trips, and so result
+caches downstream, which are keyed on filtered SMILES, see the same key
+for every variant. Like the result cache, the index is only read and
+written with CTS_RESULT_CACHE=1.
+
+With CTS_ALIAS_INDEX_PATH set the index is a sqlite file shared by
+processes and kept across restarts; otherwise it lives in memory. Either
+way it's bounded: entries expire after CTS_ALIAS_INDEX_TTL seconds (the
+filters behind them change with CTSWS and JChem releases), and past
+CTS_ALIAS_INDEX_MAX entries the least recently used are dropped. Raw
+inputs longer than MAX_RAW_LENGTH (MRV documents) are keyed by a hash.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TTL = int(os.environ.get('CTS_ALIAS_INDEX_TTL', 7 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('CTS_ALIAS_INDEX_MAX', 100000))
+MAX_RAW_LENGTH = 256
+PRUNE_EVERY = 64  # puts between expiry/size checks
+TOUCH_INTERVAL = 60  # seconds between last_used updates for an entry
+
+
+
+def raw_key(raw):
+	"""
+	Returns raw input, or a digest of it if it's long.
+	"""
+	if len(raw) <= MAX_RAW_LENGTH:
+		return raw
+	return 'blake2b:' + hashlib.blake2b(raw.encode('utf-8'), digest_size=20).hexdigest()
+
+
+
+class AliasIndex(object):
+	"""
+	Persistent (raw input, filter path) -> filtered SMILES map with
+	a TTL and an LRU size limit, that tracks its own hit rate.
+	"""
+
+	def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, prune_every=PRUNE_EVERY):
+		self.path = path or ':memory:'
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.prune_every = prune_every
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._puts = 0
+		self._lock = threading.Lock()
+		self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+		if self.path != ':memory:':
+			self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute(
+			"CREATE TABLE IF NOT EXISTS alias ("
+			"raw TEXT NOT NULL, filter_path TEXT NOT NULL, smiles TEXT NOT NULL, "
+			"PRIMARY KEY (raw, filter_path))"
+		)
+		# index files from before expiry get the columns with entries already expired:
+		columns = [row[1] for row in self.conn.execute("PRAGMA table_info(alias)")]
+		for column in ('created', 'last_used'):
+			if not column in columns:
+				self.conn.execute("ALTER TABLE alias ADD COLUMN {} REAL NOT NULL DEFAULT 0".format(column))
+		self.conn.execute("CREATE INDEX IF NOT EXISTS alias_last_used ON alias (last_used)")
+		self.conn.commit()
+
+	def get(self, raw, filter_path):
+		"""
+		Returns filtered SMILES for raw input, or None.
+		"""
+		if not isinstance(raw, str):
+			return None
+		key = raw_key(raw)
+		now = time.time()
+		with self._lock:
+			row = self.conn.execute(
+				"SELECT smiles, created, last_used FROM alias WHERE raw = ? AND filter_path = ?", (key, filter_path)
+			).fetchone()
+			if row is None or (self.ttl and row[1] + self.ttl < now):
+				self.misses += 1
+				return None
+			if now - row[2] > TOUCH_INTERVAL:
+				try:
+					self.conn.execute("UPDATE alias SET last_used = ? WHERE raw = ? AND filter_path = ?", (now, key, filter_path))
+					self.conn.commit()
+				except sqlite3.Error as e:
+					logging.warning("Could not write alias index: {}".format(e))
+			self.hits += 1
+			return row[0]
+
+	def put(self, raw, filter_path, smiles):
+		if not isinstance(raw, str) or not isinstance(smiles, str):
+			return
+		now = time.time()
+		try:
+			with self._lock:
+				self.conn.execute(
+					"INSERT OR REPLACE INTO alias (raw, filter_path, smiles, created, last_used) VALUES (?, ?, ?, ?, ?)",
+					(raw_key(raw), filter_path, smiles, now, now)
+				)
+				self._puts += 1
+				if self._puts % self.prune_every == 0:
+					self.prune(now)
+				self.conn.commit()
+		except sqlite3.Error as e:
+			logging.warning("Could not write alias index: {}".format(e))
+
+	def prune(self, now):
+		"""
+		Drops expired entries, then least recently used ones past
+		max_entries. Called with the lock held.
+		"""
+		if self.ttl:
+			self.evictions += self.conn.execute("DELETE FROM alias WHERE created < ?", (now - self.ttl,)).rowcount
+		size = self.conn.execute("SELECT COUNT(*) FROM alias").fetchone()[0]
+		if self.max_entries and size > self.max_entries:
+			self.evictions += self.conn.execute(
+				"DELETE FROM alias WHERE rowid IN (SELECT rowid FROM alias ORDER BY last_used LIMIT ?)",
+				(size - self.max_entries,)
+			).rowcount
+
+	def aliases(self, smiles):
+		"""
+		Returns [(raw, filter_path), ...] that map to smiles
+		(raw is hashed for long inputs, see raw_key).
+		"""
+		with self._lock:
+			return self.conn.execute("SELECT raw, filter_path FROM alias WHERE smiles = ?", (smiles,)).fetchall()
+
+	def stats(self):
+		total = self.hits + self.misses
+		with self._lock:
+			size = self.conn.execute("SELECT COUNT(*) FROM alias").fetchone()[0]
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_rate': float(self.hits) / total if total else 0.0,
+			'evictions': self.evictions,
+			'size': size
+		}
+
+
+
+_alias_index = None
+_alias_index_lock = threading.Lock()
+
+
+def get_alias_index():
+	global _alias_index
+	if _alias_index is None:
+		with _alias_index_lock:
+			if _alias_index is None:
+				_alias_index = AliasIndex(os.environ.get('CTS_ALIAS_INDEX_PATH'))
+	return _alias_index
@@ -0,0 +1,217 @@
+"""
+Content-addressed store for base64 structure images in results.
+
+Speciation, tautomer and stereoisomer results carry a base64 image per
+structure. With a blob store configured (CTS_BLOB_STORE="memory", or a
+file path for an on-disk store, or set_blob_store()), the jchem result
+getters swap each image string for an ImageHandle: the decoded bytes
+live once in the store (identical images are deduplicated by digest)
+and the handle resolves them lazily. str(handle) gives the base64 text
+back, so templates like imgTmpl2 work unchanged; resolve_images()
+converts a result back to plain strings before JSON serialization.
+
+MemoryBlobStore is bounded by max_bytes and spills least recently used
+blobs to an optional overflow store; without one, a full store takes no
+more blobs and those images stay inline strings. DiskBlobStore appends
+blobs to a file and reads them through mmap, so resident memory stays
+small. Processes can share its file: each appends under a file lock and
+indexes its own blobs. The file is never truncated, so remove it
+between runs.
+"""
+
+import base64
+import collections
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import threading
+
+
+
+class ImageHandle(object):
+	"""
+	Lightweight reference to an image in a blob store.
+	"""
+
+	__slots__ = ('store', 'digest', 'size')
+
+	def __init__(self, store, digest, size):
+		self.store = store
+		self.digest = digest
+		self.size = size
+
+	def bytes(self):
+		return self.store.get(self.digest)
+
+	def base64(self):
+		data = self.bytes()
+		return base64.b64encode(data).decode('ascii') if data is not None else None
+
+	def __str__(self):
+		return self.base64() or ''
+
+	def __repr__(self):
+		return "<ImageHandle {} ({} bytes)>".format(self.digest[:12], self.size)
+
+	def __eq__(self, other):
+		return isinstance(other, ImageHandle) and other.digest == self.digest
+
+	def __hash__(self):
+		return hash(self.digest)
+
+
+
+class MemoryBlobStore(object):
+	"""
+	Size-bounded in-memory blob store. put() returns None for a blob
+	that doesn't fit, unless there's an overflow store to evict to.
+	"""
+
+	def __init__(self, max_bytes=256 * 1024 * 1024, overflow=None):
+		self.max_bytes = max_bytes
+		self.overflow = overflow
+		self.total_bytes = 0
+		self._blobs = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def put(self, data):
+		digest = hashlib.sha1(data).hexdigest()
+		with self._lock:
+			if digest in self._blobs:
+				self._blobs.move_to_end(digest)
+				return digest
+			if self.overflow is None and self.total_bytes + len(data) > self.max_bytes:
+				# evicting would break handles already given out
+				logging.warning("Blob store full, keeping image {} inline".format(digest))
+				return None
+			self._blobs[digest] = data
+			self.total_bytes += len(data)
+			while self.total_bytes > self.max_bytes and len(self._blobs) > 1:
+				_, evicted = self._blobs.popitem(last=False)
+				self.total_bytes -= len(evicted)
+				self.overflow.put(evicted)
+		return digest
+
+	def get(self, digest):
+		with self._lock:
+			data = self._blobs.get(digest)
+			if data is not None:
+				self._blobs.move_to_end(digest)
+				return data
+		if self.overflow is not None:
+			return self.overflow.get(digest)
+		return None
+
+	def __len__(self):
+		return len(self._blobs)
+
+
+
+class DiskBlobStore(object):
+	"""
+	Append-only blob file read through mmap. Only the
+	digest -> (offset, length) index is held in memory.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._index = {}
+		self._lock = threading.Lock()
+		self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+		self._mmap = None
+
+	def put(self, data):
+		digest = hashlib.sha1(data).hexdigest()
+		with self._lock:
+			if digest in self._index:
+				return digest
+			fcntl.flock(self._fd, fcntl.LOCK_EX)  # other processes append to the same file
+			try:
+				offset = os.fstat(self._fd).st_size
+				written = 0
+				while written < len(data):
+					written += os.write(self._fd, data[written:])
+			finally:
+				fcntl.flock(self._fd, fcntl.LOCK_UN)
+			self._index[digest] = (offset, len(data))
+		return digest
+
+	def get(self, digest):
+		with self._lock:
+			location = self._index.get(digest)
+			if location is None:
+				return None
+			offset, length = location
+			if self._mmap is None or len(self._mmap) < offset + length:
+				# remaps after the file has grown past the current map
+				if self._mmap is not None:
+					self._mmap.close()
+				self._mmap = mmap.mmap(self._fd, os.fstat(self._fd).st_size, access=mmap.ACCESS_READ)
+			return self._mmap[offset:offset + length]
+
+	def close(self):
+		with self._lock:
+			if self._mmap is not None:
+				self._mmap.close()
+			os.close(self._fd)
+
+	def __len__(self):
+		return len(self._index)
+
+
+
+def store_image(store, image):
+	"""
+	Puts base64 image string in store, returns its ImageHandle
+	(or the string itself if the store can't take it).
+	"""
+	if store is None or not isinstance(image, str):
+		return image
+	data = base64.b64decode(image)
+	digest = store.put(data)
+	if digest is None:
+		return image
+	return ImageHandle(store, digest, len(data))
+
+
+def resolve_images(obj):
+	"""
+	Returns copy of result (dicts/lists) with ImageHandles
+	replaced by their base64 strings, e.g. for json.dumps.
+	"""
+	if isinstance(obj, ImageHandle):
+		return obj.base64()
+	if isinstance(obj, dict):
+		return dict((key, resolve_images(value)) for key, value in obj.items())
+	if isinstance(obj, list):
+		return [resolve_images(value) for value in obj]
+	return obj
+
+
+
+_blob_store = None
+_blob_store_configured = False
+
+
+def get_blob_store():
+	"""
+	Returns blob store from CTS_BLOB_STORE, or None if not configured.
+	"""
+	global _blob_store, _blob_store_configured
+	if not _blob_store_configured:
+		setting = os.environ.get('CTS_BLOB_STORE')
+		if setting == 'memory':
+			_blob_store = MemoryBlobStore(int(os.environ.get('CTS_BLOB_STORE_MAX_BYTES', 256 * 1024 * 1024)))
+		elif setting:
+			_blob_store = DiskBlobStore(setting)
+		_blob_store_configured = True
+	return _blob_store
+
+
+def set_blob_store(store):
+	global _blob_store, _blob_store_configured
+	_blob_store = store
+	_blob_store_configured = True
+	return store
@@ -0,0 +1,208 @@
+"""
+Shared result cache for CTS calculators.
+
+Caching is opt-in: calculators read through the cache only with
+CTS_RESULT_CACHE=1 (or with use_cache set on the calculator).
+
+Results are stored as zlib-compressed JSON under namespaced keys
+(e.g., "cts:sparc:<sha1 of request>") with a TTL. With REDIS_HOSTNAME
+set, the cache lives in Redis and is shared by every worker process
+and host; otherwise an in-process LocalCache is used. LocalCache
+implements the subset of the redis client API the cache needs, so it
+also serves as a Redis stand-in for local runs. With CTS_SHM_CACHE set,
+worker processes on a host share results through a shared-memory tier
+(see shm_cache), in front of Redis if that's configured too.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+
+DEFAULT_TTL = int(os.environ.get('CTS_CACHE_TTL', 86400))  # seconds
+DEFAULT_NAMESPACE = os.environ.get('CTS_CACHE_NAMESPACE', 'cts')
+
+
+
+def cache_enabled():
+	"""
+	Returns True if CTS_RESULT_CACHE=1, the default for calculators' use_cache.
+	"""
+	return os.environ.get('CTS_RESULT_CACHE', '0') == '1'
+
+
+
+class LocalCache(object):
+	"""
+	In-memory, size-bounded stand-in for a redis.StrictRedis client.
+	Supports get, set (with ex), delete, exists and flushdb.
+	"""
+
+	def __init__(self, max_entries=10000):
+		self.max_entries = max_entries
+		self._data = collections.OrderedDict()  # key: (value, expires_at)
+		self._lock = threading.Lock()
+
+	def get(self, name):
+		with self._lock:
+			item = self._data.get(name)
+			if item is None:
+				return None
+			value, expires_at = item
+			if expires_at and expires_at < time.time():
+				del self._data[name]
+				return None
+			self._data.move_to_end(name)
+			return value
+
+	def set(self, name, value, ex=None, nx=False):
+		with self._lock:
+			if nx and name in self._data:
+				return None
+			expires_at = time.time() + ex if ex else None
+			self._data[name] = (value, expires_at)
+			self._data.move_to_end(name)
+			while len(self._data) > self.max_entries:
+				self._data.popitem(last=False)  # evicts least recently used
+			return True
+
+	def delete(self, *names):
+		with self._lock:
+			deleted = 0
+			for name in names:
+				if self._data.pop(name, None) is not None:
+					deleted += 1
+			return deleted
+
+	def exists(self, name):
+		return self.get(name) is not None
+
+	def flushdb(self):
+		with self._lock:
+			self._data.clear()
+		return True
+
+
+
+class ResultCache(object):
+	"""
+	Stores compressed, serialized calculator results with TTLs
+	and namespaced keys in a redis (or redis-compatible) client.
+	"""
+
+	def __init__(self, client=None, namespace=DEFAULT_NAMESPACE, ttl=DEFAULT_TTL):
+		self.client = client if client is not None else LocalCache()
+		self.namespace = namespace
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+
+	def make_key(self, kind, *parts):
+		"""
+		Builds "<namespace>:<kind>:<digest>" key from request parts
+		(e.g., url and post data).
+		"""
+		hasher = hashlib.sha1()
+		for part in parts:
+			if not isinstance(part, str):
+				part = json.dumps(part, sort_keys=True, default=str)
+			hasher.update(part.encode('utf-8'))
+			hasher.update(b'\x00')
+		return "{}:{}:{}".format(self.namespace, kind, hasher.hexdigest())
+
+	def dumps(self, value):
+		return zlib.compress(json.dumps(value).encode('utf-8'))
+
+	def loads(self, raw):
+		return json.loads(zlib.decompress(raw).decode('utf-8'))
+
+	def get(self, key):
+		"""
+		Returns cached result or None. Backend errors and corrupt
+		entries (which are deleted) count as misses.
+		"""
+		try:
+			raw = self.client.get(key)
+		except Exception as e:
+			logging.warning("Exception reading result cache: {}".format(e))
+			raw = None
+		if raw is None:
+			self.misses += 1
+			return None
+		try:
+			value = self.loads(raw)
+		except (zlib.error, ValueError, TypeError) as e:
+			logging.warning("Corrupt result cache entry {}: {}".format(key, e))
+			self.delete(key)
+			self.misses += 1
+			return None
+		self.hits += 1
+		return value
+
+	def set(self, key, value, ttl=None):
+		try:
+			return self.client.set(key, self.dumps(value), ex=ttl or self.ttl)
+		except Exception as e:
+			logging.warning("Exception writing result cache: {}".format(e))
+			return False
+
+	def delete(self, key):
+		try:
+			return self.client.delete(key)
+		except Exception as e:
+			logging.warning("Exception deleting from result cache: {}".format(e))
+			return 0
+
+	def hit_rate(self):
+		total = self.hits + self.misses
+		return float(self.hits) / total if total else 0.0
+
+
+
+def get_redis_client():
+	"""
+	Returns redis client from REDIS_HOSTNAME/REDIS_PORT env vars,
+	or None if redis isn't configured or installed.
+	"""
+	redis_hostname = os.environ.get('REDIS_HOSTNAME')
+	if not redis_hostname:
+		return None
+	try:
+		import redis
+	except ImportError:
+		logging.warning("REDIS_HOSTNAME set but redis package not installed, using local cache.")
+		return None
+	redis_port = int(os.environ.get('REDIS_PORT', 6379))
+	return redis.StrictRedis(host=redis_hostname, port=redis_port, db=0)
+
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+	"""
+	Returns the process-wide ResultCache, created on first use.
+	"""
+	global _result_cache
+	if _result_cache is None:
+		with _result_cache_lock:
+			if _result_cache is None:
+				from .shm_cache import get_shm_client
+				_result_cache = ResultCache(get_shm_client(get_redis_client()))
+	return _result_cache
+
+
+def set_result_cache(cache):
+	"""
+	Swaps in a different ResultCache (e.g., ResultCache(LocalCache())).
+	"""
+	global _result_cache
+	_result_cache = cache
+	return cache
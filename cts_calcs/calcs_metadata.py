@@ -1,40 +1,34 @@
 """
 Metadata about calculators used by CTS.
+
+CALC_CAPABILITIES is built once at import and lists, for each calculator,
+which upstream endpoint serves which CTS p-chem prop, whether the prop
+is pH dependent, and which methods it accepts. CalcRouter uses it to
+plan the minimal set of upstream calls for a request and to reject
+unsupported props before any network I/O.
 """
 
-class MetaData:
-	def __init__(self):
-		self.model = ""
-		self.collection = ""
-		self.modelVersion = ""
-		self.description = ""
-		self.status = ""
-		self.timestamp = ""
-		self.url = ""
-		self.props = []
-		self.availableProps = []
-
-	def create_metadata_object(self, calc_info):
-		"""
-		Creates metadata object for calculator.
-		"""
-		
+import datetime
+import logging
 
+from .lazy_imports import lazy_import
 
+pytz = lazy_import('pytz')
 
 
-	'metaInfo': {
+# Calculator metaInfo (as served by cts_rest), minus the timestamp
+# which is generated when the metadata object is created.
+CALC_META_INFO = {
+	'chemaxon': {
 		'model': "chemaxon",
 		'collection': "qed",
 		'modelVersion': "Jchem Web Services 15.3.23.0",
 		'description': "Cheminformatics software platforms, applications, and services to optimize the value of chemistry information in life science and other R&D.",
 		'status': '',
-		'timestamp': gen_jid(),
 		'url': {
 			'type': "application/json",
 			'href': "http://qedinternal.epa.gov/cts/rest/chemaxon"
 		},
-		'props': ['water_sol', 'ion_con', 'kow_no_ph', 'kow_wph'],
 		'availableProps': [
 			{
 				'prop': 'water_sol',
@@ -58,4 +52,253 @@ class MetaData:
 				'methods': ['KLOP', 'PHYS', 'VG']
 			}
 		]
-	}
\ No newline at end of file
+	},
+	'sparc': {
+		'model': "sparc",
+		'collection': "qed",
+		'modelVersion': "SPARC Integration",
+		'description': "SPARC Performs Automated Reasoning in Chemistry, computes physicochemical properties from molecular structure.",
+		'status': '',
+		'url': {
+			'type': "application/json",
+			'href': "http://qedinternal.epa.gov/cts/rest/sparc"
+		},
+		'availableProps': [
+			{
+				'prop': 'boiling_point',
+				'units': 'degC',
+				'description': "boiling point"
+			},
+			{
+				'prop': 'water_sol',
+				'units': 'mg/L',
+				'description': "water solubility"
+			},
+			{
+				'prop': 'vapor_press',
+				'units': 'mmHg',
+				'description': "vapor pressure"
+			},
+			{
+				'prop': 'mol_diss',
+				'units': 'cm2/s',
+				'description': "molecular diffusivity in water"
+			},
+			{
+				'prop': 'mol_diss_air',
+				'units': 'cm2/s',
+				'description': "molecular diffusivity in air"
+			},
+			{
+				'prop': 'henrys_law_con',
+				'units': '(atm*m3)/mol',
+				'description': "Henry's law constant"
+			},
+			{
+				'prop': 'kow_no_ph',
+				'units': 'log',
+				'description': "Octanol/water partition coefficient"
+			},
+			{
+				'prop': 'ion_con',
+				'description': "pKa and pKb values"
+			},
+			{
+				'prop': 'kow_wph',
+				'units': 'log',
+				'description': "pH-dependent octanol/water partition coefficient"
+			}
+		]
+	}
+}
+
+
+# Upstream endpoints per calculator. 'props' are the CTS props an endpoint
+# serves, 'ph' marks pH-dependent props, 'methods' lists accepted methods.
+# Props sharing an endpoint are answered by a single upstream call. Only
+# endpoints the calculators actually call belong here: SparcCalc's
+# multiproperty_url, pka_url and logd_url, and the JchemProperty classes
+# getPropObject returns for CTS props (Solubility, Pka, LogP, LogD).
+CALC_ENDPOINTS = {
+	'sparc': [
+		{
+			'endpoint': '/sparc-integration/rest/calc/multiProperty',
+			'props': ['water_sol', 'vapor_press', 'henrys_law_con', 'mol_diss', 'mol_diss_air', 'boiling_point', 'kow_no_ph'],
+			'ph': False,
+			'methods': None
+		},
+		{
+			'endpoint': '/sparc-integration/rest/calc/fullSpeciation',
+			'props': ['ion_con'],
+			'ph': False,
+			'methods': None
+		},
+		{
+			'endpoint': '/sparc-integration/rest/calc/logd',
+			'props': ['kow_wph'],
+			'ph': True,
+			'methods': None
+		}
+	],
+	'chemaxon': [
+		{
+			'endpoint': '/webservices/rest-v0/util/calculate/solubility',
+			'props': ['water_sol', 'water_sol_ph'],
+			'ph': ['water_sol_ph'],
+			'methods': None
+		},
+		{
+			'endpoint': '/webservices/rest-v0/util/calculate/pKa',
+			'props': ['ion_con'],
+			'ph': False,
+			'methods': None
+		},
+		{
+			'endpoint': '/webservices/rest-v0/util/calculate/logP',
+			'props': ['kow_no_ph'],
+			'ph': False,
+			'methods': ['KLOP', 'VG', 'PHYS']
+		},
+		{
+			'endpoint': '/webservices/rest-v0/util/calculate/logD',
+			'props': ['kow_wph'],
+			'ph': True,
+			'methods': ['KLOP', 'VG', 'PHYS']
+		}
+	]
+}
+
+
+
+def build_capabilities(calc_endpoints):
+	"""
+	Builds {calc: {prop: capability}} lookup from endpoint listing,
+	where capability has keys: endpoint, ph, methods.
+	"""
+	capabilities = {}
+	for calc, endpoints in calc_endpoints.items():
+		calc_caps = capabilities.setdefault(calc, {})
+		for endpoint_info in endpoints:
+			ph_dependent = endpoint_info['ph']
+			for prop in endpoint_info['props']:
+				if isinstance(ph_dependent, list):
+					prop_ph = prop in ph_dependent
+				else:
+					prop_ph = bool(ph_dependent)
+				calc_caps[prop] = {
+					'endpoint': endpoint_info['endpoint'],
+					'ph': prop_ph,
+					'methods': endpoint_info['methods']
+				}
+	return capabilities
+
+
+CALC_CAPABILITIES = build_capabilities(CALC_ENDPOINTS)
+
+
+
+def is_supported(calc, prop, method=None, capabilities=None):
+	"""
+	Returns True if calc serves prop (and method, if given),
+	per capabilities (default CALC_CAPABILITIES).
+	"""
+	capability = (capabilities or CALC_CAPABILITIES).get(calc, {}).get(prop)
+	if not capability:
+		return False
+	if method and capability['methods'] and method not in capability['methods']:
+		return False
+	return True
+
+
+
+class CalcRouter(object):
+	"""
+	Splits a multi-prop, multi-calculator request into the
+	minimal set of upstream calls using capabilities
+	(default CALC_CAPABILITIES).
+	"""
+
+	def __init__(self, capabilities=None):
+		self.capabilities = capabilities or CALC_CAPABILITIES
+
+	def route(self, calc_props, method=None):
+		"""
+		Inputs:
+		calc_props - {calc: [props]} map of requested props
+		method - (optional) method for props that take one
+		Returns: (calls, rejected) where calls is a list of
+		{calc, endpoint, props, method} dicts, one per upstream call,
+		and rejected is a list of {calc, prop, data} error objects for
+		props no calculator endpoint serves.
+		"""
+		calls, rejected = [], []
+		for calc, props in calc_props.items():
+			calc_caps = self.capabilities.get(calc, {})
+			calc_calls = {}  # endpoint: call dict, keeps request order
+			for prop in props:
+				capability = calc_caps.get(prop)
+				if not capability or not is_supported(calc, prop, method, self.capabilities):
+					logging.info("{} does not serve prop {}, rejecting before request".format(calc, prop))
+					rejected.append({'calc': calc, 'prop': prop, 'data': "prop not supported"})
+					continue
+				endpoint = capability['endpoint']
+				if endpoint not in calc_calls:
+					calc_calls[endpoint] = {
+						'calc': calc,
+						'endpoint': endpoint,
+						'props': [],
+						'method': method if capability['methods'] else None
+					}
+				if prop not in calc_calls[endpoint]['props']:
+					calc_calls[endpoint]['props'].append(prop)
+			calls.extend(calc_calls.values())
+		return calls, rejected
+
+
+
+def gen_jid():
+	"""
+	Returns US/Eastern timestamp, as Calculator.gen_jid.
+	"""
+	ts = datetime.datetime.now(pytz.UTC)
+	return ts.astimezone(pytz.timezone('US/Eastern')).strftime('%Y%m%d%H%M%S%f')
+
+
+
+class MetaData(object):
+	def __init__(self):
+		self.model = ""
+		self.collection = ""
+		self.modelVersion = ""
+		self.description = ""
+		self.status = ""
+		self.timestamp = ""
+		self.url = ""
+		self.props = []
+		self.availableProps = []
+
+	def create_metadata_object(self, calc_info):
+		"""
+		Creates metadata object for calculator. calc_info is
+		either a calc name (e.g., "sparc") or a metaInfo dict.
+		"""
+		if not isinstance(calc_info, dict):
+			calc_info = CALC_META_INFO.get(calc_info, {})
+		for key in ['model', 'collection', 'modelVersion', 'description', 'status', 'url']:
+			setattr(self, key, calc_info.get(key, getattr(self, key)))
+		self.availableProps = list(calc_info.get('availableProps', []))
+		self.props = [prop_info['prop'] for prop_info in self.availableProps]
+		self.timestamp = gen_jid()
+		return {
+			'metaInfo': {
+				'model': self.model,
+				'collection': self.collection,
+				'modelVersion': self.modelVersion,
+				'description': self.description,
+				'status': self.status,
+				'timestamp': self.timestamp,
+				'url': self.url,
+				'props': self.props,
+				'availableProps': self.availableProps
+			}
+		}
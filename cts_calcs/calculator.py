@@ -2,19 +2,137 @@ __author__ = 'np'
 
 # from django.template import Template
 # from django.template import Context
-import requests
 import json
 import logging
-import os
 #import redis
 import datetime
-import pytz
+import time
+import types
+from .cache import get_result_cache, cache_enabled
+from . import transport
+from .endpoints import primary_url
+from .lazy_imports import lazy_import
+from . import deadline
+from .negative_cache import get_negative_cache
+from .alias_index import get_alias_index
+from . import metrics
+
+requests = lazy_import('requests')
+pytz = lazy_import('pytz')
+
+
+def thaw(template):
+	"""
+	Returns mutable copy of a read-only template
+	(mappings -> dicts, tuples -> lists).
+	"""
+	if isinstance(template, types.MappingProxyType):
+		return dict((key, thaw(value)) for key, value in template.items())
+	if isinstance(template, tuple):
+		return [thaw(value) for value in template]
+	return template
+
+
+
+class TemplateCopy(object):
+	"""
+	Read-only template shared by the class; an instance gets its own
+	mutable copy the first time it reads the attribute, so creating a
+	calculator doesn't rebuild every request/response template.
+	"""
+
+	def __init__(self, template):
+		self.template = template
+
+	def __set_name__(self, owner, name):
+		self.name = name
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self.template
+		value = thaw(self.template)
+		instance.__dict__[self.name] = value
+		return value
+
 
 
 class Calculator(object):
 	"""
 	Skeleton class for calculators
 	"""
+
+	# cts p-chem properties
+	pchem_props = TemplateCopy((
+		'boiling_point',
+		'melting_point',
+		'water_sol',
+		'vapor_press',
+		'mol_diss',
+		'ion_con',
+		'henrys_law_con',
+		'kow_no_ph',
+		'kow_wph',
+		'kow_ph',
+		'kow'
+	))
+
+	# cts chemical information dict
+	chemical_information = TemplateCopy(types.MappingProxyType({
+		'chemical': None,  # user-entered chemical (as-entered or drawn)
+		'orig_smiles': None,  # original conversion to SMILES
+		'smiles': None,  # SMILES after filtering, used for calculations
+		'formula': None,
+		'iupac': None,
+		'mass': None,
+		'structureData': None,  # drawn chemical structure format for MarvinSketch
+		'exactMass': None,
+	}))
+
+	# cts chemical information request
+	chemical_information_request = TemplateCopy(types.MappingProxyType({
+		'chemical': None,
+		'get_structure_data': False,
+	}))
+
+	# cts api data object for p-chem data request
+	data_obj = TemplateCopy(types.MappingProxyType({
+		'calc': None,
+		'prop': None,
+		'data': None,
+		'chemical': None,
+	}))
+
+	# cts p-chem request object with default key:vals.
+	# can handle list of props (ws) or single prop (cts api)
+	pchem_request = TemplateCopy(types.MappingProxyType({
+		'service': None,
+		'chemical': None,
+		'prop': None,
+		'sessionid': None,
+		'method': None,
+		'ph': 7.0,
+		'node': None,
+		'calc': None,
+		'run_type': None,
+		'workflow': None,
+		'mass': None,
+		'props': (),
+	}))
+
+	# cts p-chem response object with defaults, returns one prop per reponse
+	pchem_response = TemplateCopy(types.MappingProxyType({
+		'chemical': None,
+		'calc': None,
+		'prop': None,
+		'method': None,
+		'run_type': None,
+		'workflow': None,
+		'node': None,
+		'request_post': None,
+		'data': None,
+		'error': False,
+	}))
+
 	def __init__(self, calc=None):
 		self.name = ''
 		self.propMap = {}
@@ -29,12 +147,14 @@ class Calculator(object):
 
 		self.default_ph = 7.0
 
-		#self.redis_hostname = os.environ.get('REDIS_HOSTNAME')
-		#self.redis_port = os.environ.get('REDIS_PORT')
-		#self.redis_conn = redis.StrictRedis(host=self.redis_hostname, port=self.redis_port, db=0)
+		# shared result cache (redis if REDIS_HOSTNAME is set, else in-process),
+		# read through only when CTS_RESULT_CACHE=1:
+		self.result_cache = get_result_cache()
+		self.use_cache = cache_enabled()
 
-		self.jchem_server_url = os.environ.get('CTS_JCHEM_SERVER', 'localhost:8080')
-		self.efs_server_url = os.environ.get('CTS_EFS_SERVER', 'localhost:8080')
+		# primary server urls (requests are balanced across any replicas listed):
+		self.jchem_server_url = primary_url('CTS_JCHEM_SERVER', 'localhost:8080')
+		self.efs_server_url = primary_url('CTS_EFS_SERVER', 'localhost:8080')
 
 		# jchem ws urls:
 		self.export_endpoint = '/webservices/rest-v0/util/calculate/molExport'
@@ -46,78 +166,6 @@ class Calculator(object):
 		self.efs_metabolizer_endpoint = '/ctsws/rest/metabolizer'
 		self.efs_standardizer_endpoint = '/ctsws/rest/standardizer'
 
-		# cts p-chem properties
-		self.pchem_props = [
-			'boiling_point',
-			'melting_point',
-			'water_sol',
-			'vapor_press',
-			'mol_diss',
-			'ion_con',
-			'henrys_law_con',
-			'kow_no_ph',
-			'kow_wph',
-			'kow_ph',
-			'kow'
-		]
-
-		# cts chemical information dict
-		self.chemical_information = {
-			'chemical': None,  # user-entered chemical (as-entered or drawn)
-			'orig_smiles': None,  # original conversion to SMILES
-			'smiles': None,  # SMILES after filtering, used for calculations
-			'formula': None,
-			'iupac': None,
-			'mass': None,
-			'structureData': None,  # drawn chemical structure format for MarvinSketch
-			'exactMass': None,
-		}
-
-		# cts chemical information request
-		self.chemical_information_request = {
-			'chemical': None,
-			'get_structure_data': False,
-		}
-
-		# cts api data object for p-chem data request
-		self.data_obj = {
-			'calc': None,
-			'prop': None,
-			'data': None,
-			'chemical': None,
-		}
-
-		# cts p-chem request object with default key:vals.
-		# can handle list of props (ws) or single prop (cts api)
-		self.pchem_request = {
-			'service': None,
-			'chemical': None,
-			'prop': None,
-			'sessionid': None,
-			'method': None,
-			'ph': 7.0,
-			'node': None,
-			'calc': None,
-			'run_type': None,
-			'workflow': None,
-			'mass': None,
-			'props': [],
-		}
-
-		# cts p-chem response object with defaults, returns one prop per reponse
-		self.pchem_response = {
-			'chemical': None,
-			'calc': None,
-			'prop': None,
-			'method': None,
-			'run_type': None,
-			'workflow': None,
-			'node': None,
-			'request_post': None,
-			'data': None,
-			'error': False,
-		}
-
 
 	def getUrl(self, prop):
 		if prop in self.propMap:
@@ -173,6 +221,11 @@ class Calculator(object):
 
 		for calc in mp_request_calcs:
 
+			if deadline.expired():
+				# no time left for another lookup, carries on without MP
+				logging.warning("Skipping melting point lookups from {} onward, deadline passed".format(calc))
+				break
+
 			melting_point_request['calc'] = calc
 
 			logging.info("Requesting melting point from {}..".format(calc))
@@ -306,12 +359,20 @@ class Calculator(object):
 		Returns: SMILES string of chemical
 		"""
 		chemStruct = request_obj.get('chemical')  # chemical in <cml> format (marvin sketch)
+		alias_index = get_alias_index()
+		if self.use_cache:
+			indexed_smiles = alias_index.get(chemStruct, 'convertToSMILES')
+			if indexed_smiles is not None:
+				return {'structure': indexed_smiles, 'format': "smiles"}
 		data = {
 			"structure": chemStruct,
 			"parameters": "smiles"
 		}
 		url = self.jchem_server_url + self.export_endpoint
-		return self.web_call(url, data)  # get responset))
+		results = self.web_call(url, data)  # get responset))
+		if self.use_cache and isinstance(results, dict) and self.check_response_for_errors(results).get('valid'):
+			alias_index.put(chemStruct, 'convertToSMILES', results.get('structure'))
+		return results
 
 
 	def getStructInfo(self, structure):
@@ -371,7 +432,7 @@ class Calculator(object):
 		request_header = {'Content-Type': "*/*"}
 		response, results = None, None
 		try:
-			response = requests.post(url, data=chemical.encode('utf-8'), headers=request_header, timeout=self.request_timeout)
+			response = transport.post(url, data=chemical.encode('utf-8'), headers=request_header, timeout=self.request_timeout)
 			results = json.loads(response.content)
 		except Exception as e:
 			logging.warning("Exception at get_chemical_type: {}".format(e))
@@ -408,6 +469,13 @@ class Calculator(object):
 			'format': "smiles"
 		}
 
+		alias_index = get_alias_index()
+		if self.use_cache:
+			_indexed_smiles = alias_index.get(chemical, 'get_smiles_from_name')
+			if _indexed_smiles is not None:
+				_response['smiles'] = _indexed_smiles
+				return _response
+
 		_results = self.web_call(_url, _post)
 		_check_results = self.check_response_for_errors(_results)
 
@@ -416,6 +484,8 @@ class Calculator(object):
 			return _response
 
 		_response['smiles'] = _results.get('structure')
+		if self.use_cache:
+			alias_index.put(chemical, 'get_smiles_from_name', _response['smiles'])
 		return _response
 
 
@@ -475,11 +545,25 @@ class Calculator(object):
 
 		if not headers:
 			headers = self.headers
+
+		_cache_key = None
+		if self.use_cache:
+			_cache_key = self.result_cache.make_key('web', url, data)
+			_cached_results = self.result_cache.get(_cache_key)
+			if _cached_results is not None:
+				metrics.CALC_REQUESTS.inc('web', 'cached')
+				return _cached_results
+			_failure = get_negative_cache().get('web', url, data)
+			if _failure is not None:
+				metrics.CALC_REQUESTS.inc('web', 'negative_cached')
+				return {'error': _failure['error'], 'data': _failure['data'], 'valid': False}
+
+		_start_time = time.time()
 		try:
 			if data == None:
-				response = requests.get(url, timeout=self.request_timeout)
+				response = transport.get(url, timeout=self.request_timeout)
 			else:
-				response = requests.post(url, data=json.dumps(data), headers=headers, timeout=self.request_timeout)
+				response = transport.post(url, data=json.dumps(data), headers=headers, timeout=self.request_timeout)
 
 			results = json.loads(response.content)
 
@@ -487,6 +571,10 @@ class Calculator(object):
 
 			if valid_object.get('valid'):
 				results['valid'] = True
+				if _cache_key:
+					self.result_cache.set(_cache_key, results)
+				metrics.CALC_REQUESTS.inc('web', 'valid')
+				metrics.CALC_SECONDS.observe(time.time() - _start_time, 'web')
 				return results
 
 			else:
@@ -495,11 +583,24 @@ class Calculator(object):
 					'data': results,
 					'valid': False
 				}
+				if self.use_cache:
+					get_negative_cache().record('web', (url, data), valid_object.get('error'), response.status_code, results)
+				metrics.VALIDATION_FAILURES.inc('web', 'response_error')
+				metrics.CALC_REQUESTS.inc('web', 'failed')
+				metrics.CALC_SECONDS.observe(time.time() - _start_time, 'web')
 				return error_response
 
 			# return json.loads(response.content)
+		except deadline.DeadlineExceeded as e:
+			logging.warning("error at web call: {} /error".format(e))
+			metrics.CALC_REQUESTS.inc('web', 'failed')
+			return {'error': str(e), 'data': None, 'valid': False}
 		except requests.exceptions.RequestException as e:
 			logging.warning("error at web call: {} /error".format(e))
+			if isinstance(e, requests.exceptions.Timeout):
+				metrics.CALC_TIMEOUTS.inc('web')
+			metrics.CALC_REQUESTS.inc('web', 'failed')
+			metrics.CALC_SECONDS.observe(time.time() - _start_time, 'web')
 			raise e
 
 
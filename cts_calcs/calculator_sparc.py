@@ -1,8 +1,20 @@
+import concurrent.futures
 import json
 import logging
-import requests
-import os
+import time
 from .calculator import Calculator
+from . import transport
+from .endpoints import primary_url, DEFAULT_SPARC_SERVER
+from .calcs_metadata import CalcRouter
+from .snapshot import get_snapshot, default_conditions
+from .profiler import profiled
+from .scheduler import with_priority
+from . import deadline
+from .negative_cache import get_negative_cache, FAILURE_PERMANENT
+from . import metrics
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
 #from .smilesfilter import SMILESFilter
 
 
@@ -11,9 +23,10 @@ class SparcCalc(Calculator):
 
         Calculator.__init__(self)  # inherit Calculator base class
 
-        #self.base_url = os.environ['CTS_SPARC_SERVER']
-        self.base_url = 'https://n2626ugath802.aa.ad.epa.gov'
+        self.base_url = primary_url('CTS_SPARC_SERVER', DEFAULT_SPARC_SERVER)
         self.multiproperty_url = '/sparc-integration/rest/calc/multiProperty'
+        self.pka_url = '/sparc-integration/rest/calc/fullSpeciation'
+        self.logd_url = '/sparc-integration/rest/calc/logd'
         self.name = "sparc"
         self.smiles = smiles
         self.solvents = dict()
@@ -101,6 +114,8 @@ class SparcCalc(Calculator):
         return calculations
 
 
+    @profiled('sparc_data_request_handler')
+    @deadline.bounded
     def data_request_handler(self, request_dict):
 
         for key, val in self.pchem_request.items():
@@ -136,6 +151,43 @@ class SparcCalc(Calculator):
 
         _response_dict.update({'request_post': request_dict, 'method': None})
 
+        # Rejects props SPARC doesn't serve before making any requests:
+        _requested_props = request_dict.get('props') or []
+        if request_dict.get('prop') and not request_dict.get('prop') in _requested_props:
+            _requested_props = _requested_props + [request_dict.get('prop')]
+        _calls, _rejected = CalcRouter().route({'sparc': _requested_props})
+        _rejected_props = [data_obj['prop'] for data_obj in _rejected]
+
+        if request_dict.get('prop') in _rejected_props:
+            _response_dict.update({'data': "prop not supported", 'prop': request_dict.get('prop')})
+            return _response_dict
+
+        # Combined mode: all requested props' endpoints called concurrently:
+        if request_dict.get('combined'):
+            return self.combinedRequest(request_dict, _calls, _rejected)
+
+        # ion_con and kow_wph in props go to their own endpoints:
+        _separate_calls = []
+        if _requested_props and not request_dict.get('prop') in ['ion_con', 'kow_wph']:
+            _separate_calls = [call for call in _calls if call['endpoint'] != self.multiproperty_url]
+            _multi_calls = [call for call in _calls if call['endpoint'] == self.multiproperty_url]
+            if not _multi_calls:
+                # nothing left for the multiproperty endpoint to compute
+                return self.getSeparateData(_separate_calls, request_dict.get('ph')) + _rejected
+
+        # Serves from the precomputed snapshot if it has every requested result:
+        if request_dict.get('prop') in ['ion_con', 'kow_wph']:
+            _snapshot_data = self.getSnapshotData([request_dict['prop']], request_dict.get('ph'))
+            if _snapshot_data:
+                _response_dict.update({'data': _snapshot_data[request_dict['prop']], 'prop': request_dict['prop']})
+                return _response_dict
+        elif _requested_props:
+            _multi_props = [prop for prop in _requested_props if not prop in _rejected_props + ['ion_con', 'kow_wph']]
+            _snapshot_data = self.getSnapshotData(_multi_props, request_dict.get('ph'))
+            if _snapshot_data:
+                return [{'calc': 'sparc', 'prop': prop, 'data': _snapshot_data[prop]} for prop in _multi_props] + \
+                    self.getSeparateData(_separate_calls, request_dict.get('ph')) + _rejected
+
         try:
             # Runs ion_con endpoint if it's user's requested property
             if request_dict.get('prop') == 'ion_con':
@@ -152,13 +204,17 @@ class SparcCalc(Calculator):
 
             # Runs multiprop request if request prop is not kow_wph or ion_con
             else:
-                _post = self.get_sparc_query()
-                _url = self.base_url + self.multiproperty_url
                 _multi_response = self.makeDataRequest()
 
-                if 'calculationResults' in _multi_response:
-                    _multi_response = self.parseMultiPropResponse(_multi_response['calculationResults'], request_dict)
-                    return _multi_response
+                if isinstance(_multi_response, dict) and 'calculationResults' in _multi_response:
+                    _multi_response = self.parseMultiPropResponse(_multi_response['calculationResults'], request_dict, _rejected_props)
+                    return _multi_response + self.getSeparateData(_separate_calls, request_dict.get('ph')) + _rejected
+
+                # No multiproperty results (server down, deadline passed), returns the error per prop:
+                _error = _multi_response if isinstance(_multi_response, str) else "calc server not found"
+                _multi_props = [prop for prop in _requested_props if not prop in _rejected_props + ['ion_con', 'kow_wph']]
+                return [{'calc': 'sparc', 'prop': prop, 'data': _error} for prop in _multi_props] + \
+                    self.getSeparateData(_separate_calls, request_dict.get('ph')) + _rejected
 
         except Exception as err:
             logging.warning("Exception occurred getting SPARC data: {}".format(err))
@@ -169,6 +225,117 @@ class SparcCalc(Calculator):
             return _response_dict
 
 
+    def combinedRequest(self, request_dict, calls, rejected=None):
+        """
+        Makes the multiproperty, pKa and logD calls needed for
+        request_dict's props concurrently. Returns one list of
+        {calc, prop, data} objects in requested props order.
+        """
+        _endpoint_funcs = {
+            self.multiproperty_url: self.getMultiPropData,
+            self.pka_url: self.getPkaData,
+            self.logd_url: self.getLogDData
+        }
+        _data_objs = {}
+        if calls:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(calls)) as executor:
+                _futures = dict((executor.submit(deadline.with_deadline(with_priority(_endpoint_funcs[call['endpoint']])), call['props'], request_dict.get('ph')), call)
+                    for call in calls)
+                for future in concurrent.futures.as_completed(_futures):
+                    try:
+                        _data_objs.update(future.result())
+                    except Exception as err:
+                        logging.warning("Exception occurred getting SPARC data: {}".format(err))
+                        for prop in _futures[future]['props']:
+                            _data_objs[prop] = {'calc': 'sparc', 'prop': prop, 'data': "request timed out"}
+
+        for data_obj in rejected or []:
+            _data_objs[data_obj['prop']] = data_obj
+
+        _requested_props = request_dict.get('props') or [request_dict.get('prop')]
+        return [_data_objs[prop] for prop in _requested_props if prop in _data_objs]
+
+
+    def getSeparateData(self, calls, ph=None):
+        """
+        Returns [data_obj] for the pKa and logD calls in calls, made one
+        after the other (see combinedRequest for the concurrent version).
+        """
+        _endpoint_funcs = {
+            self.pka_url: self.getPkaData,
+            self.logd_url: self.getLogDData
+        }
+        _data_objs = []
+        for call in calls:
+            try:
+                _data_objs.extend(_endpoint_funcs[call['endpoint']](call['props'], ph).values())
+            except Exception as err:
+                logging.warning("Exception occurred getting SPARC data: {}".format(err))
+                _data_objs.extend({'calc': 'sparc', 'prop': prop, 'data': "request timed out"} for prop in call['props'])
+        return _data_objs
+
+
+    def getMultiPropData(self, props, ph=None):
+        """
+        Returns {prop: data_obj} for props from the multiproperty endpoint.
+        """
+        _data = self.getSnapshotData(props, ph)
+        if not _data:
+            _multi_response = self.makeDataRequest()
+            if not 'calculationResults' in _multi_response:
+                raise Exception("(sparc) no calculationResults in multiproperty response")
+            _data_objs = self.parseMultiPropResponse(_multi_response['calculationResults'], {'props': props})
+            _data = dict((data_obj['prop'], data_obj['data']) for data_obj in _data_objs)
+        return dict((prop, {'calc': 'sparc', 'prop': prop, 'data': _data.get(prop, "prop not found")}) for prop in props)
+
+
+    def getPkaData(self, props, ph=None):
+        """
+        Returns {'ion_con': data_obj} from the fullSpeciation endpoint.
+        """
+        _data = self.getSnapshotData(['ion_con'], ph)
+        if _data:
+            _pka_data = _data['ion_con']
+        else:
+            _pka_data = self.getPkaResults(self.makeCallForPka())
+        return {'ion_con': {'calc': 'sparc', 'prop': 'ion_con', 'data': _pka_data}}
+
+
+    def getLogDData(self, props, ph=None):
+        """
+        Returns {'kow_wph': data_obj} from the logd endpoint.
+        """
+        ph = self.default_ph if ph is None else ph
+        _data = self.getSnapshotData(['kow_wph'], ph)
+        if _data:
+            _logd_data = _data['kow_wph']
+        else:
+            _logd_data = self.getLogDForPH(self.makeCallForLogD(), ph)
+        return {'kow_wph': {'calc': 'sparc', 'prop': 'kow_wph', 'data': _logd_data}}
+
+
+    def getSnapshotData(self, props, ph=None):
+        """
+        Returns {prop: data} from the precomputed snapshot,
+        or None unless it has all props for self.smiles. Requests
+        with non-default conditions always go to SPARC.
+        """
+        _snapshot = get_snapshot()
+        if not _snapshot or not props:
+            return None
+        _conditions = {'temperature': self.temperature, 'pressure': self.pressure,
+            'meltingPoint': self.melting_point}
+        if not default_conditions(_conditions):
+            return None
+        _snapshot_data = {}
+        for prop in props:
+            data = _snapshot.get(self.smiles, 'sparc', prop, ph)
+            if data is None:
+                return None
+            _snapshot_data[prop] = data
+        return _snapshot_data
+
+
     def makeDataRequest(self):
         _post = self.get_sparc_query()
         _url = self.base_url + self.multiproperty_url
@@ -177,33 +344,60 @@ class SparcCalc(Calculator):
 
     def request_logic(self, url, post_data):
         """
-        Handles retries and validation of responses
+        Handles retries and validation of responses. Returns the
+        results rather than setting self.results, so combinedRequest's
+        concurrent calls on one SparcCalc don't share them.
         """
+        _cache_key = None
+        if self.use_cache:
+            _cache_key = self.result_cache.make_key(self.name, url, post_data)
+            _cached_results = self.result_cache.get(_cache_key)
+            if _cached_results is not None:
+                metrics.CALC_REQUESTS.inc(self.name, 'cached')
+                return _cached_results
+            if get_negative_cache().get(self.name, url, post_data) is not None:
+                metrics.CALC_REQUESTS.inc(self.name, 'negative_cached')
+                return "calc server not found"
+
+        _start_time = time.time()
         _valid_result = False  # for retry logic
         _retries = 0
         while not _valid_result and _retries < self.max_retries:
             # retry data request to chemaxon server until max retries or a valid result is returned
+            if _retries:
+                if not deadline.retry_fits(url):
+                    break
+                metrics.CALC_RETRIES.inc(self.name)
             try:
                 #req = requests.Request(method='POST',url=url,data=json.dumps(post_data), headers=self.headers)
                 #prepared = req.prepare()
                 #self.pretty_print_POST(req)
                 #print(prepared)
-                response = requests.post(url, data=json.dumps(post_data), headers=self.headers, timeout=self.request_timeout,verify=False)
-                print(response.request.url)
-                print(response.request.body)
-                print(response.request.headers)
-                
+                response = transport.post(url, data=json.dumps(post_data), headers=self.headers, timeout=self.request_timeout,verify=False)
                 _valid_result = self.validate_response(response)
                 if _valid_result:
-                    self.results = json.loads(response.content)
-                    return self.results
+                    _results = json.loads(response.content)
+                    if _cache_key:
+                        self.result_cache.set(_cache_key, _results)
+                    metrics.CALC_REQUESTS.inc(self.name, 'valid')
+                    metrics.CALC_SECONDS.observe(time.time() - _start_time, self.name)
+                    return _results
+                if self.use_cache and get_negative_cache().record(self.name, (url, post_data), "sparc request rejected",
+                        response.status_code) == FAILURE_PERMANENT:
+                    break  # same request fails the same way, no point retrying
                 _retries += 1
+            except deadline.DeadlineExceeded as e:
+                logging.warning("Exception in calculator_sparc.py: {}".format(e))
+                break
             except Exception as e:
                 logging.warning("Exception in calculator_sparc.py: {}".format(e))
+                if isinstance(e, requests.exceptions.Timeout):
+                    metrics.CALC_TIMEOUTS.inc(self.name)
                 _retries += 1
             logging.info("Max retries: {}, Retries left: {}".format(self.max_retries, _retries))
-        self.results = "calc server not found"
-        return self.results
+        metrics.CALC_REQUESTS.inc(self.name, 'failed')
+        metrics.CALC_SECONDS.observe(time.time() - _start_time, self.name)
+        return "calc server not found"
 
 
     def validate_response(self, response):
@@ -214,12 +408,14 @@ class SparcCalc(Calculator):
         """
         if response.status_code != 200:
             logging.warning("sparc server response status: {}".format(response.status_code))
+            metrics.VALIDATION_FAILURES.inc(self.name, 'status')
             return False
         
         try:
             response_obj = json.loads(response.content)
         except Exception as e:
             logging.warning("Could not convert response to json object, sparc validate_response: {}".format(e))
+            metrics.VALIDATION_FAILURES.inc(self.name, 'json')
             return False
 
         response_type = response_obj.get('type')  # get SPARC property name
@@ -230,17 +426,21 @@ class SparcCalc(Calculator):
             if not isinstance(response_obj.get('plotCoordinates'), list):
                 # retry if no 'plotCoordinates' key or 'plotCoordinates' is None
                 logging.warning("SPARC LOGD 'plotCoordinates' not list as expected...Retrying request...")
+                metrics.VALIDATION_FAILURES.inc(self.name, 'logd_plot_coordinates')
                 return False
 
         return True
 
 
-    def parseMultiPropResponse(self, results, request_dict):
+    def parseMultiPropResponse(self, results, request_dict, skip_props=None):
         """
         Loops through data grabbing the results
         and building {calc, prop, data} objects
         for front end.
 
+        skip_props - (optional) props already rejected as unsupported,
+        not reported as missing.
+
         TODO: Add more info to returned data (object instead of value)
         """
         if not results or not isinstance(results, list):
@@ -261,6 +461,8 @@ class SparcCalc(Calculator):
                 sparc_response_props.append(cts_prop_name)
 
         for prop in request_dict['props']:
+            if skip_props and prop in skip_props:
+                continue
             if not prop in sparc_response_props and prop != 'ion_con' and prop != 'kow_wph':
                 # if sparc response doesn't have user request prop from multi-response, PANIC!
                 logging.info("requested prop {} missing from sparc multi response...".format(prop))
@@ -276,8 +478,7 @@ class SparcCalc(Calculator):
         """
         Separate call for SPARC pKa
         """
-        _pka_url = "/sparc-integration/rest/calc/fullSpeciation"
-        _url = self.base_url + _pka_url
+        _url = self.base_url + self.pka_url
         logging.info("URL: {}".format(_url))
         _sparc_post = {
             "type":"FULL_SPECIATION",
@@ -337,8 +538,7 @@ class SparcCalc(Calculator):
         Seprate call for octanol/water partition
         coefficient with pH (logD?)
         """
-        _logd_url = "/sparc-integration/rest/calc/logd"
-        _url = self.base_url + _logd_url
+        _url = self.base_url + self.logd_url
         _post = {
            "type":"LOGD",
            "solvent": {
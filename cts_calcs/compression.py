@@ -0,0 +1,161 @@
+"""
+Compressed request/response bodies and wire-size accounting.
+
+Responses: transport sends Accept-Encoding (CTS_ACCEPT_ENCODING, default
+"gzip, deflate"; "identity" turns it off). With CTS_WIRE_STATS=1 it also
+reads and decodes non-streamed bodies itself (read_response) so the
+wire size and decode time of every response can be recorded; otherwise
+requests decodes them as usual.
+
+Requests: bodies for backends listed in CTS_COMPRESS_REQUESTS (comma-
+separated base urls, or "all") are gzipped when larger than
+CTS_COMPRESS_MIN_BYTES. A backend answering 415 is dropped from the
+list and the request resent uncompressed. A backend with replicas (see
+endpoints) is listed, and dropped, by its primary url.
+
+See benchmarks/bench_compression.py for the break-even point on
+realistic payloads.
+"""
+
+import gzip
+import logging
+import os
+import threading
+import time
+import zlib
+
+from .limiter import backend_key
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+
+WIRE_STATS = os.environ.get('CTS_WIRE_STATS', '0') == '1'
+ACCEPT_ENCODING = os.environ.get('CTS_ACCEPT_ENCODING', 'gzip, deflate')
+COMPRESS_MIN_BYTES = int(os.environ.get('CTS_COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.environ.get('CTS_COMPRESS_LEVEL', 6))
+
+_compress_backends = set(backend_key(url) if url != 'all' else url
+	for url in os.environ.get('CTS_COMPRESS_REQUESTS', '').split(',') if url.strip())
+_unsupported_backends = set()
+
+
+
+def enable_request_compression(base_url):
+	_compress_backends.add(backend_key(base_url) if base_url != 'all' else base_url)
+	_unsupported_backends.discard(backend_key(base_url))
+
+
+def disable_request_compression(url):
+	"""
+	Stops compressing request bodies for url's backend (e.g., after a 415).
+	"""
+	logging.warning("Backend {} doesn't accept compressed requests, sending uncompressed".format(backend_key(url)))
+	_unsupported_backends.add(backend_key(url))
+
+
+def prepare_body(url, data, headers):
+	"""
+	Returns (body, headers) for request, gzipping body when
+	url's backend accepts compressed requests.
+	"""
+	headers = dict(headers or {})
+	headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+	if data is None:
+		return data, headers
+	body = data.encode('utf-8') if isinstance(data, str) else data
+	key = backend_key(url)
+	if (key in _compress_backends or 'all' in _compress_backends) and not key in _unsupported_backends \
+			and len(body) >= COMPRESS_MIN_BYTES:
+		body = gzip.compress(body, COMPRESS_LEVEL)
+		headers['Content-Encoding'] = 'gzip'
+	return body, headers
+
+
+def decode_body(raw, encoding):
+	"""
+	Decodes gzip/deflate response body, returns bytes.
+	"""
+	encoding = (encoding or '').strip().lower()
+	if encoding in ('gzip', 'x-gzip'):
+		return zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+	if encoding == 'deflate':
+		try:
+			return zlib.decompress(raw)
+		except zlib.error:
+			return zlib.decompress(raw, -zlib.MAX_WBITS)  # raw deflate without zlib header
+	return raw
+
+
+def read_error(error):
+	"""
+	Returns the requests exception requests itself raises for
+	error while reading or decoding a body.
+	"""
+	import urllib3.exceptions
+	if isinstance(error, (zlib.error, urllib3.exceptions.DecodeError)):
+		return requests.exceptions.ContentDecodingError(error)
+	if isinstance(error, urllib3.exceptions.ProtocolError):
+		return requests.exceptions.ChunkedEncodingError(error)
+	if isinstance(error, urllib3.exceptions.SSLError):
+		return requests.exceptions.SSLError(error)
+	return requests.exceptions.ConnectionError(error)
+
+
+def read_response(response, backend, request_size=0, request_wire_size=0):
+	"""
+	Reads streamed response body, decoding it here rather than in
+	urllib3 so wire bytes and decode time can be recorded. A body
+	that can't be read in full raises (see read_error) rather than
+	leaving a truncated response, and its connection is closed.
+	"""
+	try:
+		raw = response.raw.read(decode_content=False)
+		start_time = time.time()
+		content = decode_body(raw, response.headers.get('Content-Encoding'))
+		decode_time = time.time() - start_time
+	except Exception as e:
+		response.close()
+		raise read_error(e)
+	response._content = content
+	response._content_consumed = True
+	release_conn = getattr(response.raw, 'release_conn', None)
+	if release_conn:
+		release_conn()
+	get_wire_stats().record(backend, request_size, request_wire_size, len(raw), len(content), decode_time)
+	return response
+
+
+
+class WireStats(object):
+	"""
+	Request/response byte counts and decode time per backend.
+	"""
+
+	FIELDS = ['requests', 'request_bytes', 'request_wire_bytes', 'response_wire_bytes', 'response_bytes', 'decode_time']
+
+	def __init__(self):
+		self.backends = {}
+		self._lock = threading.Lock()
+
+	def record(self, backend, request_size, request_wire_size, response_wire_size, response_size, decode_time):
+		with self._lock:
+			stats = self.backends.setdefault(backend, dict((field, 0) for field in self.FIELDS))
+			stats['requests'] += 1
+			stats['request_bytes'] += request_size
+			stats['request_wire_bytes'] += request_wire_size
+			stats['response_wire_bytes'] += response_wire_size
+			stats['response_bytes'] += response_size
+			stats['decode_time'] += decode_time
+
+	def stats(self):
+		with self._lock:
+			return dict((backend, dict(stats)) for backend, stats in self.backends.items())
+
+
+
+_wire_stats = WireStats()
+
+
+def get_wire_stats():
+	return _wire_stats
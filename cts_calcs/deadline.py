@@ -0,0 +1,174 @@
+"""
+End-to-end deadlines for calculator requests.
+
+A request's time budget covers every stage it goes through: filtering
+round trips, melting point lookups, the calculator call and its
+retries. The deadline is held per thread (like the scheduler's priority
+class) and applied at each stage:
+
+	transport.send       - timeout and limiter wait are clipped to the
+	                       time left; nothing is sent once it has passed
+	request_logic /      - retries stop once the time left is less than
+	make_data_request      the endpoint's typical (p50) latency
+	get_melting_point    - remaining lookups are skipped
+	filterSMILES         - raises DeadlineExceeded between steps
+
+so a caller gets a prompt partial result or error instead of a worker
+tied up for max_retries x request_timeout.
+
+data_request_handler and getJchemPropData take the deadline from the
+request dict, as 'deadline' (unix time) or 'time_budget' (seconds), and
+otherwise from CTS_REQUEST_BUDGET (seconds, unset for no deadline).
+Elsewhere, set one with:
+
+	with deadline.deadline(10):
+		SMILESFilter().filterSMILES(smiles)
+"""
+
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+
+from .latency import get_latency_tracker
+
+
+DEFAULT_BUDGET = float(os.environ.get('CTS_REQUEST_BUDGET') or 0) or None
+
+_local = threading.local()
+
+
+
+class DeadlineExceeded(Exception):
+	"""
+	Raised when a stage starts after the request's deadline.
+	"""
+
+
+
+class Deadline(object):
+
+	__slots__ = ('expires_at',)
+
+	def __init__(self, expires_at):
+		self.expires_at = expires_at
+
+	def remaining(self):
+		return self.expires_at - time.time()
+
+	def expired(self):
+		return self.remaining() <= 0
+
+	def __repr__(self):
+		return "<Deadline in {:.3f}s>".format(self.remaining())
+
+
+
+def current_deadline():
+	return getattr(_local, 'deadline', None)
+
+
+@contextlib.contextmanager
+def deadline(seconds=None, expires_at=None):
+	"""
+	Runs the block (in this thread) under a deadline, seconds from now
+	or at expires_at. A nested deadline can only shorten the current one.
+	"""
+	if seconds is not None:
+		expires_at = time.time() + seconds
+	previous = current_deadline()
+	if expires_at is None or (previous is not None and previous.expires_at <= expires_at):
+		yield previous
+		return
+	_local.deadline = Deadline(expires_at)
+	try:
+		yield _local.deadline
+	finally:
+		_local.deadline = previous
+
+
+def remaining_time():
+	"""
+	Returns seconds left, or None without a deadline.
+	"""
+	current = current_deadline()
+	return current.remaining() if current is not None else None
+
+
+def expired():
+	remaining = remaining_time()
+	return remaining is not None and remaining <= 0
+
+
+def check(stage):
+	"""
+	Raises DeadlineExceeded if the deadline has passed before stage.
+	"""
+	if expired():
+		logging.warning("Deadline exceeded by {:.3f}s before {}".format(-remaining_time(), stage))
+		raise DeadlineExceeded("deadline exceeded before {}".format(stage))
+
+
+def clip_timeout(timeout, stage):
+	"""
+	Returns timeout cut down to the time left (raising DeadlineExceeded
+	if there's none), or timeout unchanged without a deadline.
+	"""
+	check(stage)
+	remaining = remaining_time()
+	if remaining is None:
+		return timeout
+	remaining = max(remaining, 0.001)  # may have run out since the check
+	return min(timeout, remaining) if timeout else remaining
+
+
+def retry_fits(url):
+	"""
+	True if another attempt at url can be expected to finish in time.
+	"""
+	remaining = remaining_time()
+	if remaining is None:
+		return True
+	expected = get_latency_tracker().expected_latency(url) or 0.0
+	if remaining > expected:
+		return True
+	logging.warning("Skipping retry of {}: {:.3f}s left, typical latency {:.3f}s".format(url, remaining, expected))
+	return False
+
+
+def with_deadline(func):
+	"""
+	Wraps func to run under the calling thread's current deadline,
+	for handing work to executor threads.
+	"""
+	current = current_deadline()
+
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		with deadline(expires_at=current.expires_at if current is not None else None):
+			return func(*args, **kwargs)
+	return wrapper
+
+
+def request_expiry(request_dict):
+	"""
+	Returns request's deadline as unix time, or None.
+	"""
+	if request_dict.get('deadline'):
+		return float(request_dict['deadline'])
+	budget = request_dict.get('time_budget') or DEFAULT_BUDGET
+	return time.time() + float(budget) if budget else None
+
+
+def bounded(func):
+	"""
+	Decorator for calculator methods taking a request dict,
+	running them under the request's deadline.
+	"""
+	@functools.wraps(func)
+	def wrapper(self, request_dict, *args, **kwargs):
+		with deadline(expires_at=request_expiry(request_dict)):
+			return func(self, request_dict, *args, **kwargs)
+	return wrapper
@@ -0,0 +1,249 @@
+"""
+Replica pools for the SPARC, JChem WS and CTSWS backends.
+
+CTS_SPARC_SERVER, CTS_JCHEM_SERVER and CTS_EFS_SERVER each accept a
+comma-separated list of base urls. Calculators keep building urls from
+the first (primary) one, and transport.send rewrites each request onto
+the replica with the fewest outstanding requests. A url belongs to the
+pool whose primary url plus backend path (/sparc-integration,
+/webservices, /ctsws) it starts with, so JChem and CTSWS can share a
+host. Replicas are ejected after consecutive failures (passive checks)
+or failed health probes (active checks, every CTS_HEALTH_CHECK_INTERVAL
+seconds from a pool's first request in each process; 0 turns them
+off), and readmitted once their ejection time is up or a probe succeeds.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+
+DEFAULT_SPARC_SERVER = 'https://n2626ugath802.aa.ad.epa.gov'
+FAILURE_THRESHOLD = int(os.environ.get('CTS_EJECT_AFTER_FAILURES', 3))
+EJECTION_TIME = float(os.environ.get('CTS_EJECTION_TIME', 30))  # seconds, doubles per repeat ejection
+MAX_EJECTION_TIME = 300.0
+HEALTH_CHECK_INTERVAL = float(os.environ.get('CTS_HEALTH_CHECK_INTERVAL', 10))  # seconds, 0 for passive checks only
+
+# path each backend's endpoints live under, also the health probe path:
+POOL_PATHS = {
+	'sparc': '/sparc-integration',
+	'jchem': '/webservices',
+	'efs': '/ctsws',
+}
+
+
+
+def parse_urls(value):
+	return [url.strip().rstrip('/') for url in (value or '').split(',') if url.strip()]
+
+
+def primary_url(env_name, default=None):
+	"""
+	Returns the first url of a (possibly comma-separated) server env var.
+	"""
+	urls = parse_urls(os.environ.get(env_name))
+	return urls[0] if urls else default
+
+
+
+class Replica(object):
+
+	def __init__(self, url):
+		self.url = url
+		self.outstanding = 0
+		self.failures = 0  # consecutive
+		self.ejections = 0
+		self.ejected_until = 0.0
+
+	def is_available(self, now):
+		return self.ejected_until <= now
+
+	def stats(self):
+		return {
+			'url': self.url,
+			'outstanding': self.outstanding,
+			'failures': self.failures,
+			'ejected': not self.is_available(time.time())
+		}
+
+
+
+class EndpointPool(object):
+	"""
+	Least-outstanding-requests balancer over replicas of one backend.
+	"""
+
+	def __init__(self, name, urls, failure_threshold=FAILURE_THRESHOLD, ejection_time=EJECTION_TIME,
+			path=None, health_interval=HEALTH_CHECK_INTERVAL):
+		self.name = name
+		self.replicas = [Replica(url) for url in urls]
+		self.primary = self.replicas[0].url
+		self.failure_threshold = failure_threshold
+		self.ejection_time = ejection_time
+		self.path = path or ''  # backend path prefix, '' matches any path on primary
+		self.health_interval = health_interval
+		self._lock = threading.Lock()
+		self._health_thread = None
+		self._health_pid = None
+
+	def match_length(self, url):
+		"""
+		Returns length of the primary url + path prefix url starts
+		with, or -1 if url isn't on this pool.
+		"""
+		prefix = self.primary + self.path
+		if url.startswith(prefix) and url[len(prefix):][:1] in ('', '/', '?'):
+			return len(prefix)
+		return -1
+
+	def acquire(self):
+		"""
+		Picks replica for a request and counts it as outstanding.
+		If all replicas are ejected, picks the one readmitted soonest.
+		"""
+		now = time.time()
+		with self._lock:
+			available = [replica for replica in self.replicas if replica.is_available(now)]
+			if available:
+				fewest = min(replica.outstanding for replica in available)
+				replica = random.choice([replica for replica in available if replica.outstanding == fewest])
+			else:
+				replica = min(self.replicas, key=lambda replica: replica.ejected_until)
+			replica.outstanding += 1
+			return replica
+
+	def release(self, replica, ok=True):
+		with self._lock:
+			replica.outstanding = max(0, replica.outstanding - 1)
+			self._report(replica, ok)
+
+	def _report(self, replica, ok):
+		if ok:
+			if replica.failures or replica.ejections:
+				logging.info("Replica {} healthy, readmitted to {} pool".format(replica.url, self.name))
+			replica.failures = 0
+			replica.ejections = 0
+			replica.ejected_until = 0.0
+			return
+		replica.failures += 1
+		if replica.failures >= self.failure_threshold and replica.is_available(time.time()):
+			ejection_time = min(MAX_EJECTION_TIME, self.ejection_time * 2 ** replica.ejections)
+			replica.ejections += 1
+			replica.ejected_until = time.time() + ejection_time
+			logging.warning("Ejecting replica {} from {} pool for {}s".format(replica.url, self.name, ejection_time))
+
+	def resolve(self, url, replica):
+		"""
+		Rewrites url built on the primary base onto replica's base.
+		"""
+		return replica.url + url[len(self.primary):]
+
+	def probe(self, replica, path='', timeout=5):
+		"""
+		Active health check: any non-5xx answer counts as healthy.
+		"""
+		try:
+			response = requests.get(replica.url + path, timeout=timeout, verify=False)
+			ok = response.status_code < 500
+		except requests.exceptions.RequestException:
+			ok = False
+		with self._lock:
+			if ok:
+				self._report(replica, True)
+			else:
+				# a failed probe ejects right away
+				replica.failures = max(replica.failures, self.failure_threshold - 1)
+				self._report(replica, False)
+		return ok
+
+	def start_health_checks(self, interval=None, path=None):
+		"""
+		Probes every replica each interval seconds (default:
+		health_interval) in a daemon thread, once per process.
+		"""
+		interval = self.health_interval if interval is None else interval
+		path = self.path if path is None else path
+		if not interval:
+			return None
+		with self._lock:
+			if self._health_thread and self._health_pid == os.getpid():
+				return self._health_thread  # (a forked worker starts its own)
+
+			stopped = self._health_stopped = threading.Event()
+
+			def check_loop():
+				while True:
+					for replica in list(self.replicas):
+						try:
+							self.probe(replica, path)
+						except Exception as e:
+							logging.warning("Health check of {} failed: {}".format(replica.url, e))
+					if stopped.wait(interval):
+						return
+
+			self._health_thread = threading.Thread(target=check_loop, name="{}-health".format(self.name))
+			self._health_thread.daemon = True
+			self._health_pid = os.getpid()
+			self._health_thread.start()
+			return self._health_thread
+
+	def stop_health_checks(self):
+		with self._lock:
+			if self._health_thread:
+				self._health_stopped.set()
+				self._health_thread = None
+				self._health_pid = None
+
+	def stats(self):
+		with self._lock:
+			return [replica.stats() for replica in self.replicas]
+
+
+
+_pools = {}
+
+
+def register_pool(name, urls, **pool_kwargs):
+	"""
+	Registers replica pool (list or comma-separated string of urls),
+	under POOL_PATHS[name] unless given a path.
+	"""
+	if isinstance(urls, str):
+		urls = parse_urls(urls)
+	if not urls:
+		return None
+	pool_kwargs.setdefault('path', POOL_PATHS.get(name))
+	pool = EndpointPool(name, urls, **pool_kwargs)
+	_pools[name] = pool
+	return pool
+
+
+def get_pool(name):
+	return _pools.get(name)
+
+
+def find_pool(url):
+	"""
+	Returns the replicated pool with the longest primary url + path
+	prefix of url, or None. Starts the pool's health checks.
+	"""
+	best, best_length = None, -1
+	for pool in list(_pools.values()):
+		if len(pool.replicas) > 1:
+			length = pool.match_length(url)
+			if length > best_length:
+				best, best_length = pool, length
+	if best and best.health_interval and best._health_pid != os.getpid():
+		best.start_health_checks()
+	return best
+
+
+register_pool('sparc', os.environ.get('CTS_SPARC_SERVER') or DEFAULT_SPARC_SERVER)
+register_pool('jchem', os.environ.get('CTS_JCHEM_SERVER', ''))
+register_pool('efs', os.environ.get('CTS_EFS_SERVER', ''))
@@ -1,8 +1,20 @@
-import requests
 import json
 import logging
 import os
+import time
 from .calculator import Calculator
+from . import transport
+from .endpoints import parse_urls
+from .snapshot import get_snapshot
+from .profiler import profiled
+from .blobstore import get_blob_store, store_image
+from . import deadline
+from .negative_cache import get_negative_cache, FAILURE_PERMANENT
+from . import metrics
+from .streaming import iter_json_array, CHUNK_SIZE
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
 
 
 class JchemProperty(Calculator):
@@ -19,7 +31,7 @@ class JchemProperty(Calculator):
         self.request_timeout = 20
         self.headers = {'Content-Type': 'application/json'}
         self.max_retries = 3
-        self.baseUrl = os.environ['CTS_JCHEM_SERVER']
+        self.baseUrl = parse_urls(os.environ['CTS_JCHEM_SERVER'])[0]
         self.url_pattern = '/webservices/rest-v0/util/calculate/{}'
         self.results = ''  # json result
         self.name = ''  # name of property
@@ -30,15 +42,27 @@ class JchemProperty(Calculator):
 
 
     # def getJchemPropData(self, chemical, prop, ph=7.0, method=None, mass=None):
+    @profiled('getJchemPropData')
+    @deadline.bounded
     def getJchemPropData(self, request_dict):
         """
         Calls jchem web services from chemaxon and
         wraps data in a CTS data object (keys: calc, prop, method, data)
         """
         prop_obj = self.getPropObject(request_dict.get('prop'))
-        prop_obj.results = self.make_data_request(request_dict.get('chemical'), prop_obj, request_dict.get('method'))
 
-        prop_obj.results = prop_obj.get_data(request_dict)
+        # Uses precomputed result from snapshot if there is one:
+        _snapshot = get_snapshot()
+        _data = None
+        if _snapshot:
+            _data = _snapshot.get(request_dict.get('chemical'), 'chemaxon', request_dict.get('prop'),
+                request_dict.get('ph'), request_dict.get('method'))
+
+        if _data is None:
+            prop_obj.results = self.make_data_request(request_dict.get('chemical'), prop_obj, request_dict.get('method'))
+            _data = prop_obj.get_data(request_dict)
+
+        prop_obj.results = _data
 
         _result_dict = {
             'calc': 'chemaxon',
@@ -83,7 +107,11 @@ class JchemProperty(Calculator):
 
 
 
-    def make_data_request(self, structure, prop_obj, method=None):
+    def data_request_post(self, structure, prop_obj, method=None, parameters=None):
+        """
+        Returns (url, post data) of prop_obj's request for structure.
+        parameters override prop_obj.postData for this request only.
+        """
         url = self.baseUrl + prop_obj.url
         prop_obj.postData.update({
             "result-display": {
@@ -97,30 +125,136 @@ class JchemProperty(Calculator):
             "structure": structure,
             "parameters": prop_obj.postData
         }
+        if parameters:
+            post_data['parameters'] = dict(prop_obj.postData, **parameters)
 
         if method:
             post_data['parameters']['method'] = method
 
+        return url, post_data
+
+
+
+    def make_data_request(self, structure, prop_obj, method=None):
+        url, post_data = self.data_request_post(structure, prop_obj, method)
+
+        _cache_key = None
+        if self.use_cache:
+            _cache_key = self.result_cache.make_key('chemaxon', url, post_data)
+            _cached_results = self.result_cache.get(_cache_key)
+            if _cached_results is not None:
+                metrics.CALC_REQUESTS.inc('chemaxon', 'cached')
+                prop_obj.results = _cached_results
+                return _cached_results
+            if get_negative_cache().get('chemaxon', url, post_data) is not None:
+                metrics.CALC_REQUESTS.inc('chemaxon', 'negative_cached')
+                return None
+
+        _start_time = time.time()
         _valid_result = False  # for retry logic
         _retries = 0
         while not _valid_result and _retries < self.max_retries:
             # retry data request to chemaxon server until max retries or a valid result is returned
+            if _retries:
+                if not deadline.retry_fits(url):
+                    break
+                metrics.CALC_RETRIES.inc('chemaxon')
             try:
-                response = requests.post(url, data=json.dumps(post_data), headers=self.headers, timeout=self.request_timeout)
+                response = transport.post(url, data=json.dumps(post_data), headers=self.headers, timeout=self.request_timeout)
                 _valid_result = self.validate_response(response)
                 if _valid_result:
                     prop_obj.results = json.loads(response.content)
+                    if _cache_key:
+                        self.result_cache.set(_cache_key, prop_obj.results)
+                    metrics.CALC_REQUESTS.inc('chemaxon', 'valid')
+                    metrics.CALC_SECONDS.observe(time.time() - _start_time, 'chemaxon')
                     return json.loads(response.content)
+                if self.use_cache and get_negative_cache().record('chemaxon', (url, post_data), self.response_error(response),
+                        response.status_code) == FAILURE_PERMANENT:
+                    break  # same request fails the same way, no point retrying
                 _retries += 1
+            except deadline.DeadlineExceeded as e:
+                logging.warning("Exception in jchem_calculator.py: {}".format(e))
+                break
             except Exception as e:
                 logging.warning("Exception in jchem_calculator.py: {}".format(e))
+                if isinstance(e, requests.exceptions.Timeout):
+                    metrics.CALC_TIMEOUTS.inc('chemaxon')
                 _retries += 1
 
             logging.info("Max retries: {}, Retries left: {}".format(self.max_retries, _retries))
+        metrics.CALC_REQUESTS.inc('chemaxon', 'failed')
+        metrics.CALC_SECONDS.observe(time.time() - _start_time, 'chemaxon')
         return None
 
 
 
+    def stream_data_request(self, structure, prop_obj, method=None, parameters=None):
+        """
+        Generator version of make_data_request for enumerations: yields
+        the response's 'result' items as they're parsed off the wire
+        (see streaming) instead of loading the whole body. A cached full
+        result is served from the cache; streamed results aren't cached.
+        Retries happen only before the first item is yielded.
+        """
+        url, post_data = self.data_request_post(structure, prop_obj, method, parameters)
+
+        if self.use_cache:
+            _cached_results = self.result_cache.get(self.result_cache.make_key('chemaxon', url, post_data))
+            if _cached_results is not None:
+                metrics.CALC_REQUESTS.inc('chemaxon', 'cached')
+                _result = _cached_results.get('result')
+                for item in (_result if isinstance(_result, list) else [_result] if _result is not None else []):
+                    yield item
+                return
+            if get_negative_cache().get('chemaxon', url, post_data) is not None:
+                metrics.CALC_REQUESTS.inc('chemaxon', 'negative_cached')
+                return
+
+        _start_time = time.time()
+        response = None
+        _retries = 0
+        while _retries < self.max_retries:
+            if _retries:
+                if not deadline.retry_fits(url):
+                    break
+                metrics.CALC_RETRIES.inc('chemaxon')
+            try:
+                response = transport.post(url, data=json.dumps(post_data), headers=self.headers, timeout=self.request_timeout, stream=True)
+                if self.validate_response(response):
+                    break
+                _permanent = self.use_cache and get_negative_cache().record('chemaxon', (url, post_data), self.response_error(response),
+                        response.status_code) == FAILURE_PERMANENT
+                response = None
+                if _permanent:
+                    break  # same request fails the same way, no point retrying
+                _retries += 1
+            except deadline.DeadlineExceeded as e:
+                logging.warning("Exception in jchem_calculator.py: {}".format(e))
+                break
+            except Exception as e:
+                logging.warning("Exception in jchem_calculator.py: {}".format(e))
+                if isinstance(e, requests.exceptions.Timeout):
+                    metrics.CALC_TIMEOUTS.inc('chemaxon')
+                _retries += 1
+
+        if response is None:
+            metrics.CALC_REQUESTS.inc('chemaxon', 'failed')
+            metrics.CALC_SECONDS.observe(time.time() - _start_time, 'chemaxon')
+            return
+
+        metrics.CALC_REQUESTS.inc('chemaxon', 'valid')
+        try:
+            for item in iter_json_array(response.iter_content(CHUNK_SIZE)):
+                yield item
+        except (ValueError, requests.exceptions.RequestException) as e:
+            logging.warning("Exception reading streamed jchem response: {}".format(e))
+        finally:
+            response.close()  # stopped early: drops the connection instead of reading the rest
+            metrics.CALC_SECONDS.observe(time.time() - _start_time, 'chemaxon')
+
+
+
     def validate_response(self, response):
         """
         Validates jchem response.
@@ -129,11 +263,24 @@ class JchemProperty(Calculator):
         """
         if response.status_code != 200:
             logging.warning("cts_celery calculator_chemaxon -- jchem server response: {} \n {}".format(response, response.content))
+            metrics.VALIDATION_FAILURES.inc('chemaxon', 'status')
             return False
         return True
 
 
 
+    def response_error(self, response):
+        """
+        Returns error message from a failed jchem response, or None.
+        """
+        try:
+            results = json.loads(response.content)
+        except Exception:
+            return None
+        return self.check_response_for_errors(results).get('error')
+
+
+
     # def booleanize(self, value):
     #     """
     #     django checkbox comes back as 'on' or 'off',
@@ -149,6 +296,16 @@ class JchemProperty(Calculator):
 
 
 
+    def storeImage(self, image_obj):
+        """
+        Returns base64 image in a result's image object as a blob
+        store handle (if a blob store is configured). The raw
+        results are left as they are.
+        """
+        return store_image(get_blob_store(), image_obj['image'])
+
+
+
     def getSpeciationResults(self, jchemResultObjects):
         """
         Loops jchemPropObjects (speciation results) from chemaxon,
@@ -235,7 +392,7 @@ class Pka(JchemProperty):
 		Returns dict with keys: image, formula, iupac, mass, and smiles
 		"""
         try:
-            parentDict = {'image': self.results['result']['image']['image'], 'key': 'parent'}
+            parentDict = {'image': self.storeImage(self.results['result']['image']), 'key': 'parent'}
             if not test:
                 # Adds additional chem info from jchemws:
                 parentDict.update(self.getStructInfo(self.results['result']['structureData']['structure']))
@@ -256,7 +413,7 @@ class Pka(JchemProperty):
                 msList = []
                 for ms in self.results['microspecies']:
                     msStructDict = {}  # list element in msList
-                    msStructDict.update({'image': ms['image']['image'], 'key': ms['key']})
+                    msStructDict.update({'image': self.storeImage(ms['image']), 'key': ms['key']})
                     if not test:
                         structInfo = self.getStructInfo(ms['structureData']['structure'])
                         msStructDict.update(structInfo)
@@ -358,7 +515,7 @@ class MajorMicrospecies(JchemProperty):
     def getMajorMicrospecies(self, test=False):
         majorMsDict = {}
         try:
-            majorMsDict.update({'image': self.results['result']['image']['image'], 'key': 'majorMS'})
+            majorMsDict.update({'image': self.storeImage(self.results['result']['image']), 'key': 'majorMS'})
             if not test:
                 structInfo = self.getStructInfo(self.results['result']['structureData']['structure'])
                 majorMsDict.update(structInfo)  # add smiles, iupac, mass, formula key:values
@@ -405,12 +562,7 @@ class Tautomerization(JchemProperty):
             tauts = self.results['result']  # for DOMINANT tautomers
 
             for taut in tauts:
-                tautStructDict = {'image': taut['image']['image'], 'key': 'taut'}
-                if not test:
-                    structInfo = self.getStructInfo(taut['structureData']['structure'])
-                    tautStructDict.update(structInfo)
-                tautStructDict.update({'dist': 100 * round(taut['dominantTautomerDistribution'], 4)})
-                tautImageList.append(tautStructDict)
+                tautImageList.append(self.getTautStruct(taut, test))
 
             tautDict.update({'tautStructs': tautImageList})
             return tautImageList
@@ -418,6 +570,39 @@ class Tautomerization(JchemProperty):
             logging.warning("key error: {}".format(ke))
             return None
 
+    def getTautStruct(self, taut, test=False):
+        tautStructDict = {'image': self.storeImage(taut['image']), 'key': 'taut'}
+        if not test:
+            structInfo = self.getStructInfo(taut['structureData']['structure'])
+            tautStructDict.update(structInfo)
+        tautStructDict.update({'dist': 100 * round(taut['dominantTautomerDistribution'], 4)})
+        return tautStructDict
+
+    def iterTautomers(self, structure, max_count=None, min_distribution=None, test=False):
+        """
+        Generator of tautomer dicts (as in getTautomers) for structure,
+        built as the response is parsed. Stops after max_count tautomers,
+        or once their dominantTautomerDistribution adds up to
+        min_distribution (0-1), without reading the rest of the response.
+        """
+        _parameters = None
+        if max_count:
+            # caps this request only, the instance keeps its maxStructureCount
+            _parameters = {'maxStructureCount': min(max_count, self.postData['maxStructureCount'])}
+        tauts = self.stream_data_request(structure, self, parameters=_parameters)
+        count, covered = 0, 0.0
+        try:
+            for taut in tauts:
+                yield self.getTautStruct(taut, test)
+                count += 1
+                covered += taut['dominantTautomerDistribution']
+                if (max_count and count >= max_count) or (min_distribution and covered >= min_distribution):
+                    break
+        except KeyError as ke:
+            logging.warning("key error: {}".format(ke))
+        finally:
+            tauts.close()
+
 
 
 class Stereoisomer(JchemProperty):
@@ -437,16 +622,41 @@ class Stereoisomer(JchemProperty):
         stereoList = []
         try:
             for stereo in self.results['result']:
-                stereoDict = {'image': stereo['image']['image'], 'key': 'stereo'}
-                if not test:
-                    structInfo = self.getStructInfo(stereo['structureData']['structure'])
-                    stereoDict.update(structInfo)
-                stereoList.append(stereoDict)
+                stereoList.append(self.getStereoStruct(stereo, test))
             return stereoList
         except KeyError as ke:
             logging.warning("key error: {} @ jchem rest".format(ke))
             return None
 
+    def getStereoStruct(self, stereo, test=False):
+        stereoDict = {'image': self.storeImage(stereo['image']), 'key': 'stereo'}
+        if not test:
+            structInfo = self.getStructInfo(stereo['structureData']['structure'])
+            stereoDict.update(structInfo)
+        return stereoDict
+
+    def iterStereoisomers(self, structure, max_count=None, test=False):
+        """
+        Generator of stereoisomer dicts (as in getStereoisomers) for
+        structure, built as the response is parsed. Stops after
+        max_count stereoisomers without reading the rest of the response.
+        """
+        _parameters = None
+        if max_count:
+            _parameters = {'maxStructureCount': min(max_count, self.postData['maxStructureCount'])}
+        stereos = self.stream_data_request(structure, self, parameters=_parameters)
+        count = 0
+        try:
+            for stereo in stereos:
+                yield self.getStereoStruct(stereo, test)
+                count += 1
+                if max_count and count >= max_count:
+                    break
+        except KeyError as ke:
+            logging.warning("key error: {} @ jchem rest".format(ke))
+        finally:
+            stereos.close()
+
 
 
 class Solubility(JchemProperty):
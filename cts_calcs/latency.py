@@ -0,0 +1,142 @@
+"""
+Per-endpoint latency tracking for adaptive timeouts and hedged requests.
+
+LatencyTracker keeps a window of recent response times per endpoint
+(backend plus path). A request that times out is recorded at the time
+it waited, so the window isn't censored to the requests that beat the
+current timeout. With CTS_ADAPTIVE_TIMEOUTS=1, once an endpoint has
+enough samples its timeout becomes a multiple of the observed p99,
+between a floor of CTS_TIMEOUT_FLOOR x the caller's flat timeout (e.g.,
+SparcCalc.request_timeout) and that timeout as the ceiling. An
+endpoint's p95 is the delay after which a hedged duplicate request is
+sent.
+"""
+
+import collections
+import os
+import threading
+
+from urllib.parse import urlsplit
+
+
+MIN_SAMPLES = int(os.environ.get('CTS_LATENCY_MIN_SAMPLES', 20))
+WINDOW_SIZE = int(os.environ.get('CTS_LATENCY_WINDOW', 500))
+TIMEOUT_MULTIPLIER = float(os.environ.get('CTS_TIMEOUT_MULTIPLIER', 3.0))  # x p99
+MIN_TIMEOUT = float(os.environ.get('CTS_MIN_TIMEOUT', 1.0))  # seconds
+TIMEOUT_FLOOR = float(os.environ.get('CTS_TIMEOUT_FLOOR', 0.25))  # x the caller's timeout
+ADAPTIVE_TIMEOUTS = os.environ.get('CTS_ADAPTIVE_TIMEOUTS', '0') == '1'
+
+
+
+def endpoint_key(url):
+	"""
+	Returns host + path for url, ignoring query string.
+	"""
+	parts = urlsplit(url if '//' in url else '//' + url)
+	return parts.netloc + parts.path
+
+
+
+class EndpointLatency(object):
+	"""
+	Sliding window of latencies (seconds) for one endpoint.
+	"""
+
+	def __init__(self, window_size=WINDOW_SIZE):
+		self.samples = collections.deque(maxlen=window_size)
+		self._lock = threading.Lock()
+
+	def record(self, latency):
+		with self._lock:
+			self.samples.append(latency)
+
+	def count(self):
+		return len(self.samples)
+
+	def percentile(self, pct):
+		with self._lock:
+			ordered = sorted(self.samples)
+		if not ordered:
+			return None
+		index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+		return ordered[index]
+
+
+
+class LatencyTracker(object):
+	"""
+	Tracks latencies per endpoint and derives timeouts and hedge delays.
+	"""
+
+	def __init__(self, min_samples=MIN_SAMPLES, multiplier=TIMEOUT_MULTIPLIER, min_timeout=MIN_TIMEOUT,
+			floor=TIMEOUT_FLOOR, adaptive=ADAPTIVE_TIMEOUTS):
+		self.min_samples = min_samples
+		self.multiplier = multiplier
+		self.min_timeout = min_timeout
+		self.floor = floor
+		self.adaptive = adaptive
+		self.endpoints = {}
+		self._lock = threading.Lock()
+
+	def get_endpoint(self, url):
+		key = endpoint_key(url)
+		endpoint = self.endpoints.get(key)
+		if endpoint is None:
+			with self._lock:
+				endpoint = self.endpoints.setdefault(key, EndpointLatency())
+		return endpoint
+
+	def record(self, url, latency):
+		"""
+		Records a response time, or for a timed out request the time
+		waited (a lower bound on the response time).
+		"""
+		self.get_endpoint(url).record(latency)
+
+	def timeout_for(self, url, ceiling=None):
+		"""
+		Returns timeout from url's observed p99, within [min_timeout
+		and floor x ceiling, ceiling], or ceiling if adaptive timeouts
+		are off or until enough samples.
+		"""
+		endpoint = self.get_endpoint(url)
+		if not self.adaptive or endpoint.count() < self.min_samples:
+			return ceiling
+		timeout = max(self.min_timeout, self.multiplier * endpoint.percentile(99))
+		if ceiling:
+			timeout = min(ceiling, max(timeout, self.floor * ceiling))
+		return timeout
+
+	def hedge_delay(self, url):
+		"""
+		Returns p95 latency for url, or None until enough samples.
+		"""
+		endpoint = self.get_endpoint(url)
+		if endpoint.count() < self.min_samples:
+			return None
+		return endpoint.percentile(95)
+
+	def expected_latency(self, url):
+		"""
+		Returns p50 latency for url, or None until enough samples.
+		"""
+		endpoint = self.get_endpoint(url)
+		if endpoint.count() < self.min_samples:
+			return None
+		return endpoint.percentile(50)
+
+	def stats(self):
+		return dict((key, {
+			'count': endpoint.count(),
+			'p50': endpoint.percentile(50),
+			'p95': endpoint.percentile(95),
+			'p99': endpoint.percentile(99)
+		}) for key, endpoint in list(self.endpoints.items()))
+
+
+
+_latency_tracker = LatencyTracker()
+
+
+def get_latency_tracker():
+	return _latency_tracker
@@ -0,0 +1,74 @@
+"""
+Deferred imports for heavy dependencies.
+
+requests (with urllib3, certifi, idna, ...) accounts for most of the
+time it takes to import the calculators, and pytz is only needed to
+stamp job ids. Modules bind them with lazy_import(), which returns a
+LazyModule right away and imports the real module on first attribute
+access, so short-lived CLI and serverless runs that never reach a
+backend (cache or snapshot hits, replayed archives) don't pay for them.
+The first access is often from concurrent threads (combinedRequest,
+hedging, fan_out), so it's made under a lock; nothing lazy is ever put
+in sys.modules.
+
+	requests = lazy_import('requests')
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+
+
+
+class LazyModule(object):
+	"""
+	Stand-in for a module that imports it, under a lock, the first
+	time an attribute is read, then hands out the real module's
+	attributes. The real import goes through importlib as usual, so
+	sys.modules only ever holds fully executed modules and threads
+	that race to the first access all wait for the same import.
+	"""
+
+	def __init__(self, name):
+		self._name = name
+		self._module = None
+		self._lock = threading.Lock()
+
+	def _load(self):
+		module = self._module
+		if module is None:
+			with self._lock:
+				if self._module is None:
+					self._module = importlib.import_module(self._name)
+				module = self._module
+		return module
+
+	def __getattr__(self, attr):
+		if attr.startswith('__') and attr.endswith('__'):
+			raise AttributeError(attr)  # copy/pickle/inspect probes don't trigger the import
+		return getattr(self._load(), attr)
+
+	def __repr__(self):
+		return "<lazy module {!r}{}>".format(self._name, '' if self._module is None else ' (loaded)')
+
+
+
+def lazy_import(name):
+	"""
+	Returns module name if it's already imported, else a
+	LazyModule that imports it on first attribute access.
+	"""
+	module = sys.modules.get(name)
+	if module is not None:
+		return module
+	if importlib.util.find_spec(name) is None:
+		raise ImportError("No module named {}".format(name), name=name)
+	return LazyModule(name)
+
+
+def is_loaded(name):
+	"""
+	True once module name has actually been executed.
+	"""
+	return name in sys.modules
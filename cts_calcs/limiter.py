@@ -0,0 +1,290 @@
+"""
+Per-backend request limiting for the SPARC, JChem WS and CTSWS servers.
+
+Each backend (keyed by scheme://host[:port] of the request url) gets a
+BackendLimiter combining a TokenBucket, for a hard requests/second cap,
+with an AIMDLimiter whose concurrency limit grows additively while the
+backend answers promptly and is cut multiplicatively on timeouts, 5xx
+responses or rising latency. Endpoints on one backend have very
+different normal latencies (SPARC multiProperty vs. logd, JChem detail
+vs. tautomerization), so latency is judged per endpoint: the median of
+its recent responses against its own uncongested baseline (a low
+percentile over a longer window). Batch throughput then settles near
+what each backend can sustain without manual tuning.
+Requests waiting for a slot are admitted in weighted fair order by
+priority class (see scheduler).
+
+Limits are configured with configure_backend() or the CTS_BACKEND_LIMITS
+env var, a JSON object of {base_url: {rate, burst, initial_limit,
+min_limit, max_limit, latency_tolerance, weights, interactive_reserve}}.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from .scheduler import FairQueue
+
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_OVERLOAD = 'overload'  # 5xx, 429, connection refused/reset
+OUTCOME_ERROR = 'error'  # client-side errors that say nothing about load
+
+RECENT_SAMPLES = 16  # responses whose median is an endpoint's current latency
+BASELINE_WINDOW = 256  # responses the baseline is taken over
+BASELINE_PERCENTILE = 10
+BASELINE_REFRESH = 32  # responses between baseline recomputations
+
+
+
+class TokenBucket(object):
+	"""
+	Hard rate cap of 'rate' requests/second with bursts up to 'burst'.
+	A rate of None disables the cap.
+	"""
+
+	def __init__(self, rate=None, burst=None):
+		self.rate = rate
+		self.burst = burst or (max(1.0, rate) if rate else 1.0)
+		self.tokens = self.burst
+		self.updated = time.time()
+		self._lock = threading.Lock()
+
+	def _refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self, timeout=None):
+		"""
+		Takes a token, waiting up to timeout seconds. Returns True if taken.
+		"""
+		if not self.rate:
+			return True
+		end_time = time.time() + timeout if timeout is not None else None
+		while True:
+			with self._lock:
+				now = time.time()
+				self._refill(now)
+				if self.tokens >= 1.0:
+					self.tokens -= 1.0
+					return True
+				wait_time = (1.0 - self.tokens) / self.rate
+			if end_time is not None:
+				if now >= end_time:
+					return False
+				wait_time = min(wait_time, end_time - now)
+			time.sleep(wait_time)
+
+
+
+class LatencyBaseline(object):
+	"""
+	One endpoint's latency signal: median of its last RECENT_SAMPLES
+	responses vs. the BASELINE_PERCENTILE of its last BASELINE_WINDOW.
+	A single slow response (a large molecule, a GC pause) moves neither.
+	"""
+
+	def __init__(self):
+		self.recent = collections.deque(maxlen=RECENT_SAMPLES)
+		self.window = collections.deque(maxlen=BASELINE_WINDOW)
+		self.baseline = None
+		self._since_refresh = 0
+
+	def record(self, latency):
+		self.recent.append(latency)
+		self.window.append(latency)
+		self._since_refresh += 1
+		if self.baseline is None or latency < self.baseline or self._since_refresh >= BASELINE_REFRESH:
+			ordered = sorted(self.window)
+			self.baseline = ordered[int(len(ordered) * BASELINE_PERCENTILE / 100)]
+			self._since_refresh = 0
+
+	def current(self):
+		ordered = sorted(self.recent)
+		return ordered[len(ordered) // 2]
+
+	def congested(self, tolerance):
+		"""
+		Returns True once recent latency exceeds tolerance x baseline.
+		"""
+		if len(self.recent) < RECENT_SAMPLES:
+			return False
+		return self.current() > self.baseline * tolerance
+
+
+
+class AIMDLimiter(object):
+	"""
+	Additive-increase/multiplicative-decrease concurrency limit.
+	"""
+
+	def __init__(self, initial_limit=4, min_limit=1, max_limit=64, backoff=0.5, latency_tolerance=2.5,
+			weights=None, interactive_reserve=None):
+		self.limit = float(initial_limit)
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.backoff = backoff
+		self.latency_tolerance = latency_tolerance  # x an endpoint's baseline that counts as congestion
+		self.baselines = {}  # endpoint: LatencyBaseline
+		self.inflight = 0
+		self._last_decrease = 0.0
+		self._cond = threading.Condition()
+		self.queue = FairQueue(weights, interactive_reserve)
+
+	def acquire(self, timeout=None, priority=None):
+		end_time = time.time() + timeout if timeout is not None else None
+		with self._cond:
+			ticket = self.queue.enqueue(priority)
+			while not self.queue.can_admit(ticket, self.inflight, int(self.limit)):
+				wait_time = None
+				if end_time is not None:
+					wait_time = end_time - time.time()
+					if wait_time <= 0:
+						self.queue.cancel(ticket)
+						self._cond.notify_all()  # the next waiter may be due the slot
+						return False
+				self._cond.wait(wait_time)
+			self.queue.admit(ticket)
+			self.inflight += 1
+			if self.queue.waiting() and self.inflight < int(self.limit):
+				self._cond.notify_all()
+			return True
+
+	def release(self, latency=None, outcome=OUTCOME_SUCCESS, endpoint=None):
+		"""
+		Frees a slot and adapts the limit to the request's outcome and
+		latency, judged against endpoint's (e.g., url path's) baseline.
+		"""
+		with self._cond:
+			self.inflight = max(0, self.inflight - 1)
+			if outcome == OUTCOME_SUCCESS and latency is not None:
+				baseline = self.baselines.get(endpoint)
+				if baseline is None:
+					baseline = self.baselines[endpoint] = LatencyBaseline()
+				baseline.record(latency)
+				if baseline.congested(self.latency_tolerance):
+					self._decrease(baseline.current())
+				else:
+					self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+			elif outcome in (OUTCOME_TIMEOUT, OUTCOME_OVERLOAD):
+				self._decrease(latency)
+			self._cond.notify_all()
+
+	def baseline_stats(self):
+		with self._cond:
+			return dict((endpoint, {'baseline': baseline.baseline, 'current': baseline.current()})
+				for endpoint, baseline in self.baselines.items())
+
+	def queue_stats(self):
+		with self._cond:
+			return self.queue.stats()
+
+	def _decrease(self, latency=None):
+		# one decrease per latency window, so a burst of failures
+		# from the same overload doesn't collapse the limit to min
+		now = time.time()
+		window = max(latency or 0.0, 0.1)
+		if now - self._last_decrease < window:
+			return
+		self._last_decrease = now
+		self.limit = max(self.min_limit, self.limit * self.backoff)
+
+
+
+class BackendLimiter(object):
+	"""
+	Token bucket and AIMD concurrency limit for one backend.
+	"""
+
+	def __init__(self, name, rate=None, burst=None, **aimd_kwargs):
+		self.name = name
+		self.bucket = TokenBucket(rate, burst)
+		self.concurrency = AIMDLimiter(**aimd_kwargs)
+
+	def acquire(self, timeout=None, priority=None):
+		"""
+		Waits for a concurrency slot and a rate token. Returns True
+		if both were taken before timeout.
+		"""
+		start_time = time.time()
+		if not self.concurrency.acquire(timeout, priority):
+			return False
+		remaining = None if timeout is None else max(0.0, timeout - (time.time() - start_time))
+		if not self.bucket.acquire(remaining):
+			self.concurrency.release(outcome=OUTCOME_ERROR)
+			return False
+		return True
+
+	def release(self, latency=None, outcome=OUTCOME_SUCCESS, endpoint=None):
+		self.concurrency.release(latency, outcome, endpoint)
+
+	def stats(self):
+		return {
+			'backend': self.name,
+			'limit': self.concurrency.limit,
+			'inflight': self.concurrency.inflight,
+			'latency': self.concurrency.baseline_stats(),
+			'rate': self.bucket.rate,
+			'priorities': self.concurrency.queue_stats()
+		}
+
+
+
+def backend_key(url):
+	"""
+	Returns scheme://host[:port] for url (urls without scheme, like
+	the 'localhost:8080' default jchem server, are keyed as-is).
+	"""
+	parts = urlsplit(url if '//' in url else '//' + url)
+	if parts.scheme:
+		return "{}://{}".format(parts.scheme, parts.netloc)
+	return parts.netloc
+
+
+def load_backend_limits():
+	try:
+		return json.loads(os.environ.get('CTS_BACKEND_LIMITS', '{}'))
+	except ValueError as e:
+		logging.warning("Could not parse CTS_BACKEND_LIMITS: {}".format(e))
+		return {}
+
+
+_backend_config = dict((backend_key(url), config) for url, config in load_backend_limits().items())
+_backend_limiters = {}
+_backend_lock = threading.Lock()
+
+
+def configure_backend(base_url, **config):
+	"""
+	Sets limits for a backend (rate, burst, initial_limit, min_limit,
+	max_limit, backoff, latency_tolerance), replacing its limiter.
+	"""
+	key = backend_key(base_url)
+	with _backend_lock:
+		_backend_config[key] = config
+		_backend_limiters.pop(key, None)
+
+
+def get_backend_limiter(url):
+	"""
+	Returns the process-wide BackendLimiter for url's backend.
+	"""
+	key = backend_key(url)
+	limiter = _backend_limiters.get(key)
+	if limiter is None:
+		with _backend_lock:
+			limiter = _backend_limiters.get(key)
+			if limiter is None:
+				limiter = BackendLimiter(key, **_backend_config.get(key, {}))
+				_backend_limiters[key] = limiter
+	return limiter
+
+
+def backend_stats():
+	return [limiter.stats() for limiter in list(_backend_limiters.values())]
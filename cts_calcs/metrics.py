@@ -0,0 +1,382 @@
+"""
+Process-wide metrics in Prometheus text format.
+
+Counters and histograms are updated inline by the request paths:
+
+	cts_upstream_request_seconds     transport, per backend/endpoint/outcome
+	cts_upstream_responses_total     transport, per backend/endpoint/status
+	cts_backend_busy_total           transport, no limiter slot in time
+	cts_calc_requests_total          request_logic, make_data_request and
+	                                 web_call, per calc and result (valid,
+	                                 cached, negative_cached, failed)
+	cts_calc_request_seconds         the same calls, retries included
+	cts_calc_retries_total           retry attempts
+	cts_calc_timeouts_total          attempts that timed out
+	cts_validation_failures_total    responses rejected by validation (e.g.
+	                                 SPARC LOGD without plotCoordinates)
+	cts_filter_seconds               filterSMILES, parseSmilesByCalculators
+	cts_filter_rejections_total      structures the filters turned away
+
+Cache hit counts and limiter queue depths already live on their objects
+(ResultCache, AliasIndex, NegativeCache, BackendLimiter), so they're
+read by collectors at scrape time instead of being counted twice.
+
+Expose with start_http_server() for scraping at /metrics, or
+write_textfile() for node_exporter's textfile collector. Importing the
+package starts neither: a worker calls start_exporters() once at
+startup, which serves CTS_METRICS_PORT and/or rewrites
+CTS_METRICS_TEXTFILE every CTS_METRICS_INTERVAL seconds, as set.
+Each process has its own registry; give workers their own port or file.
+CTS_METRICS=0 turns instrumentation into a flag check.
+"""
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+
+
+METRICS_ENABLED = os.environ.get('CTS_METRICS', '1') == '1'
+METRICS_PORT = int(os.environ.get('CTS_METRICS_PORT') or 0)
+METRICS_TEXTFILE = os.environ.get('CTS_METRICS_TEXTFILE')
+METRICS_INTERVAL = float(os.environ.get('CTS_METRICS_INTERVAL', 15))  # seconds between textfile dumps
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+
+def escape_label(value):
+	return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values):
+	if not names:
+		return ''
+	return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+	if value == float('inf'):
+		return '+Inf'
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value)) if abs(value) < 1e15 else repr(value)
+	return repr(value) if isinstance(value, float) else str(value)
+
+
+
+class Counter(object):
+	"""
+	Monotonic count per label values.
+	"""
+
+	type_name = 'counter'
+
+	def __init__(self, name, documentation, labelnames=()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def inc(self, *labels, amount=1):
+		if not _enabled:
+			return
+		with self._lock:
+			self._values[labels] = self._values.get(labels, 0) + amount
+
+	def value(self, *labels):
+		return self._values.get(labels, 0)
+
+	def samples(self):
+		with self._lock:
+			items = list(self._values.items())
+		return [(self.name, self.labelnames, labels, value) for labels, value in sorted(items)]
+
+
+
+class Histogram(object):
+	"""
+	Cumulative bucket counts, sum and count per label values.
+	"""
+
+	type_name = 'histogram'
+
+	def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self.buckets = tuple(sorted(buckets))
+		self._values = {}  # labels: [bucket counts..., +Inf count, sum]
+		self._lock = threading.Lock()
+
+	def observe(self, value, *labels):
+		if not _enabled:
+			return
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			counts = self._values.get(labels)
+			if counts is None:
+				counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+			counts[index] += 1
+			counts[-1] += value
+
+	def count(self, *labels):
+		counts = self._values.get(labels)
+		return sum(counts[:-1]) if counts else 0
+
+	def samples(self):
+		with self._lock:
+			items = [(labels, list(counts)) for labels, counts in self._values.items()]
+		samples = []
+		bucket_names = self.labelnames + ('le',)
+		for labels, counts in sorted(items):
+			cumulative = 0
+			for bound, count in zip(self.buckets + (float('inf'),), counts):
+				cumulative += count
+				samples.append((self.name + '_bucket', bucket_names, labels + (format_value(float(bound)),), cumulative))
+			samples.append((self.name + '_sum', self.labelnames, labels, counts[-1]))
+			samples.append((self.name + '_count', self.labelnames, labels, cumulative))
+		return samples
+
+
+
+class MetricsRegistry(object):
+	"""
+	Named metrics plus collectors read at exposition time.
+	"""
+
+	def __init__(self):
+		self.metrics = {}
+		self.collectors = []
+		self._lock = threading.Lock()
+
+	def register(self, metric):
+		with self._lock:
+			return self.metrics.setdefault(metric.name, metric)
+
+	def counter(self, name, documentation, labelnames=()):
+		return self.register(Counter(name, documentation, labelnames))
+
+	def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+		return self.register(Histogram(name, documentation, labelnames, buckets))
+
+	def add_collector(self, collector):
+		"""
+		Adds collector() returning [(name, type, help, labelnames,
+		[(label values, value)])], called on every exposition.
+		"""
+		with self._lock:
+			self.collectors.append(collector)
+		return collector
+
+	def exposition(self):
+		"""
+		Returns all metrics in Prometheus text format (0.0.4).
+		"""
+		lines = []
+		for metric in sorted(list(self.metrics.values()), key=lambda metric: metric.name):
+			lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+			lines.append('# TYPE {} {}'.format(metric.name, metric.type_name))
+			for name, labelnames, labels, value in metric.samples():
+				lines.append('{}{} {}'.format(name, format_labels(labelnames, labels), format_value(value)))
+		for collector in list(self.collectors):
+			try:
+				families = collector()
+			except Exception as e:
+				logging.warning("Metrics collector {} failed: {}".format(getattr(collector, '__name__', collector), e))
+				continue
+			for name, type_name, documentation, labelnames, values in families:
+				lines.append('# HELP {} {}'.format(name, documentation))
+				lines.append('# TYPE {} {}'.format(name, type_name))
+				for labels, value in values:
+					if value is not None:
+						lines.append('{}{} {}'.format(name, format_labels(labelnames, labels), format_value(value)))
+		return '\n'.join(lines) + '\n'
+
+
+
+_registry = MetricsRegistry()
+_enabled = METRICS_ENABLED
+
+
+def get_registry():
+	return _registry
+
+
+def enable_metrics():
+	global _enabled
+	_enabled = True
+
+
+def disable_metrics():
+	global _enabled
+	_enabled = False
+
+
+def counter(name, documentation, labelnames=()):
+	return _registry.counter(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+	return _registry.histogram(name, documentation, labelnames, buckets)
+
+
+def timed(metric, *labels):
+	"""
+	Decorator observing each call's duration in histogram metric.
+	"""
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			start_time = time.time()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				metric.observe(time.time() - start_time, *labels)
+		return wrapper
+	return decorator
+
+
+
+UPSTREAM_SECONDS = histogram('cts_upstream_request_seconds', "Upstream request latency.", ['backend', 'endpoint', 'outcome'])
+UPSTREAM_RESPONSES = counter('cts_upstream_responses_total', "Upstream responses by HTTP status.", ['backend', 'endpoint', 'status'])
+BACKEND_BUSY = counter('cts_backend_busy_total', "Requests that got no backend slot in time.", ['backend'])
+CALC_REQUESTS = counter('cts_calc_requests_total', "Calculator requests by result.", ['calc', 'result'])
+CALC_SECONDS = histogram('cts_calc_request_seconds', "Calculator request latency, retries included.", ['calc'])
+CALC_RETRIES = counter('cts_calc_retries_total', "Calculator request retries.", ['calc'])
+CALC_TIMEOUTS = counter('cts_calc_timeouts_total', "Calculator request attempts that timed out.", ['calc'])
+VALIDATION_FAILURES = counter('cts_validation_failures_total', "Responses rejected by validation.", ['calc', 'reason'])
+FILTER_SECONDS = histogram('cts_filter_seconds', "SMILES filter pipeline latency.", ['step'])
+FILTER_REJECTIONS = counter('cts_filter_rejections_total', "Structures rejected by the SMILES filters.", ['reason'])
+
+
+
+def collect_caches():
+	from .cache import _result_cache
+	from .alias_index import _alias_index
+	from .negative_cache import get_negative_cache
+	lookups = []
+	if _result_cache is not None:
+		lookups += [(('result', 'hit'), _result_cache.hits), (('result', 'miss'), _result_cache.misses)]
+	if _alias_index is not None:
+		lookups += [(('alias', 'hit'), _alias_index.hits), (('alias', 'miss'), _alias_index.misses)]
+	negative_stats = get_negative_cache().stats()
+	return [
+		('cts_cache_lookups_total', 'counter', "Cache lookups by cache and result.", ('cache', 'result'), lookups),
+		('cts_negative_cache_hits_total', 'counter', "Requests answered by the negative cache.", (), [((), negative_stats['hits'])]),
+		('cts_negative_cache_stored_total', 'counter', "Permanent failures stored.", (), [((), negative_stats['stored'])]),
+	]
+
+
+def collect_limiters():
+	from .limiter import backend_stats
+	limits, inflight, depth, admitted, timed_out = [], [], [], [], []
+	for stats in backend_stats():
+		backend = stats['backend']
+		limits.append(((backend,), stats['limit']))
+		inflight.append(((backend,), stats['inflight']))
+		for priority_class, queue_stats in sorted(stats['priorities'].items()):
+			depth.append(((backend, priority_class), queue_stats['depth']))
+			admitted.append(((backend, priority_class), queue_stats['admitted']))
+			timed_out.append(((backend, priority_class), queue_stats['timed_out']))
+	return [
+		('cts_backend_concurrency_limit', 'gauge', "Current AIMD concurrency limit.", ('backend',), limits),
+		('cts_backend_inflight', 'gauge', "Requests holding a backend slot.", ('backend',), inflight),
+		('cts_backend_queue_depth', 'gauge', "Requests waiting for a backend slot.", ('backend', 'priority'), depth),
+		('cts_backend_admitted_total', 'counter', "Requests admitted to a backend slot.", ('backend', 'priority'), admitted),
+		('cts_backend_queue_timeouts_total', 'counter', "Requests that gave up waiting for a slot.", ('backend', 'priority'), timed_out),
+	]
+
+
+_registry.add_collector(collect_caches)
+_registry.add_collector(collect_limiters)
+
+
+
+def write_textfile(path, registry=None):
+	"""
+	Writes exposition to path atomically (temp file and rename),
+	as node_exporter's textfile collector expects.
+	"""
+	registry = registry or _registry
+	tmp_path = "{}.{}.tmp".format(path, os.getpid())
+	with open(tmp_path, 'w') as textfile:
+		textfile.write(registry.exposition())
+	os.replace(tmp_path, path)
+	return path
+
+
+def start_textfile_writer(path, interval=METRICS_INTERVAL, registry=None):
+	"""
+	Rewrites path every interval seconds from a daemon thread.
+	"""
+	def run():
+		while True:
+			try:
+				write_textfile(path, registry)
+			except Exception as e:
+				logging.warning("Could not write metrics to {}: {}".format(path, e))
+			time.sleep(interval)
+	thread = threading.Thread(target=run, name='cts-metrics-textfile')
+	thread.daemon = True
+	thread.start()
+	return thread
+
+
+def start_http_server(port=METRICS_PORT, addr='', registry=None):
+	"""
+	Serves exposition at /metrics from a daemon thread.
+	Returns the server (server.server_port for port=0).
+	"""
+	from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+	registry = registry or _registry
+
+	class MetricsHandler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			if self.path.split('?')[0] not in ('/', '/metrics'):
+				self.send_error(404)
+				return
+			body = registry.exposition().encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', CONTENT_TYPE)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer((addr, port), MetricsHandler)
+	server.daemon_threads = True
+	thread = threading.Thread(target=server.serve_forever, name='cts-metrics-http')
+	thread.daemon = True
+	thread.start()
+	logging.info("Serving metrics on {}:{}/metrics".format(addr or '0.0.0.0', server.server_port))
+	return server
+
+
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port=None, textfile=None, interval=None):
+	"""
+	Starts the HTTP server on port and the textfile writer for textfile
+	(defaults: CTS_METRICS_PORT and CTS_METRICS_TEXTFILE, either off if
+	unset), once per process. Returns (server, textfile thread), None
+	for an exporter that's off.
+	"""
+	global _exporters
+	with _exporters_lock:
+		if _exporters is None:
+			port = METRICS_PORT if port is None else port
+			textfile = METRICS_TEXTFILE if textfile is None else textfile
+			server = start_http_server(port) if port else None
+			thread = start_textfile_writer(textfile, interval or METRICS_INTERVAL) if textfile else None
+			_exporters = (server, thread)
+		return _exporters
@@ -0,0 +1,118 @@
+"""
+Negative cache for requests that can't succeed.
+
+Invalid structures ("Chemical not recognized", "Chemical cannot be a
+salt or mixture", "structure too large", ...) and permanent backend
+rejections (HTTP 400, 404, 413, 422) fail the same way every time, yet
+each resubmission used to pay the full max_retries loop. Failures are
+classified as permanent or transient from the error message
+(check_response_for_errors/handle_error_messages, filter errors) and
+the HTTP status; permanent ones are stored in the result cache, under
+their own keys, for CTS_NEGATIVE_TTL seconds (default 3600, 0 to turn
+off), and the next identical request is rejected without a round trip.
+5xx, 429 and timeouts are transient and never stored.
+
+Used by web_call, SparcCalc.request_logic, JchemProperty.make_data_request,
+SMILESFilter.filterSMILES and parseSmilesByCalculators.
+"""
+
+import logging
+import os
+import time
+
+from .cache import get_result_cache
+
+
+NEGATIVE_TTL = int(os.environ.get('CTS_NEGATIVE_TTL', 3600))
+
+FAILURE_PERMANENT = 'permanent'
+FAILURE_TRANSIENT = 'transient'
+
+PERMANENT_MESSAGES = [
+	"Chemical not recognized",
+	"Chemical cannot be standardized",
+	"Chemical cannot be a salt or mixture",
+	"Chemical cannot contain metals",
+	"CTS only accepts organic chemicals",
+	"Not a valid name",
+	"structure too large",
+	"cannot process metals or charges",
+]
+PERMANENT_STATUSES = [400, 404, 413, 422]
+TRANSIENT_STATUSES = [408, 429]
+
+
+
+def classify_failure(message=None, status=None):
+	"""
+	Returns FAILURE_PERMANENT or FAILURE_TRANSIENT. The status wins
+	over the message: jchem wraps server errors in the same error
+	keys as bad structures.
+	"""
+	if status is not None:
+		if status in PERMANENT_STATUSES:
+			return FAILURE_PERMANENT
+		if status >= 500 or status in TRANSIENT_STATUSES:
+			return FAILURE_TRANSIENT
+	if message in PERMANENT_MESSAGES:
+		return FAILURE_PERMANENT
+	return FAILURE_TRANSIENT
+
+
+
+class NegativeCache(object):
+	"""
+	Permanent failures keyed like the results they stand in for.
+	"""
+
+	def __init__(self, result_cache=None, ttl=NEGATIVE_TTL):
+		self._result_cache = result_cache
+		self.ttl = ttl
+		self.hits = 0
+		self.stored = 0
+
+	@property
+	def result_cache(self):
+		# follows set_result_cache() unless given a cache of its own
+		return self._result_cache or get_result_cache()
+
+	def get(self, kind, *parts):
+		"""
+		Returns stored failure dict (keys: error, status, data) or None.
+		"""
+		if not self.ttl:
+			return None
+		failure = self.result_cache.get(self.result_cache.make_key('neg:' + kind, *parts))
+		if failure is not None:
+			self.hits += 1
+			logging.info("Negative cache hit ({}): {}".format(kind, failure.get('error')))
+		return failure
+
+	def record(self, kind, parts, message=None, status=None, data=None):
+		"""
+		Classifies a failure and stores it if permanent.
+		Returns the classification.
+		"""
+		classification = classify_failure(message, status)
+		if classification == FAILURE_PERMANENT and self.ttl:
+			failure = {'error': message, 'status': status, 'data': data, 'recorded_at': time.time()}
+			self.result_cache.set(self.result_cache.make_key('neg:' + kind, *parts), failure, ttl=self.ttl)
+			self.stored += 1
+		return classification
+
+	def stats(self):
+		return {'hits': self.hits, 'stored': self.stored, 'ttl': self.ttl}
+
+
+
+_negative_cache = NegativeCache()
+
+
+def get_negative_cache():
+	return _negative_cache
+
+
+def set_negative_cache(cache):
+	global _negative_cache
+	_negative_cache = cache
+	return cache
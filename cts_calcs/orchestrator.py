@@ -0,0 +1,146 @@
+"""
+One-call p-chem fan-out for a chemical across calculators.
+
+fan_out(chemical, {calc: [props]}) filters the chemical once for all
+requested calculators (SMILESFilter.parseSmilesByCalculators), then
+runs every calculator's calls at once and yields {calc, prop, data}
+objects as they arrive, instead of the caller running chemaxon and
+SPARC one after the other:
+
+	for data_obj in fan_out(smiles, {'chemaxon': ['water_sol', 'kow_no_ph'], 'sparc': ['water_sol', 'ion_con']}):
+		...
+
+Each calculator runs on its own bounded worker pool (CTS_FANOUT_WORKERS,
+default chemaxon=8,sparc=4), on top of the per-backend limits in
+limiter. chemaxon gets one call per prop (and per method for props
+that take one, unless a method is given); SPARC gets one combined-mode
+data_request_handler call. Props a calculator doesn't serve, and
+calculators the chemical can't be filtered for, are yielded first.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+from .calcs_metadata import CalcRouter, CALC_CAPABILITIES
+from .smilesfilter import SMILESFilter
+from .scheduler import with_priority
+from . import deadline
+
+
+DEFAULT_CALC_WORKERS = {'chemaxon': 8, 'sparc': 4}
+
+
+
+def parse_calc_workers(value):
+	"""
+	Parses "chemaxon=8,sparc=4" into a workers dict.
+	"""
+	workers = dict(DEFAULT_CALC_WORKERS)
+	for item in (value or '').split(','):
+		calc, _, count = item.partition('=')
+		if calc.strip():
+			workers[calc.strip()] = int(count)
+	return workers
+
+
+CALC_WORKERS = parse_calc_workers(os.environ.get('CTS_FANOUT_WORKERS'))
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+
+def get_calc_executor(calc):
+	"""
+	Returns the process-wide worker pool for calc.
+	"""
+	with _executors_lock:
+		executor = _executors.get(calc)
+		if executor is None:
+			executor = concurrent.futures.ThreadPoolExecutor(max_workers=CALC_WORKERS.get(calc, 4))
+			_executors[calc] = executor
+		return executor
+
+
+def run_chemaxon(smiles, prop, ph, method, expires_at):
+	from .jchem_properties import JchemProperty
+	request_dict = {'chemical': smiles, 'calc': 'chemaxon', 'prop': prop, 'ph': ph, 'method': method, 'deadline': expires_at}
+	return [JchemProperty().getJchemPropData(request_dict)]
+
+
+def run_sparc(smiles, props, ph, expires_at):
+	from .calculator_sparc import SparcCalc
+	request_dict = {'chemical': smiles, 'calc': 'sparc', 'props': list(props), 'ph': ph, 'combined': True, 'deadline': expires_at}
+	response = SparcCalc(smiles).data_request_handler(request_dict)
+	return response if isinstance(response, list) else [response]
+
+
+def calc_tasks(calls, filtered, ph, method, expires_at):
+	"""
+	Returns [(calc, props, func, args)] for the routed calls.
+	"""
+	tasks = []
+	sparc_props = []
+	for call in calls:
+		calc = call['calc']
+		if calc == 'sparc':
+			sparc_props.extend(call['props'])
+		elif calc == 'chemaxon':
+			for prop in call['props']:
+				prop_methods = CALC_CAPABILITIES[calc][prop]['methods']
+				for prop_method in ([method] if method or not prop_methods else prop_methods):
+					tasks.append((calc, [prop], run_chemaxon, (filtered[calc], prop, ph, prop_method, expires_at)))
+		else:
+			logging.warning("fan-out doesn't run calc {}".format(calc))
+			for prop in call['props']:
+				tasks.append((calc, [prop], None, None))
+	if sparc_props:
+		tasks.append(('sparc', sparc_props, run_sparc, (filtered['sparc'], sparc_props, ph, expires_at)))
+	return tasks
+
+
+def fan_out(chemical, calc_props, ph=7.0, method=None, time_budget=None):
+	"""
+	Generator of {calc, prop, data} objects for chemical's
+	calc_props ({calc: [props]}), in order of arrival.
+	"""
+	expires_at = time.time() + time_budget if time_budget else None
+	calls, rejected = CalcRouter().route(calc_props, method)
+	for data_obj in rejected:
+		yield data_obj
+
+	calcs = sorted(set(call['calc'] for call in calls))
+	with deadline.deadline(expires_at=expires_at):
+		try:
+			filtered, errors = SMILESFilter().parseSmilesByCalculators(chemical, calcs)
+		except Exception as e:
+			logging.warning("Exception filtering {} for fan-out: {}".format(chemical, e))
+			filtered, errors = {}, dict((calc, {'data': "error filtering chemical"}) for calc in calcs)
+	for call in [call for call in calls if call['calc'] in errors]:
+		for prop in call['props']:
+			yield {'calc': call['calc'], 'prop': prop, 'data': errors[call['calc']].get('data')}
+	calls = [call for call in calls if call['calc'] in filtered]
+
+	futures = {}
+	for calc, props, func, args in calc_tasks(calls, filtered, ph, method, expires_at):
+		if func is None:
+			for prop in props:
+				yield {'calc': calc, 'prop': prop, 'data': "calc not supported"}
+			continue
+		futures[get_calc_executor(calc).submit(with_priority(func), *args)] = (calc, props)
+	try:
+		for future in concurrent.futures.as_completed(futures):
+			calc, props = futures[future]
+			try:
+				data_objs = future.result()
+			except Exception as e:
+				logging.warning("Exception in {} fan-out call for {}: {}".format(calc, props, e))
+				data_objs = [{'calc': calc, 'prop': prop, 'data': "request timed out"} for prop in props]
+			for data_obj in data_objs:
+				yield data_obj
+	finally:
+		for future in futures:
+			future.cancel()  # caller stopped early, drops calls not started yet
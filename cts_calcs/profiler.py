@@ -0,0 +1,135 @@
+"""
+On-demand sampling profiler for live calculator workers.
+
+Functions decorated with @profiled (data_request_handler,
+getJchemPropData, filterSMILES) run under cProfile for a sampled
+fraction of calls while profiling is on, writing one .prof file per
+sampled call and merging it into an aggregate hot-function report.
+When off, the wrapper costs one global flag check.
+
+One call is profiled at a time per process: a sampled call that finds
+another being profiled (in any thread) runs unprofiled, as do calls
+nested in a profiled one. Only the profiled call's own thread is
+covered, so work it fans out to executor threads (parseSmilesByCalculators'
+filters, combined and hedged requests, prop threads) shows up only as
+time waiting on futures.
+
+Turn on with CTS_PROFILE=1 (CTS_PROFILE_RATE, CTS_PROFILE_DIR) or at
+runtime with enable_profiling()/disable_profiling().
+"""
+
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+
+
+_enabled = os.environ.get('CTS_PROFILE', '0') == '1'
+_sample_rate = float(os.environ.get('CTS_PROFILE_RATE', 0.01))
+_output_dir = os.environ.get('CTS_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'cts_profiles')
+_aggregate = None
+_aggregate_lock = threading.Lock()
+_profile_lock = threading.Lock()  # held while a call is being profiled
+
+
+
+def enable_profiling(sample_rate=None, output_dir=None):
+	global _enabled, _sample_rate, _output_dir
+	if sample_rate is not None:
+		_sample_rate = sample_rate
+	if output_dir:
+		_output_dir = output_dir
+	_enabled = True
+
+
+def disable_profiling():
+	global _enabled
+	_enabled = False
+
+
+def is_enabled():
+	return _enabled
+
+
+def profiled(name=None):
+	"""
+	Decorator profiling a sampled fraction of calls while enabled.
+	"""
+	def decorator(func):
+		profile_name = name or func.__name__
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not _enabled or random.random() >= _sample_rate:
+				return func(*args, **kwargs)
+			return run_profiled(profile_name, func, *args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def run_profiled(profile_name, func, *args, **kwargs):
+	"""
+	Runs func under cProfile (calling thread only), or unprofiled if
+	another call is being profiled or another profiler is active.
+	"""
+	if not _profile_lock.acquire(False):
+		return func(*args, **kwargs)  # nested call, or another thread's sample
+	profile = cProfile.Profile()
+	try:
+		profile.enable()
+	except ValueError:
+		# another profiling tool is active (Python 3.12+ allows one)
+		_profile_lock.release()
+		return func(*args, **kwargs)
+	try:
+		return func(*args, **kwargs)
+	finally:
+		profile.disable()
+		_profile_lock.release()
+		try:
+			save_profile(profile_name, profile)
+		except Exception as e:
+			logging.warning("Could not save profile for {}: {}".format(profile_name, e))
+
+
+def save_profile(profile_name, profile):
+	global _aggregate
+	if not os.path.isdir(_output_dir):
+		os.makedirs(_output_dir)
+	profile_path = os.path.join(_output_dir, "{}-{}-{}.prof".format(profile_name, os.getpid(), int(time.time() * 1e6)))
+	profile.dump_stats(profile_path)
+	with _aggregate_lock:
+		if _aggregate is None:
+			_aggregate = pstats.Stats(profile)
+		else:
+			_aggregate.add(profile)
+	return profile_path
+
+
+def hot_function_report(limit=30, sort_by='cumulative'):
+	"""
+	Returns text report of the hottest functions across sampled calls,
+	and writes it to hot_functions.txt in the profile directory.
+	"""
+	with _aggregate_lock:
+		if _aggregate is None:
+			return "no profiles collected"
+		stream = io.StringIO()
+		_aggregate.stream = stream
+		_aggregate.sort_stats(sort_by).print_stats(limit)
+	report = stream.getvalue()
+	with open(os.path.join(_output_dir, 'hot_functions.txt'), 'w') as report_file:
+		report_file.write(report)
+	return report
+
+
+def reset_aggregate():
+	global _aggregate
+	with _aggregate_lock:
+		_aggregate = None
@@ -0,0 +1,267 @@
+"""
+Record/replay HTTP layer for deterministic offline runs.
+
+transport.send_once goes through the recorder, which runs in one of
+three modes, set with CTS_HTTP_MODE or set_mode():
+
+	passthrough - requests go to the backends (default)
+	record      - requests go to the backends and every exchange
+	              (request, response or exception, elapsed time) is
+	              appended to the archive
+	replay      - requests are answered from the archive, no network
+
+The archive (CTS_HTTP_ARCHIVE) is a sqlite file indexed by a hash of
+method, endpoint path and request body; host names are left out so
+replica pools and moved servers replay the same. Repeated identical
+requests replay their recorded responses in order. Replay runs at the
+original speed by default, or as fast as possible with
+CTS_REPLAY_SPEED=fast (or a float speed-up factor, e.g. 10).
+
+A recorded exchange's elapsed time is its time on the wire, as noted
+by the send function with note_wire_time(), not counting waits for a
+backend slot. A streamed (stream=True) response isn't read when it's
+recorded: its body is teed into the archive as the caller reads it,
+and recorded when the caller is done (up to where it stopped).
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+
+MODE_PASSTHROUGH = 'passthrough'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+# headers describing the wire form, not the stored decoded body
+SKIP_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+EXCEPTIONS = {
+	'timeout': 'Timeout',
+	'connection': 'ConnectionError',
+	'error': 'RequestException',
+}  # names in requests.exceptions
+
+_local = threading.local()
+
+
+
+def exchange_key(method, url, data):
+	parts = urlsplit(url if '//' in url else '//' + url)
+	body = data.encode('utf-8') if isinstance(data, str) else (data or b'')
+	hasher = hashlib.sha1()
+	for part in (method.upper().encode('utf-8'), parts.path.encode('utf-8'), parts.query.encode('utf-8'), body):
+		hasher.update(part)
+		hasher.update(b'\x00')
+	return hasher.hexdigest()
+
+
+def note_wire_time(elapsed):
+	"""
+	Called by the send function with the time its request spent on
+	the wire, which record mode stores as the exchange's elapsed time.
+	"""
+	_local.wire_time = elapsed
+
+
+def exception_kind(exception):
+	if isinstance(exception, requests.exceptions.Timeout):
+		return 'timeout'
+	if isinstance(exception, requests.exceptions.ConnectionError):
+		return 'connection'
+	return 'error'
+
+
+
+class HttpArchive(object):
+	"""
+	Indexed sqlite archive of request/response exchanges.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self._replay_positions = {}
+		self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+		self.conn.execute(
+			"CREATE TABLE IF NOT EXISTS exchange ("
+			"id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, method TEXT, url TEXT, "
+			"request_body BLOB, status INTEGER, headers TEXT, body BLOB, error TEXT, "
+			"elapsed REAL, recorded_at TEXT)"
+		)
+		self.conn.execute("CREATE INDEX IF NOT EXISTS exchange_key ON exchange (key, id)")
+		self.conn.commit()
+
+	def record(self, method, url, data, response=None, exception=None, elapsed=0.0, content=None):
+		"""
+		Appends an exchange: response (its body as content, if given,
+		else response.content) or the exception the request raised.
+		"""
+		body = data.encode('utf-8') if isinstance(data, str) else data
+		status, headers, error = None, None, None
+		if response is not None:
+			status = response.status_code
+			headers = json.dumps(dict((key, value) for key, value in response.headers.items() if key.lower() not in SKIP_HEADERS))
+			if content is None:
+				content = response.content
+		else:
+			error = json.dumps({'kind': exception_kind(exception), 'message': str(exception)})
+		with self._lock:
+			self.conn.execute(
+				"INSERT INTO exchange (key, method, url, request_body, status, headers, body, error, elapsed, recorded_at) "
+				"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				(exchange_key(method, url, data), method, url, body, status, headers, content, error, elapsed,
+					datetime.datetime.utcnow().isoformat())
+			)
+			self.conn.commit()
+
+	def next_exchange(self, method, url, data):
+		"""
+		Returns next recorded row for request (cycling on the last
+		one), or None if the request was never recorded.
+		"""
+		key = exchange_key(method, url, data)
+		with self._lock:
+			rows = self.conn.execute(
+				"SELECT status, headers, body, error, elapsed FROM exchange WHERE key = ? ORDER BY id", (key,)
+			).fetchall()
+			if not rows:
+				return None
+			position = self._replay_positions.get(key, 0)
+			self._replay_positions[key] = position + 1
+			return rows[min(position, len(rows) - 1)]
+
+	def count(self):
+		with self._lock:
+			return self.conn.execute("SELECT COUNT(*) FROM exchange").fetchone()[0]
+
+
+
+class Recorder(object):
+
+	def __init__(self, mode=MODE_PASSTHROUGH, archive_path=None, speed='original'):
+		self.archive = None
+		self.set_mode(mode, archive_path, speed)
+
+	def set_mode(self, mode, archive_path=None, speed='original'):
+		if mode not in (MODE_PASSTHROUGH, MODE_RECORD, MODE_REPLAY):
+			raise ValueError("Unknown http mode {}".format(mode))
+		if mode != MODE_PASSTHROUGH:
+			if not archive_path:
+				raise ValueError("http mode {} needs an archive path".format(mode))
+			if self.archive is None or self.archive.path != archive_path:
+				self.archive = HttpArchive(archive_path)
+		self.mode = mode
+		if speed == 'fast':
+			self.speed = None
+		elif speed == 'original':
+			self.speed = 1.0
+		else:
+			self.speed = float(speed)
+
+	def send(self, send_func, method, url, data=None, headers=None, **kwargs):
+		"""
+		Sends request with send_func, or answers it from the archive.
+		"""
+		if self.mode == MODE_REPLAY:
+			return self.replay(method, url, data, headers)
+		if self.mode == MODE_PASSTHROUGH:
+			return send_func(method, url, data, headers, **kwargs)
+		_local.wire_time = None
+		start_time = time.time()
+		try:
+			response = send_func(method, url, data, headers, **kwargs)
+		except requests.exceptions.RequestException as e:
+			self.archive.record(method, url, data, exception=e, elapsed=self.wire_time(start_time))
+			raise
+		elapsed = self.wire_time(start_time)
+		if kwargs.get('stream') and not response._content_consumed:
+			self.tee(response, lambda content: self.archive.record(method, url, data, response=response, elapsed=elapsed, content=content))
+		else:
+			self.archive.record(method, url, data, response=response, elapsed=elapsed)
+		return response
+
+	@staticmethod
+	def wire_time(start_time):
+		"""
+		Returns the wire time noted by the send function, else the time since start_time.
+		"""
+		elapsed = getattr(_local, 'wire_time', None)
+		return elapsed if elapsed is not None else time.time() - start_time
+
+	@staticmethod
+	def tee(response, record):
+		"""
+		Makes response.iter_content() (and so content, iter_lines() and
+		json()) pass the body to record(content) once read, or once
+		the caller stops reading.
+		"""
+		iter_content = response.iter_content
+		recorded = []
+
+		def teed_iter_content(chunk_size=1, decode_unicode=False):
+			def chunks():
+				read = []
+				try:
+					for chunk in iter_content(chunk_size):
+						read.append(chunk)
+						yield chunk
+				finally:
+					if not recorded:
+						recorded.append(True)
+						record(b''.join(read))
+			if decode_unicode:
+				return requests.utils.stream_decode_response_unicode(chunks(), response)
+			return chunks()
+
+		response.iter_content = teed_iter_content
+
+	def replay(self, method, url, data=None, headers=None):
+		row = self.archive.next_exchange(method, url, data)
+		if row is None:
+			logging.warning("No recorded response for {} {}".format(method, url))
+			raise requests.exceptions.ConnectionError("no recorded response for {} {}".format(method, url))
+		status, recorded_headers, content, error, elapsed = row
+		if self.speed:
+			time.sleep(elapsed / self.speed)
+		if error:
+			error = json.loads(error)
+			raise getattr(requests.exceptions, EXCEPTIONS.get(error['kind'], 'RequestException'))(error['message'])
+		response = requests.models.Response()
+		response.status_code = status
+		response.headers = requests.structures.CaseInsensitiveDict(json.loads(recorded_headers or '{}'))
+		response._content = content
+		response._content_consumed = True  # iter_content() serves the recorded body
+		response.url = url
+		response.encoding = 'utf-8'
+		response.elapsed = datetime.timedelta(seconds=elapsed)
+		response.request = requests.Request(method, url, data=data, headers=headers).prepare()
+		return response
+
+
+
+_recorder = Recorder(
+	os.environ.get('CTS_HTTP_MODE', MODE_PASSTHROUGH),
+	os.environ.get('CTS_HTTP_ARCHIVE'),
+	os.environ.get('CTS_REPLAY_SPEED', 'original')
+)
+
+
+def get_recorder():
+	return _recorder
+
+
+def set_mode(mode, archive_path=None, speed='original'):
+	_recorder.set_mode(mode, archive_path, speed)
+	return _recorder
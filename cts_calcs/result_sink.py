@@ -0,0 +1,281 @@
+"""
+Columnar export of calculator results to Parquet or Arrow IPC.
+
+Calculator outputs are nested ({calc, prop, data} objects whose data is
+a number, an error string, a {'pKa': [...], 'pKb': [...]} dict or a
+list of [pH, value] chart points). ResultSink flattens them into one
+row per value with typed columns:
+
+	chemical, calc, prop, method, ph, value, units, error, elapsed
+
+Dict results become one row per entry with the key appended to the
+prop (ion_con.pKa, ion_con.pKb), chart points carry their pH in the ph
+column, and non-numeric data is kept in error, as are responses that
+aren't {calc, prop, data} objects at all (None, "calc server not
+found"). Rows are buffered up to
+row_group_size and appended as one row group, so memory stays bounded
+however long the batch runs. The file is written next to the target
+and moved into place on close.
+
+pyarrow is optional and only imported when a sink is opened:
+
+	with ResultSink('results.parquet') as sink:
+		sink.write(chemical, [{'calc': 'sparc', 'prop': 'water_sol', 'data': 1.2}])
+"""
+
+import logging
+import os
+import threading
+
+from .calcs_metadata import CALC_META_INFO
+
+
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+
+COLUMNS = ['chemical', 'calc', 'prop', 'method', 'ph', 'value', 'units', 'error', 'elapsed']
+
+EXTENSIONS = {
+	'.parquet': FORMAT_PARQUET,
+	'.pq': FORMAT_PARQUET,
+	'.arrow': FORMAT_ARROW,
+	'.feather': FORMAT_ARROW,
+	'.ipc': FORMAT_ARROW,
+}
+
+
+
+def import_pyarrow():
+	try:
+		import pyarrow
+		import pyarrow.ipc
+		import pyarrow.parquet
+	except ImportError:
+		raise ImportError("Result export needs pyarrow, install it with 'pip install pyarrow'")
+	return pyarrow
+
+
+def result_schema(pa):
+	return pa.schema([
+		('chemical', pa.string()),
+		('calc', pa.string()),
+		('prop', pa.string()),
+		('method', pa.string()),
+		('ph', pa.float64()),
+		('value', pa.float64()),
+		('units', pa.string()),
+		('error', pa.string()),
+		('elapsed', pa.float64()),
+	])
+
+
+def prop_units(calc, prop):
+	for prop_info in CALC_META_INFO.get(calc, {}).get('availableProps', []):
+		if prop_info.get('prop') == prop:
+			return prop_info.get('units')
+	return None
+
+
+def as_float(value):
+	if isinstance(value, bool):
+		return None
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+
+def is_chart_point(item):
+	return isinstance(item, (list, tuple)) and len(item) == 2 and \
+		as_float(item[0]) is not None and as_float(item[1]) is not None
+
+
+def normalize(result_obj, chemical=None, ph=None, method=None, elapsed=None):
+	"""
+	Flattens a {calc, prop, data} object into a list of row dicts
+	(anything else becomes one error row).
+	"""
+	if not isinstance(result_obj, dict):
+		return [{
+			'chemical': chemical,
+			'calc': None,
+			'prop': None,
+			'method': method,
+			'ph': as_float(ph),
+			'value': None,
+			'units': None,
+			'error': "no result" if result_obj is None else str(result_obj),
+			'elapsed': as_float(elapsed),
+		}]
+	calc = result_obj.get('calc')
+	prop = result_obj.get('prop')
+	base = {
+		'chemical': result_obj.get('chemical', chemical),
+		'calc': calc,
+		'method': result_obj.get('method', method),
+		'ph': as_float(result_obj.get('ph', ph)),
+		'units': prop_units(calc, prop),
+		'elapsed': as_float(elapsed),
+	}
+	rows = []
+	append_values(rows, base, prop, result_obj.get('data'))
+	return rows
+
+
+def append_values(rows, base, prop, data):
+	if data is None:
+		rows.append(dict(base, prop=prop, value=None, error=None))
+	elif isinstance(data, dict):
+		for key, value in data.items():
+			append_values(rows, base, "{}.{}".format(prop, key), value)
+	elif isinstance(data, (list, tuple)):
+		for item in data:
+			if is_chart_point(item):
+				rows.append(dict(base, prop=prop, ph=float(item[0]), value=float(item[1]), error=None))
+			else:
+				append_values(rows, base, prop, item)
+	else:
+		value = as_float(data)
+		error = None if value is not None else str(data)
+		rows.append(dict(base, prop=prop, value=value, error=error))
+
+
+
+class ResultSink(object):
+	"""
+	Appends normalized results to a Parquet or Arrow IPC file
+	in row groups of at most row_group_size rows.
+	"""
+
+	def __init__(self, path, format=None, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression='snappy'):
+		self.pa = import_pyarrow()
+		self.path = path
+		self.format = format or EXTENSIONS.get(os.path.splitext(path)[1].lower(), FORMAT_PARQUET)
+		if self.format not in (FORMAT_PARQUET, FORMAT_ARROW):
+			raise ValueError("Unknown result format {}".format(self.format))
+		self.row_group_size = row_group_size
+		self.schema = result_schema(self.pa)
+		self.rows_written = 0
+		self.row_groups = 0
+		self._columns = dict((column, []) for column in COLUMNS)
+		self._buffered = 0
+		self._lock = threading.Lock()
+		self._tmp_path = path + '.tmp'
+		if self.format == FORMAT_PARQUET:
+			self._writer = self.pa.parquet.ParquetWriter(self._tmp_path, self.schema, compression=compression)
+		else:
+			self._sink = self.pa.OSFile(self._tmp_path, 'wb')
+			self._writer = self.pa.ipc.new_file(self._sink, self.schema)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+	def write(self, chemical, results, ph=None, method=None, elapsed=None):
+		"""
+		Appends a calculator response (one {calc, prop, data} object
+		or a list of them) for chemical.
+		"""
+		if not isinstance(results, (list, tuple)):
+			results = [results]
+		rows = []
+		for result_obj in results:
+			rows.extend(normalize(result_obj, chemical, ph, method, elapsed))
+		self.write_rows(rows)
+
+	def write_task_result(self, result, task=None, elapsed=None):
+		"""
+		Appends a BatchWorker result ({task_id, calc, chemical, props,
+		ph, method, data, error}). task, if given, overrides props, ph
+		and method.
+		"""
+		if not isinstance(result, dict):
+			task = task or {}
+			self.write(None, result, task.get('ph'), task.get('method'), elapsed)
+			return
+		task = dict(result, **(task or {}))
+		if result.get('error'):
+			self.write_rows([{
+				'chemical': result.get('chemical'),
+				'calc': result.get('calc'),
+				'prop': ','.join(task.get('props') or []) or None,
+				'method': task.get('method'),
+				'ph': as_float(task.get('ph')),
+				'value': None,
+				'units': None,
+				'error': str(result['error']),
+				'elapsed': as_float(elapsed),
+			}])
+			return
+		self.write(result.get('chemical'), result.get('data'), task.get('ph'), task.get('method'), elapsed)
+
+	def write_rows(self, rows):
+		with self._lock:
+			for row in rows:
+				for column in COLUMNS:
+					self._columns[column].append(row.get(column))
+				self._buffered += 1
+				if self._buffered >= self.row_group_size:
+					self._flush()
+
+	def flush(self):
+		with self._lock:
+			self._flush()
+
+	def _flush(self):
+		if not self._buffered:
+			return
+		batch = self.pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+		if self.format == FORMAT_PARQUET:
+			self._writer.write_table(self.pa.Table.from_batches([batch]), row_group_size=self._buffered)
+		else:
+			self._writer.write_batch(batch)
+		self.rows_written += self._buffered
+		self.row_groups += 1
+		self._columns = dict((column, []) for column in COLUMNS)
+		self._buffered = 0
+
+	def close(self):
+		with self._lock:
+			self._flush()
+			self._close_writer()
+		os.replace(self._tmp_path, self.path)
+		return self.path
+
+	def abort(self):
+		with self._lock:
+			self._close_writer()
+		try:
+			os.remove(self._tmp_path)
+		except OSError as e:
+			logging.warning("Could not remove partial result file {}: {}".format(self._tmp_path, e))
+
+	def _close_writer(self):
+		if self._writer is None:
+			return
+		self._writer.close()
+		if self.format == FORMAT_ARROW:
+			self._sink.close()
+		self._writer = None
+
+
+
+def export_job(producer, job_id, path, **sink_kwargs):
+	"""
+	Writes a finished batch job's stored results to path,
+	reading one task result at a time.
+	"""
+	task_ids = producer.result_store.get(producer.job_key(job_id)) or []
+	with ResultSink(path, **sink_kwargs) as sink:
+		for task_id in task_ids:
+			result = producer.result_store.get(producer.result_key(task_id))
+			if result is not None:
+				sink.write_task_result(result)
+	return sink
@@ -0,0 +1,225 @@
+"""
+Priority classes for upstream requests.
+
+Every request through transport carries a priority class:
+
+	interactive - a user waiting on a page (default)
+	batch       - BatchWorker tasks
+	prefetch    - speculative work nobody is waiting on yet
+
+When a backend's concurrency limit (see limiter) is reached, waiting
+requests are admitted by a FairQueue rather than first come first
+served: start-time fair queuing weighted per class (CTS_PRIORITY_WEIGHTS,
+default interactive=8,batch=2,prefetch=1), with a share of each
+backend's slots (CTS_INTERACTIVE_RESERVE, default 0.25) that only
+interactive requests may use. A batch backlog then queues behind itself
+while interactive latency stays close to the backend's own.
+
+The class is set per thread with priority(), or per call with
+transport.send(..., priority=...):
+
+	with scheduler.priority(scheduler.PRIORITY_BATCH):
+		SparcCalc(smiles).data_request_handler(request_dict)
+
+Per-class queue depth and wait times are in limiter.backend_stats().
+"""
+
+import collections
+import contextlib
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+PRIORITY_PREFETCH = 'prefetch'
+PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_PREFETCH]
+
+DEFAULT_WEIGHTS = {PRIORITY_INTERACTIVE: 8.0, PRIORITY_BATCH: 2.0, PRIORITY_PREFETCH: 1.0}
+WAIT_SAMPLES = 1024  # recent wait times kept per class for percentiles
+
+
+
+def parse_weights(value):
+	"""
+	Parses "interactive=8,batch=2,prefetch=1" into a weights dict.
+	"""
+	weights = dict(DEFAULT_WEIGHTS)
+	for item in (value or '').split(','):
+		name, _, weight = item.partition('=')
+		if not name.strip():
+			continue
+		if name.strip() not in PRIORITIES:
+			logging.warning("Unknown priority class {} in CTS_PRIORITY_WEIGHTS".format(name))
+			continue
+		weights[name.strip()] = float(weight)
+	return weights
+
+
+def parse_default_priority(value):
+	"""
+	Returns priority class value, or interactive if it's unset or unknown.
+	"""
+	if not value:
+		return PRIORITY_INTERACTIVE
+	if value not in PRIORITIES:
+		logging.warning("Unknown priority class {} in CTS_DEFAULT_PRIORITY, using {}".format(value, PRIORITY_INTERACTIVE))
+		return PRIORITY_INTERACTIVE
+	return value
+
+
+PRIORITY_WEIGHTS = parse_weights(os.environ.get('CTS_PRIORITY_WEIGHTS'))
+INTERACTIVE_RESERVE = float(os.environ.get('CTS_INTERACTIVE_RESERVE', 0.25))
+DEFAULT_PRIORITY = parse_default_priority(os.environ.get('CTS_DEFAULT_PRIORITY'))
+
+_local = threading.local()
+
+
+
+def current_priority():
+	return getattr(_local, 'priority', None) or DEFAULT_PRIORITY
+
+
+@contextlib.contextmanager
+def priority(priority_class):
+	"""
+	Runs the block's upstream requests (in this thread) at priority_class.
+	"""
+	if priority_class not in PRIORITIES:
+		raise ValueError("Unknown priority class {}".format(priority_class))
+	previous = getattr(_local, 'priority', None)
+	_local.priority = priority_class
+	try:
+		yield
+	finally:
+		_local.priority = previous
+
+
+def with_priority(func):
+	"""
+	Wraps func to run at the calling thread's current priority,
+	for handing work to executor threads.
+	"""
+	priority_class = current_priority()
+
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		with priority(priority_class):
+			return func(*args, **kwargs)
+	return wrapper
+
+
+
+class Ticket(object):
+
+	__slots__ = ('priority', 'start', 'seq', 'enqueued', 'admitted')
+
+	def __init__(self, priority, start, seq):
+		self.priority = priority
+		self.start = start
+		self.seq = seq
+		self.enqueued = time.time()
+		self.admitted = False
+
+
+
+class ClassStats(object):
+
+	def __init__(self):
+		self.admitted = 0
+		self.timed_out = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+		self.recent_waits = collections.deque(maxlen=WAIT_SAMPLES)
+
+	def record_wait(self, wait_time):
+		self.admitted += 1
+		self.total_wait += wait_time
+		self.max_wait = max(self.max_wait, wait_time)
+		self.recent_waits.append(wait_time)
+
+	def percentile(self, pct):
+		if not self.recent_waits:
+			return None
+		ordered = sorted(self.recent_waits)
+		return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+
+class FairQueue(object):
+	"""
+	Weighted fair admission order for one backend's concurrency slots.
+	Not locked itself: the owning limiter calls it under its lock.
+	"""
+
+	def __init__(self, weights=None, interactive_reserve=None):
+		self.weights = dict(PRIORITY_WEIGHTS, **(weights or {}))
+		self.interactive_reserve = INTERACTIVE_RESERVE if interactive_reserve is None else interactive_reserve
+		self.virtual_time = 0.0
+		self._next_start = dict((priority_class, 0.0) for priority_class in PRIORITIES)
+		self._waiting = dict((priority_class, collections.deque()) for priority_class in PRIORITIES)
+		self._stats = dict((priority_class, ClassStats()) for priority_class in PRIORITIES)
+		self._seq = itertools.count()
+
+	def enqueue(self, priority_class=None):
+		priority_class = priority_class if priority_class in self._waiting else DEFAULT_PRIORITY
+		# a class that was idle starts at the current virtual time, it
+		# doesn't get credit for the time it sent nothing
+		start = max(self.virtual_time, self._next_start[priority_class])
+		self._next_start[priority_class] = start + 1.0 / self.weights[priority_class]
+		ticket = Ticket(priority_class, start, next(self._seq))
+		self._waiting[priority_class].append(ticket)
+		return ticket
+
+	def reserved_slots(self, limit):
+		return int(limit * self.interactive_reserve)
+
+	def free_slots(self, priority_class, inflight, limit):
+		if priority_class == PRIORITY_INTERACTIVE:
+			return limit - inflight
+		return limit - self.reserved_slots(limit) - inflight
+
+	def can_admit(self, ticket, inflight, limit):
+		"""
+		True if ticket is the next waiter due a free slot.
+		"""
+		if self.free_slots(ticket.priority, inflight, limit) <= 0:
+			return False
+		head = None
+		for priority_class, waiting in self._waiting.items():
+			if waiting and self.free_slots(priority_class, inflight, limit) > 0:
+				if head is None or (waiting[0].start, waiting[0].seq) < (head.start, head.seq):
+					head = waiting[0]
+		return head is ticket
+
+	def admit(self, ticket):
+		self._waiting[ticket.priority].remove(ticket)  # head of its deque
+		ticket.admitted = True
+		self.virtual_time = max(self.virtual_time, ticket.start)
+		self._stats[ticket.priority].record_wait(time.time() - ticket.enqueued)
+
+	def cancel(self, ticket):
+		self._waiting[ticket.priority].remove(ticket)
+		self._stats[ticket.priority].timed_out += 1
+
+	def waiting(self):
+		return sum(len(waiting) for waiting in self._waiting.values())
+
+	def stats(self):
+		class_stats = {}
+		for priority_class in PRIORITIES:
+			stats = self._stats[priority_class]
+			class_stats[priority_class] = {
+				'depth': len(self._waiting[priority_class]),
+				'admitted': stats.admitted,
+				'timed_out': stats.timed_out,
+				'mean_wait': stats.total_wait / stats.admitted if stats.admitted else 0.0,
+				'p50_wait': stats.percentile(50),
+				'p99_wait': stats.percentile(99),
+				'max_wait': stats.max_wait,
+			}
+		return class_stats
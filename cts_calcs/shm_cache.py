@@ -0,0 +1,357 @@
+"""
+Host-wide shared-memory tier for the result cache.
+
+With a pool of worker processes, each LocalCache holds its own copy of
+the hot results (filtered SMILES, melting points, SPARC outputs) and
+each worker recomputes what the others already have. SharedMemoryCache
+keeps results in one mmap'd file (on /dev/shm, so it stays in memory)
+that every worker process on the host maps, behind the same client API
+as LocalCache and redis (get, set, delete, exists, flushdb):
+
+	set_result_cache(ResultCache(SharedMemoryCache()))
+
+or CTS_SHM_CACHE=1 (or a path) for get_result_cache(). With redis also
+configured, TieredCache puts the shared-memory tier in front of it.
+
+Layout: a header, then fixed-size slots. A key hashes to a window of
+PROBES neighbouring slots; a set takes the window's slot for the same
+key, else an empty or expired one, else the one expiring first. Each
+slot is a compact binary record:
+
+	seq u32 | key hash u64 | expires_at f64 | value length u32 | key length u16 | key | value
+
+Reads take no lock. seq is a seqlock: a writer makes it odd, writes
+the record and makes it even again, and a reader that sees an odd
+seq, or a different seq after copying the record, retries (and counts
+a miss after READ_RETRIES). Writers (set, delete, flushdb, laying out
+a new file) hold an fcntl lock on the whole file (between processes)
+and a lock per path (between threads and instances in one process),
+so choosing a slot and writing it is atomic: a key is only ever in
+one slot of its window, and set(nx=True) is a real set-if-absent. A
+slot left odd by a writer that died mid-write reads as a miss, and
+the next writer treats it as empty. Values larger than a slot aren't
+stored (see 'oversize' in stats()).
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+
+DEFAULT_PATH = '/dev/shm/cts-result-cache' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'cts-result-cache')
+DEFAULT_SIZE = int(os.environ.get('CTS_SHM_CACHE_MB', 64)) * 1024 * 1024
+DEFAULT_SLOT_SIZE = int(os.environ.get('CTS_SHM_SLOT_SIZE', 1024))  # bytes per record, key and value included
+PROBES = 4
+READ_RETRIES = 8
+
+MAGIC = b'CTSSHM01'
+HEADER = struct.Struct('<8sII')  # magic, slot count, slot size
+HEADER_SIZE = 64
+SLOT = struct.Struct('<IQdIH')  # seq, key hash, expires_at, value length, key length
+SLOT_HEADER_SIZE = 32
+SEQ = struct.Struct('<I')
+
+_path_locks = {}  # fcntl locks are per process, so instances on one file share a thread lock
+_path_locks_lock = threading.Lock()
+
+
+
+def key_hash(name):
+	"""
+	Returns nonzero 64-bit hash of key (0 marks an empty slot).
+	"""
+	if isinstance(name, str):
+		name = name.encode('utf-8')
+	return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little') or 1
+
+
+
+class SharedMemoryCache(object):
+	"""
+	Redis-compatible client over a cache file mapped by every process
+	on the host. Geometry comes from the file if it already exists.
+	"""
+
+	def __init__(self, path=DEFAULT_PATH, size=DEFAULT_SIZE, slot_size=DEFAULT_SLOT_SIZE):
+		self.path = path
+		with _path_locks_lock:
+			self._lock = _path_locks.setdefault(os.path.realpath(path), threading.RLock())
+		self.hits = 0
+		self.misses = 0
+		self.sets = 0
+		self.evictions = 0
+		self.oversize = 0
+		self.torn_reads = 0
+		self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+		self._lock.acquire()
+		self.lock_file()  # one process lays out a new file
+		try:
+			file_size = os.fstat(self.fd).st_size
+			header = os.pread(self.fd, HEADER.size, 0) if file_size >= HEADER_SIZE else b''
+			if len(header) == HEADER.size and HEADER.unpack(header)[0] == MAGIC:
+				_, self.slot_count, self.slot_size = HEADER.unpack(header)
+			else:
+				self.slot_size = slot_size
+				self.slot_count = max(PROBES, (size - HEADER_SIZE) // slot_size)
+				os.ftruncate(self.fd, 0)
+				os.ftruncate(self.fd, HEADER_SIZE + self.slot_count * self.slot_size)
+				os.pwrite(self.fd, HEADER.pack(MAGIC, self.slot_count, self.slot_size), 0)
+		finally:
+			self.unlock_file()
+			self._lock.release()
+		self.size = HEADER_SIZE + self.slot_count * self.slot_size
+		self.mm = mmap.mmap(self.fd, self.size)
+		self.max_record = self.slot_size - SLOT_HEADER_SIZE
+
+	def slot_offset(self, index):
+		return HEADER_SIZE + index * self.slot_size
+
+	def window(self, hashed):
+		start = hashed % self.slot_count
+		return [(start + probe) % self.slot_count for probe in range(PROBES)]
+
+	def read_slot(self, index, hashed, key):
+		"""
+		Returns (found, value or None) for key in slot index, without locking.
+		"""
+		offset = self.slot_offset(index)
+		for _ in range(READ_RETRIES):
+			seq, slot_hash, expires_at, value_len, key_len = SLOT.unpack_from(self.mm, offset)
+			if seq & 1:
+				continue  # write in progress
+			if slot_hash != hashed:
+				return False, None
+			if key_len + value_len > self.max_record:
+				self.torn_reads += 1
+				continue
+			record = self.mm[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + key_len + value_len]
+			if SEQ.unpack_from(self.mm, offset)[0] != seq:
+				self.torn_reads += 1
+				continue
+			if record[:key_len] != key:
+				return False, None
+			if expires_at and expires_at < time.time():
+				return True, None
+			return True, record[key_len:]
+		return False, None
+
+	def get(self, name):
+		key = name.encode('utf-8') if isinstance(name, str) else name
+		hashed = key_hash(key)
+		for index in self.window(hashed):
+			found, value = self.read_slot(index, hashed, key)
+			if found:
+				if value is not None:
+					self.hits += 1
+					return value
+				break
+		self.misses += 1
+		return None
+
+	def write_slot(self, index, hashed, key, value, expires_at):
+		"""
+		Writes a record into slot index. Called with the file locked.
+		"""
+		offset = self.slot_offset(index)
+		seq = SEQ.unpack_from(self.mm, offset)[0]
+		if seq & 1:
+			seq += 1  # left odd by a writer that died mid-write
+		SEQ.pack_into(self.mm, offset, (seq + 1) & 0xffffffff)  # odd: readers retry
+		SLOT.pack_into(self.mm, offset, (seq + 1) & 0xffffffff, hashed, expires_at, len(value), len(key))
+		record_offset = offset + SLOT_HEADER_SIZE
+		self.mm[record_offset:record_offset + len(key) + len(value)] = key + value
+		SEQ.pack_into(self.mm, offset, (seq + 2) & 0xffffffff)
+
+	def lock_file(self):
+		"""
+		Locks the whole file against writers in other processes.
+		"""
+		fcntl.lockf(self.fd, fcntl.LOCK_EX, 0, 0)
+
+	def unlock_file(self):
+		fcntl.lockf(self.fd, fcntl.LOCK_UN, 0, 0)
+
+	def choose_slot(self, hashed, key, now):
+		"""
+		Returns (slot index, live) for key: its own slot (live if its
+		record hasn't expired), else an empty, expired or torn slot, else
+		the slot that expires first (live: evicting it). Called with the
+		file locked, so the choice holds until the write.
+		"""
+		best, best_expiry = None, None
+		for index in self.window(hashed):
+			seq, slot_hash, expires_at, _, key_len = SLOT.unpack_from(self.mm, self.slot_offset(index))
+			expired = expires_at and expires_at < now
+			if slot_hash == hashed and not seq & 1:
+				record_offset = self.slot_offset(index) + SLOT_HEADER_SIZE
+				if self.mm[record_offset:record_offset + key_len] == key:
+					return index, not expired
+			if slot_hash == 0 or seq & 1 or expired:
+				if best_expiry != -1:
+					best, best_expiry = index, -1
+				continue
+			expiry = expires_at or float('inf')
+			if best_expiry is None or (best_expiry != -1 and expiry < best_expiry):
+				best, best_expiry = index, expiry
+		return best, best_expiry != -1
+
+	def set(self, name, value, ex=None, nx=False):
+		key = name.encode('utf-8') if isinstance(name, str) else name
+		if isinstance(value, str):
+			value = value.encode('utf-8')
+		if len(key) + len(value) > self.max_record:
+			self.oversize += 1
+			return False
+		hashed = key_hash(key)
+		now = time.time()
+		with self._lock:
+			self.lock_file()
+			try:
+				index, live = self.choose_slot(hashed, key, now)
+				own = SLOT.unpack_from(self.mm, self.slot_offset(index))[1] == hashed
+				if nx and live and own:
+					return None  # already set, checked under the lock
+				self.write_slot(index, hashed, key, value, now + ex if ex else 0.0)
+			finally:
+				self.unlock_file()
+		self.sets += 1
+		if live and not own:
+			self.evictions += 1
+		return True
+
+	def delete(self, *names):
+		deleted = 0
+		for name in names:
+			key = name.encode('utf-8') if isinstance(name, str) else name
+			hashed = key_hash(key)
+			with self._lock:
+				self.lock_file()
+				try:
+					for index in self.window(hashed):
+						if self.read_slot(index, hashed, key)[0]:
+							self.write_slot(index, 0, b'', b'', 0.0)
+							deleted += 1
+							break
+				finally:
+					self.unlock_file()
+		return deleted
+
+	def exists(self, name):
+		return self.get(name) is not None
+
+	def flushdb(self):
+		with self._lock:
+			self.lock_file()
+			try:
+				for index in range(self.slot_count):
+					seq, slot_hash = SLOT.unpack_from(self.mm, self.slot_offset(index))[:2]
+					if slot_hash or seq & 1:
+						self.write_slot(index, 0, b'', b'', 0.0)
+			finally:
+				self.unlock_file()
+		return True
+
+	def occupancy(self):
+		"""
+		Returns fraction of slots holding unexpired records (scans the file).
+		"""
+		now = time.time()
+		used = 0
+		for index in range(self.slot_count):
+			_, slot_hash, expires_at, _, _ = SLOT.unpack_from(self.mm, self.slot_offset(index))
+			if slot_hash and not (expires_at and expires_at < now):
+				used += 1
+		return float(used) / self.slot_count
+
+	def stats(self):
+		total = self.hits + self.misses
+		return {
+			'path': self.path,
+			'size': self.size,
+			'slots': self.slot_count,
+			'slot_size': self.slot_size,
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_rate': float(self.hits) / total if total else 0.0,
+			'sets': self.sets,
+			'evictions': self.evictions,
+			'oversize': self.oversize,
+			'torn_reads': self.torn_reads,
+		}
+
+	def close(self):
+		self.mm.close()
+		os.close(self.fd)
+
+
+
+class TieredCache(object):
+	"""
+	Shared-memory tier in front of another client (e.g., redis):
+	reads try near first and copy far hits into it, writes go to both.
+	"""
+
+	def __init__(self, near, far, near_ttl=None):
+		self.near = near
+		self.far = far
+		self.near_ttl = near_ttl  # far hits are kept this long near (default: cache TTL)
+
+	def get(self, name):
+		value = self.near.get(name)
+		if value is not None:
+			return value
+		value = self.far.get(name)
+		if value is not None:
+			self.near.set(name, value, ex=self.near_ttl)
+		return value
+
+	def set(self, name, value, ex=None, nx=False):
+		result = self.far.set(name, value, ex=ex, nx=nx)
+		if result:
+			self.near.set(name, value, ex=ex)
+		return result
+
+	def delete(self, *names):
+		self.near.delete(*names)
+		return self.far.delete(*names)
+
+	def exists(self, name):
+		return self.near.exists(name) or bool(self.far.exists(name))
+
+	def flushdb(self):
+		self.near.flushdb()
+		return self.far.flushdb()
+
+
+
+def shm_cache_path():
+	"""
+	Returns cache file path from CTS_SHM_CACHE ('1' for the default
+	path), or None if the shared-memory tier is off.
+	"""
+	setting = os.environ.get('CTS_SHM_CACHE', '0')
+	if setting in ('', '0'):
+		return None
+	return DEFAULT_PATH if setting == '1' else setting
+
+
+def get_shm_client(far=None):
+	"""
+	Returns SharedMemoryCache (in front of far, if given) when
+	CTS_SHM_CACHE is set, else far.
+	"""
+	path = shm_cache_path()
+	if not path:
+		return far
+	try:
+		near = SharedMemoryCache(path)
+	except (OSError, ValueError) as e:
+		logging.warning("Could not map shared-memory cache {}: {}".format(path, e))
+		return far
+	return TieredCache(near, far) if far is not None else near
@@ -1,9 +1,45 @@
-import requests
+import concurrent.futures
 import json
 import logging
-import os
+import threading
 from .calculator import Calculator
+from . import transport
+from .endpoints import primary_url
+from .alias_index import get_alias_index
+from .negative_cache import get_negative_cache
+from .cache import cache_enabled
+from . import metrics
+from .profiler import profiled
 from .jchem_properties import Tautomerization, ElementalAnalysis
+from . import deadline
+from .scheduler import with_priority
+from .lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+# calcs that take structures with stereos cleared and nitro groups untransformed
+STEREOLESS_CALCS = ['epi', 'sparc', 'measured']
+
+FILTER_WORKERS = 16  # stereo clearing steps run alongside mass checks, across requests
+
+# parseSmilesByCalculators errors as metrics labels
+FILTER_REJECTION_REASONS = {
+	"structure too large": 'too_large',
+	"cannot process metals or charges": 'metals_or_charges',
+}
+
+_filter_executor = None
+_filter_executor_lock = threading.Lock()
+
+
+
+def get_filter_executor():
+	global _filter_executor
+	if _filter_executor is None:
+		with _filter_executor_lock:
+			if _filter_executor is None:
+				_filter_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FILTER_WORKERS)
+	return _filter_executor
 
 
 
@@ -24,8 +60,9 @@ class SMILESFilter(object):
 			"smiles": "",
 			"processedsmiles" : ""
 		}
-		self.baseUrl = os.environ.get('CTS_EFS_SERVER')
+		self.baseUrl = primary_url('CTS_EFS_SERVER')
 		self.is_valid_url = self.baseUrl + '/ctsws/rest/isvalidchemical'
+		self.use_cache = cache_enabled()  # rejections are cached only when CTS_RESULT_CACHE=1
 
 
 
@@ -34,12 +71,25 @@ class SMILESFilter(object):
 		Makes request to ctsws /isvalidchemical endpoint to check
 		if user smiles is valid. Returns boolean.
 		"""
-		is_valid_response = requests.post(self.is_valid_url, data=json.dumps({'smiles': smiles}), headers={'Content-Type': 'application/json'}, timeout=5)
-		is_valid = json.loads(is_valid_response.content).get('result')  # result should be "true" or "false"
-		if is_valid == "true":
-			return True
-		else:
-			return False
+		return self.check_valid_smiles(smiles)[0] is True
+
+
+
+	def check_valid_smiles(self, smiles):
+		"""
+		Makes request to ctsws /isvalidchemical endpoint. Returns
+		(valid, status code), where valid is None unless CTSWS
+		answered "true" or "false".
+		"""
+		is_valid_response = transport.post(self.is_valid_url, data=json.dumps({'smiles': smiles}), headers={'Content-Type': 'application/json'}, timeout=5)
+		status = is_valid_response.status_code
+		try:
+			is_valid = json.loads(is_valid_response.content).get('result')  # result should be "true" or "false"
+		except (ValueError, AttributeError):
+			return None, status
+		if status >= 400 or not is_valid in ("true", "false"):
+			return None, status
+		return is_valid == "true", status
 
 
 
@@ -99,26 +149,73 @@ class SMILESFilter(object):
 
 
 
+	@profiled('filterSMILES')
+	@metrics.timed(metrics.FILTER_SECONDS, 'filterSMILES')
 	def filterSMILES(self, smiles, is_node=False):
 		"""
 		cts ws call to jchem to perform various
 		smiles processing before being sent to
 		p-chem calculators
 		"""
+		# Returns previously filtered SMILES for this input:
+		filter_path = 'filterSMILES:node' if is_node else 'filterSMILES'
+		if self.use_cache:
+			indexed_smiles = get_alias_index().get(smiles, filter_path)
+			if indexed_smiles is not None:
+				return indexed_smiles
+
+			# Returns previous rejection of this input without the checks:
+			failure = get_negative_cache().get('filter', smiles, filter_path)
+			if failure is not None:
+				return {'error': failure['error']}
+
+		try:
+			return self.applyFilters(smiles, is_node, filter_path)
+		except deadline.DeadlineExceeded as e:
+			logging.warning("Stopped filtering {}: {}".format(smiles, e))
+			metrics.FILTER_REJECTIONS.inc('deadline')
+			return {'error': "error filtering chemical"}
+
+
+
+	def applyFilters(self, smiles, is_node, filter_path):
+		"""
+		Runs filterSMILES's checks and CTSWS/jchem filters on smiles (not
+		already filtered or rejected), raising DeadlineExceeded between steps.
+		"""
+		negative_cache = get_negative_cache()
+
+		deadline.check('filterSMILES')
+
 		calc_object = Calculator()
 
 		# Performs carbon check (but not for transformation products):
 		if not is_node and not self.check_for_carbon(smiles):
+			if self.use_cache:
+				negative_cache.record('filter', (smiles, filter_path), "CTS only accepts organic chemicals")
+			metrics.FILTER_REJECTIONS.inc('not_organic')
 			return {'error': "CTS only accepts organic chemicals"}
 
 		# Checks SMILES for invalid characters:
 		if not self.check_smiles_against_exludestring(smiles):
+			if self.use_cache:
+				negative_cache.record('filter', (smiles, filter_path), "Chemical cannot be a salt or mixture")
+			metrics.FILTER_REJECTIONS.inc('salt_or_mixture')
 			return {'error': "Chemical cannot be a salt or mixture"}
 
 		# Calls CTSWS /isvalidchemical endpoint:
-		if not self.is_valid_smiles(smiles):
+		is_valid, status = self.check_valid_smiles(smiles)
+		if is_valid is False:
 			logging.warning("User chemical contains metals, sending error to client..")
+			if self.use_cache:
+				negative_cache.record('filter', (smiles, filter_path), "Chemical cannot contain metals", status)
+			metrics.FILTER_REJECTIONS.inc('metals')
 			return {'error': "Chemical cannot contain metals"}
+		if is_valid is None:
+			# CTSWS didn't answer (5xx, error page), not a rejection of the chemical
+			logging.warning("CTSWS isvalidchemical check failed with status {}".format(status))
+			metrics.FILTER_REJECTIONS.inc('error')
+			return {'error': "error filtering chemical"}
 
 		# Updated approach (todo: more efficient to have CTSWS use major taut instead of canonical)
 		# 1. CTSWS actions "removeExplicitH" and "transform".
@@ -131,10 +228,13 @@ class SMILESFilter(object):
 			]
 		}
 		response = calc_object.web_call(url, post_data)
+		if not response.get('valid'):
+			return {'error': "error filtering chemical"}
 
 		filtered_smiles = response['results'][-1] # picks last item, format: [filter1 smiles, filter1 + filter2 smiles]
 		
 		# 2. Get major tautomer from jchem:
+		deadline.check('filterSMILES major tautomer')
 		taut_obj = Tautomerization()
 		taut_obj.postData.update({'calculationType': 'MAJOR'})
 		taut_obj.make_data_request(filtered_smiles, taut_obj)
@@ -152,6 +252,7 @@ class SMILESFilter(object):
 			filtered_smiles = major_taut_smiles
 
 		# 3. Using major taut smiles for final "neutralize" filter:
+		deadline.check('filterSMILES neutralize')
 		post_data = {
 			'structure': filtered_smiles, 
 			'actions': [
@@ -159,9 +260,14 @@ class SMILESFilter(object):
 			]
 		}
 		response = calc_object.web_call(url, post_data)
+		if not response.get('valid'):
+			return {'error': "error filtering chemical"}
 
 		final_smiles = response['results'][-1]
 
+		if self.use_cache:
+			get_alias_index().put(smiles, filter_path, final_smiles)
+
 		return final_smiles
 
 
@@ -231,32 +337,106 @@ class SMILESFilter(object):
 		"""
 		Calculator-dependent SMILES filtering!
 		"""
-		filtered_smiles = structure
+		filtered, errors = self.parseSmilesByCalculators(structure, [calculator])
+		if calculator in errors:
+			# bubble up to calc for handling error
+			raise Exception(errors[calculator])
+		return filtered[calculator]
 
-		#1. check structure mass..
-		if calculator != 'chemaxon':
-			if not self.checkMass(structure):
-				# raise "Structure too large, must be < 1500 g/mol.."
-				raise Exception({'data': "structure too large"})
 
-		#2-3. clear stereos from structure, untransform [N+](=O)[O-] >> N(=O)=O..
-		if calculator == 'epi' or calculator == 'sparc' or calculator == 'measured':
-			try:
-				# clear stereoisomers:
-				filtered_smiles = self.clearStereos(structure)
 
-				# transform structure:
-				filtered_smiles = str(filtered_smiles[-1])
-				filtered_smiles = str(self.untransformSMILES(filtered_smiles)[-1])
+	@metrics.timed(metrics.FILTER_SECONDS, 'parseSmilesByCalculators')
+	def parseSmilesByCalculators(self, structure, calculators):
+		"""
+		Calculator-dependent SMILES filtering for a set of calculators,
+		running each step shared between them once (mass check for all but
+		chemaxon, stereo clearing and untransform for epi, sparc and measured).
+		Returns (filtered, errors): {calc: filtered smiles} and
+		{calc: {'data': error message}} for calcs that can't take structure.
+		"""
+		alias_index = get_alias_index()
+		negative_cache = get_negative_cache()
+		filtered, errors = {}, {}
+		for calculator in calculators:
+			if self.use_cache:
+				indexed_smiles = alias_index.get(structure, 'parseSmilesByCalculator:' + str(calculator))
+				if indexed_smiles is not None:
+					filtered[calculator] = indexed_smiles
+					continue
+				failure = negative_cache.get('filter', structure, 'parseSmilesByCalculator:' + str(calculator))
+				if failure is not None:
+					errors[calculator] = {'data': failure['error']}
+		remaining = [calculator for calculator in calculators if not calculator in filtered and not calculator in errors]
+		if not remaining:
+			return filtered, errors
+
+		needs_mass = [calculator for calculator in remaining if calculator != 'chemaxon']
+		needs_stereoless = [calculator for calculator in remaining if calculator in STEREOLESS_CALCS]
+
+		# 1. mass check and 2-3. stereo clearing/untransform, side by side when both are needed:
+		stereoless_future = None
+		if needs_mass and needs_stereoless:
+			stereoless_future = get_filter_executor().submit(deadline.with_deadline(with_priority(self.getStereolessSMILES)), structure)
+
+		if needs_mass:
+			try:
+				mass_ok = self.checkMass(structure)
 			except Exception as e:
-				logging.warning("!!! Error in parseSmilesByCalculator() {} !!!".format(e))
-				raise {'data': "error filtering chemical"}
+				logging.warning("!!! Error in parseSmilesByCalculators() {} !!!".format(e))
+				mass_ok, mass_error = False, "error filtering chemical"
+			else:
+				mass_error = "structure too large"
+			if not mass_ok:
+				for calculator in needs_mass:
+					errors[calculator] = {'data': mass_error}
+
+		stereoless_smiles = None
+		if needs_stereoless:
+			try:
+				stereoless_smiles = stereoless_future.result() if stereoless_future else self.getStereolessSMILES(structure)
+			except Exception as e:
+				logging.warning("!!! Error in parseSmilesByCalculators() {} !!!".format(e))
+				for calculator in needs_stereoless:
+					errors.setdefault(calculator, {'data': "error filtering chemical"})
+
+		for calculator in remaining:
+			if calculator in errors:
+				continue
+			filtered_smiles = stereoless_smiles if calculator in STEREOLESS_CALCS else structure
+
+			# 4. Check for metals and stuff (square brackets):
+			if calculator == 'epi' or calculator == 'measured':
+				if '[' in filtered_smiles or ']' in filtered_smiles:
+					errors[calculator] = {'data': "cannot process metals or charges"}
+					continue
+
+			if self.use_cache and filtered_smiles != structure:
+				# (identity mappings, e.g. chemaxon's, would only fill the index)
+				alias_index.put(structure, 'parseSmilesByCalculator:' + str(calculator), filtered_smiles)
+			filtered[calculator] = filtered_smiles
+
+		# Keeps permanent rejections ("structure too large", metals) for next time:
+		for calculator in remaining:
+			if calculator in errors:
+				if self.use_cache:
+					negative_cache.record('filter', (structure, 'parseSmilesByCalculator:' + str(calculator)), errors[calculator]['data'])
+				metrics.FILTER_REJECTIONS.inc(FILTER_REJECTION_REASONS.get(errors[calculator]['data'], 'error'))
 
-		# 4. Check for metals and stuff (square brackets):
-		if calculator == 'epi' or calculator == 'measured':
-			if '[' in filtered_smiles or ']' in filtered_smiles:
-				# bubble up to calc for handling error
-				# raise Exception("{} cannot process metals..".format(calculator))
-				raise Exception({'data': "cannot process metals or charges"})
+		return filtered, errors
 
-		return filtered_smiles
\ No newline at end of file
+
+
+	def getStereolessSMILES(self, structure):
+		"""
+		Clears stereos and untransforms [N+](=O)[O-] >> N(=O)=O,
+		the filtering shared by epi, sparc and measured.
+		"""
+		if self.use_cache:
+			indexed_smiles = get_alias_index().get(structure, 'parseSmilesByCalculator:stereoless')
+			if indexed_smiles is not None:
+				return indexed_smiles
+		filtered_smiles = str(self.clearStereos(structure)[-1])
+		filtered_smiles = str(self.untransformSMILES(filtered_smiles)[-1])
+		if self.use_cache:
+			get_alias_index().put(structure, 'parseSmilesByCalculator:stereoless', filtered_smiles)
+		return filtered_smiles
@@ -0,0 +1,253 @@
+"""
+Memory-mapped, precomputed property snapshot for offline serving.
+
+A snapshot is an immutable file of calculator results (the values
+parseMultiPropResponse, getPkaResults, getLogDForPH and
+JchemProperty.get_data return) keyed by filtered SMILES, calc, prop,
+and pH/method where the prop takes them. Layout:
+
+	header: magic (8s), record count (Q), index offset (Q)
+	values: zlib-compressed JSON {"k": key, "v": result}, back to back
+	index:  sorted (key hash (Q), value offset (Q), value length (I)) records
+
+Readers mmap the file, so start-up needs no load time and processes on
+a host share its pages; a lookup is a binary search over the index and
+one small decompress. Calculators consult the snapshot named by
+CTS_SNAPSHOT_PATH before making any request.
+
+Results are for SNAPSHOT_CONDITIONS (SPARC's default temperature,
+pressure and melting point): export skips results computed under other
+conditions, and SPARC requests with other conditions bypass the
+snapshot. Error results (messages, None, {'error': ...}) aren't stored.
+
+Build one from JSON lines of {chemical, calc, prop, data, ph, method}:
+
+	python -m cts_calcs.snapshot results.jsonl snapshot.bin
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from .calcs_metadata import CALC_CAPABILITIES
+
+
+MAGIC = b'CTSSNAP1'
+HEADER = struct.Struct('<8sQQ')
+INDEX_RECORD = struct.Struct('<QQI')
+SNAPSHOT_CONDITIONS = {'temperature': 25.0, 'pressure': 760.0, 'meltingPoint': 0.0}
+
+
+
+def snapshot_key(smiles, calc, prop, ph=None, method=None):
+	"""
+	Key string for a result. pH is only part of the key for
+	pH-dependent props, rounded to the 0.1 step the calcs use.
+	"""
+	capability = CALC_CAPABILITIES.get(calc, {}).get(prop)
+	if capability is not None and not capability['ph']:
+		ph = None
+	if ph is not None:
+		ph = "{:.1f}".format(float(ph))
+	return "\t".join([smiles or '', calc or '', prop or '', ph or '', method or ''])
+
+
+def default_conditions(conditions):
+	"""
+	True if conditions (dict of temperature, pressure, meltingPoint;
+	missing ones are taken as default) match SNAPSHOT_CONDITIONS.
+	"""
+	for name, default in SNAPSHOT_CONDITIONS.items():
+		value = conditions.get(name, default)
+		try:
+			if value is None or float(value) != default:
+				return False
+		except (TypeError, ValueError):
+			return False
+	return True
+
+
+def storable_result(result):
+	"""
+	True if a {chemical, calc, prop, data, ...} result dict holds
+	a calculated value rather than an error.
+	"""
+	data = result.get('data')
+	if data is None or result.get('error') or result.get('valid') is False:
+		return False
+	if isinstance(data, str):
+		# errors come back as messages in place of data ("request timed out")
+		try:
+			float(data)
+		except ValueError:
+			return False
+	if isinstance(data, dict) and data.get('error'):
+		return False
+	return default_conditions(result)
+
+
+def key_hash(key):
+	return struct.unpack('<Q', hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest())[0]
+
+
+
+class SnapshotWriter(object):
+	"""
+	Collects results and writes them as a snapshot file on close().
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.tmp_path = path + '.tmp'
+		self.file = open(self.tmp_path, 'wb')
+		self.file.write(HEADER.pack(MAGIC, 0, 0))
+		self.index = []
+		self.keys = set()
+
+	def add(self, smiles, calc, prop, result, ph=None, method=None):
+		if result is None:
+			return False
+		key = snapshot_key(smiles, calc, prop, ph, method)
+		if key in self.keys:
+			return False
+		self.keys.add(key)
+		value = zlib.compress(json.dumps({'k': key, 'v': result}).encode('utf-8'))
+		self.index.append((key_hash(key), self.file.tell(), len(value)))
+		self.file.write(value)
+		return True
+
+	def close(self):
+		"""
+		Writes sorted index and header, then moves file into place.
+		"""
+		self.index.sort()
+		index_offset = self.file.tell()
+		for record in self.index:
+			self.file.write(INDEX_RECORD.pack(*record))
+		self.file.seek(0)
+		self.file.write(HEADER.pack(MAGIC, len(self.index), index_offset))
+		self.file.close()
+		os.replace(self.tmp_path, self.path)
+		return len(self.index)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.file.close()
+			os.remove(self.tmp_path)
+
+
+
+class SnapshotReader(object):
+	"""
+	Read-only, memory-mapped view of a snapshot file.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as snapshot_file:
+			self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self.count, self.index_offset = HEADER.unpack_from(self.mmap, 0)
+		if magic != MAGIC:
+			raise ValueError("{} is not a CTS snapshot file".format(path))
+
+	def _hash_at(self, position):
+		return struct.unpack_from('<Q', self.mmap, self.index_offset + position * INDEX_RECORD.size)[0]
+
+	def get(self, smiles, calc, prop, ph=None, method=None):
+		"""
+		Returns stored result, or None if not in snapshot.
+		"""
+		key = snapshot_key(smiles, calc, prop, ph, method)
+		target = key_hash(key)
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			if self._hash_at(middle) < target:
+				low = middle + 1
+			else:
+				high = middle
+		# checks every record with the same hash in case of collisions
+		while low < self.count and self._hash_at(low) == target:
+			_, offset, length = INDEX_RECORD.unpack_from(self.mmap, self.index_offset + low * INDEX_RECORD.size)
+			record = json.loads(zlib.decompress(self.mmap[offset:offset + length]).decode('utf-8'))
+			if record['k'] == key:
+				return record['v']
+			low += 1
+		return None
+
+	def __len__(self):
+		return self.count
+
+	def close(self):
+		self.mmap.close()
+
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+	"""
+	Returns SnapshotReader for CTS_SNAPSHOT_PATH, or None if unset.
+	"""
+	global _snapshot
+	snapshot_path = os.environ.get('CTS_SNAPSHOT_PATH')
+	if not snapshot_path:
+		return None
+	if _snapshot is None or _snapshot.path != snapshot_path:
+		with _snapshot_lock:
+			if _snapshot is None or _snapshot.path != snapshot_path:
+				try:
+					_snapshot = SnapshotReader(snapshot_path)
+				except (IOError, OSError, ValueError) as e:
+					logging.warning("Could not open snapshot {}: {}".format(snapshot_path, e))
+					return None
+	return _snapshot
+
+
+def export_snapshot(results, path):
+	"""
+	Writes iterable of {chemical, calc, prop, data, ph, method}
+	result dicts to a snapshot file, skipping errors and results
+	for other conditions. Returns record count.
+	"""
+	with SnapshotWriter(path) as writer:
+		for result in results:
+			if not storable_result(result):
+				continue
+			writer.add(result.get('chemical'), result.get('calc'), result.get('prop'), result.get('data'),
+				result.get('ph'), result.get('method'))
+	return len(writer.index)
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Builds a CTS property snapshot from JSON lines of results")
+	parser.add_argument('input', help="JSON lines file of {chemical, calc, prop, data, ph, method}")
+	parser.add_argument('output', help="snapshot file to write")
+	args = parser.parse_args()
+
+	def read_results():
+		with open(args.input) as input_file:
+			for line in input_file:
+				if line.strip():
+					yield json.loads(line)
+
+	count = export_snapshot(read_results(), args.output)
+	print("wrote {} results to {}".format(count, args.output))
+
+
+if __name__ == '__main__':
+	main()
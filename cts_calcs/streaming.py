@@ -0,0 +1,125 @@
+"""
+Incremental parsing of large JSON responses.
+
+Tautomer and stereoisomer enumerations come back as one object whose
+'result' array can hold up to maxStructureCount structures, each with a
+base64 image. iter_json_array() reads the body in chunks (e.g.,
+response.iter_content() on a transport.post(..., stream=True) response)
+and yields the array's items one at a time with JSONDecoder.raw_decode,
+so only the unparsed remainder of the body and the current item are
+held in memory, and a caller that stops early doesn't read the rest.
+"""
+
+import codecs
+import json
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+_decoder = json.JSONDecoder()
+
+
+
+class ChunkReader(object):
+	"""
+	Text buffer over an iterator of byte (or str) chunks.
+	"""
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.decoder = codecs.getincrementaldecoder('utf-8')()
+		self.buffer = ''
+		self.pos = 0
+		self.eof = False
+
+	def read_more(self):
+		"""
+		Appends the next chunk, dropping what's been parsed.
+		Returns False at end of input.
+		"""
+		if self.eof:
+			return False
+		self.buffer = self.buffer[self.pos:]
+		self.pos = 0
+		for chunk in self.chunks:
+			if not chunk:
+				continue
+			self.buffer += chunk if isinstance(chunk, str) else self.decoder.decode(chunk)
+			return True
+		self.buffer += self.decoder.decode(b'', final=True)
+		self.eof = True
+		return False
+
+	def peek(self):
+		"""
+		Returns the next non-whitespace character (not consumed), or None.
+		"""
+		while True:
+			while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+				self.pos += 1
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+			if not self.read_more():
+				return None
+
+	def expect(self, char):
+		if self.peek() != char:
+			raise ValueError("expected {!r} at offset {} of JSON stream".format(char, self.pos))
+		self.pos += 1
+
+	def decode(self):
+		"""
+		Returns the next complete JSON value, reading more as needed.
+		"""
+		self.peek()
+		while True:
+			try:
+				value, end = _decoder.raw_decode(self.buffer, self.pos)
+			except ValueError:
+				if self.read_more():
+					continue
+				raise
+			# a number running up to the end of the buffer may continue in the next chunk
+			if isinstance(value, (int, float)) and not isinstance(value, bool) and not self.eof:
+				if NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer) and self.read_more():
+					continue
+			self.pos = end
+			return value
+
+
+
+def iter_json_array(chunks, key='result'):
+	"""
+	Yields the items of the top-level object's key array from a stream
+	of JSON chunks (a non-array value is yielded as one item). Yields
+	nothing if the object has no key.
+	"""
+	reader = ChunkReader(chunks)
+	reader.expect('{')
+	if reader.peek() == '}':
+		return
+	while True:
+		name = reader.decode()
+		reader.expect(':')
+		if name != key:
+			reader.decode()  # other top-level values (errors, metadata) are small
+		elif reader.peek() != '[':
+			yield reader.decode()
+		else:
+			reader.expect('[')
+			if reader.peek() == ']':
+				reader.pos += 1
+			else:
+				while True:
+					yield reader.decode()
+					if reader.peek() == ']':
+						reader.pos += 1
+						break
+					reader.expect(',')
+			return
+		if reader.peek() == '}':
+			return
+		reader.expect(',')
@@ -0,0 +1,304 @@
+"""
+HTTP transport shared by the CTS calculators.
+
+Every upstream request (web_call, SparcCalc.request_logic,
+JchemProperty.make_data_request, SMILESFilter.is_valid_smiles, etc.)
+goes through send(), which holds a slot from the backend's limiter for
+the duration of the request and reports how the request went, so the
+limiter can adapt to the backend's load. Waiting requests get slots in
+order of their priority class (see scheduler), and timeouts and slot
+waits are cut to whatever is left of the request's deadline (see
+deadline).
+
+The caller's timeout is used as a ceiling: with CTS_ADAPTIVE_TIMEOUTS=1,
+once an endpoint has enough latency samples (timed out requests count
+at the time they waited) its timeout is derived from the observed p99
+(see latency). With
+hedging on (CTS_HEDGE_REQUESTS=1 or send(..., hedge=True)), a duplicate
+request is sent if the first hasn't answered by the endpoint's p95, and
+the first 200 response wins.
+
+Urls on a backend configured with several replicas (see endpoints) are
+rewritten onto the least-loaded healthy replica, and each request's
+outcome feeds that replica's passive health check. Bodies are
+compressed, and with CTS_WIRE_STATS=1 wire sizes recorded, as described
+in compression. Requests can be recorded to, or replayed from, an
+archive (see recorder).
+
+Latency, status and outcome of every request are counted in metrics.
+
+Requests share one keep-alive session. requests itself is imported on
+first use (see lazy_imports); with CTS_WARM_UP=1, or warm_up() called
+at startup, a background thread imports it and opens a connection to
+each configured backend replica so the first real call doesn't pay for
+the import and TCP/TLS handshake.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from .limiter import get_backend_limiter, OUTCOME_SUCCESS, OUTCOME_TIMEOUT, OUTCOME_OVERLOAD, OUTCOME_ERROR
+from .latency import get_latency_tracker
+from .endpoints import find_pool, get_pool
+from . import compression
+from .recorder import get_recorder, note_wire_time
+from .lazy_imports import lazy_import
+from .scheduler import current_priority
+from . import deadline
+from . import metrics
+
+requests = lazy_import('requests')
+
+
+LIMITER_WAIT = float(os.environ.get('CTS_LIMITER_WAIT', 120))  # max seconds to wait for a backend slot
+HEDGE_REQUESTS = os.environ.get('CTS_HEDGE_REQUESTS', '0') == '1'
+HEDGE_WORKERS = int(os.environ.get('CTS_HEDGE_WORKERS', 32))
+POOL_SIZE = int(os.environ.get('CTS_HTTP_POOL_SIZE', 32))  # keep-alive connections per host
+WARM_UP = os.environ.get('CTS_WARM_UP', '0') == '1'
+WARM_UP_POOLS = ['sparc', 'jchem', 'efs']
+
+_hedge_executor = None
+_session = None
+_session_lock = threading.Lock()
+_backend_busy = None
+
+
+
+def backend_busy_error():
+	"""
+	Returns BackendBusy exception class (a requests RequestException,
+	defined on first use so importing transport doesn't load requests).
+	"""
+	global _backend_busy
+	if _backend_busy is None:
+		class BackendBusy(requests.exceptions.RequestException):
+			"""
+			Raised when no backend slot frees up within LIMITER_WAIT.
+			"""
+		_backend_busy = BackendBusy
+	return _backend_busy
+
+
+def __getattr__(name):
+	if name == 'BackendBusy':
+		return backend_busy_error()
+	raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def get_session():
+	"""
+	Returns requests.Session shared by all upstream calls.
+	"""
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				import http.cookiejar
+				session = requests.Session()
+				adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+				session.mount('http://', adapter)
+				session.mount('https://', adapter)
+				# backends are stateless, don't carry cookies between calls:
+				session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+				_session = session
+	return _session
+
+
+def warm_up(urls=None, timeout=5, background=True):
+	"""
+	Imports requests and opens a keep-alive connection to each url
+	(default: every replica of the configured backends).
+	Returns the warm-up thread when run in the background.
+	"""
+	if urls is None:
+		urls = []
+		for name in WARM_UP_POOLS:
+			pool = get_pool(name)
+			if pool:
+				urls.extend(replica.url for replica in pool.replicas)
+	if background:
+		thread = threading.Thread(target=warm_up, args=(urls, timeout, False), name='cts-warm-up')
+		thread.daemon = True
+		thread.start()
+		return thread
+	session = get_session()
+	for url in urls:
+		start_time = time.time()
+		try:
+			session.head(url, timeout=timeout, verify=False).close()
+			logging.info("Warmed up connection to {} in {:.3f}s".format(url, time.time() - start_time))
+		except requests.exceptions.RequestException as e:
+			logging.info("Could not warm up connection to {}: {}".format(url, e))
+	return None
+
+
+
+def endpoint_path(url):
+	"""
+	Returns url's path, the endpoint label for metrics.
+	"""
+	return urlsplit(url if '//' in url else '//' + url).path or '/'
+
+
+def classify_status(status_code):
+	"""
+	Maps HTTP status to limiter outcome.
+	"""
+	if status_code >= 500 or status_code == 429:
+		return OUTCOME_OVERLOAD
+	return OUTCOME_SUCCESS
+
+
+def send(method, url, data=None, headers=None, timeout=None, hedge=None, priority=None, **kwargs):
+	"""
+	Makes HTTP request through url's backend limiter, at priority
+	(default: the thread's scheduler priority class).
+	Returns requests.Response, raises requests exceptions.
+	"""
+	kwargs['priority'] = priority or current_priority()  # hedges run on other threads
+	tracker = get_latency_tracker()
+	timeout = deadline.clip_timeout(tracker.timeout_for(url, timeout), url)
+	if hedge is None:
+		hedge = HEDGE_REQUESTS
+	hedge_delay = tracker.hedge_delay(url) if hedge else None
+	if hedge_delay is None:
+		return send_once(method, url, data=data, headers=headers, timeout=timeout, **kwargs)
+	return send_hedged(hedge_delay, method, url, data=data, headers=headers, timeout=timeout, **kwargs)
+
+
+def send_once(method, url, data=None, headers=None, timeout=None, **kwargs):
+	"""
+	Makes a single request, resending it uncompressed if the
+	backend rejects a compressed body.
+	"""
+	recorder = get_recorder()
+	response = recorder.send(_send_once, method, url, data, headers, timeout=timeout, **kwargs)
+	if response.status_code == 415 and response.request.headers.get('Content-Encoding'):
+		compression.disable_request_compression(url)
+		response = recorder.send(_send_once, method, url, data, headers, timeout=timeout, **kwargs)
+	return response
+
+
+def _send_once(method, url, data=None, headers=None, timeout=None, **kwargs):
+	"""
+	Makes a single request, recording its latency if the backend answered.
+	"""
+	endpoint_url = url  # latency is tracked per endpoint, across replicas
+	priority = kwargs.pop('priority', None) or current_priority()
+	pool = find_pool(url)
+	replica = None
+	if pool:
+		replica = pool.acquire()
+		url = pool.resolve(url, replica)
+	limiter = get_backend_limiter(url)
+	limiter_wait = LIMITER_WAIT
+	if deadline.remaining_time() is not None:
+		limiter_wait = max(0.0, min(limiter_wait, deadline.remaining_time()))
+	if not limiter.acquire(limiter_wait, priority):
+		if replica:
+			pool.release(replica, True)
+		deadline.check(url)
+		metrics.BACKEND_BUSY.inc(limiter.name)
+		logging.warning("No free slot for backend {} after {}s".format(limiter.name, LIMITER_WAIT))
+		raise backend_busy_error()("backend {} busy".format(limiter.name))
+	body, headers = compression.prepare_body(endpoint_url, data, headers)  # configured (and 415s recorded) per primary url
+	stream = kwargs.pop('stream', False)
+	outcome = OUTCOME_ERROR
+	start_time = time.time()
+	deadline_bound = False
+	try:
+		remaining = deadline.remaining_time()
+		deadline_bound = remaining is not None and (not timeout or remaining <= timeout)
+		timeout = deadline.clip_timeout(timeout, url)  # less any time spent waiting for the slot
+		read_here = compression.WIRE_STATS and not stream
+		response = get_session().request(method, url, data=body, headers=headers, timeout=timeout, stream=stream or read_here, **kwargs)
+		if read_here:
+			request_size = len(data.encode('utf-8') if isinstance(data, str) else data or b'')
+			compression.read_response(response, limiter.name, request_size, len(body or b''))
+		outcome = classify_status(response.status_code)
+		metrics.UPSTREAM_RESPONSES.inc(limiter.name, endpoint_path(endpoint_url), response.status_code)
+		if outcome == OUTCOME_SUCCESS:
+			get_latency_tracker().record(endpoint_url, time.time() - start_time)
+		return response
+	except requests.exceptions.Timeout:
+		# a timeout cut short by the caller's deadline says nothing about the backend's load
+		outcome = OUTCOME_ERROR if deadline_bound else OUTCOME_TIMEOUT
+		if outcome == OUTCOME_TIMEOUT:
+			get_latency_tracker().record(endpoint_url, time.time() - start_time)
+		raise
+	except requests.exceptions.ConnectionError:
+		outcome = OUTCOME_OVERLOAD
+		raise
+	finally:
+		elapsed = time.time() - start_time
+		note_wire_time(elapsed)
+		limiter.release(elapsed, outcome, endpoint_path(endpoint_url))
+		metrics.UPSTREAM_SECONDS.observe(elapsed, limiter.name, endpoint_path(endpoint_url), outcome)
+		if replica:
+			pool.release(replica, outcome not in (OUTCOME_TIMEOUT, OUTCOME_OVERLOAD))
+
+
+def send_hedged(hedge_delay, method, url, **kwargs):
+	"""
+	Sends request, and a duplicate if no response arrives within
+	hedge_delay seconds. Returns the first 200 response, else the
+	last response, else raises the last exception. The losing
+	responses are closed, so their connections go back to the pool.
+	"""
+	executor = get_hedge_executor()
+	primary = executor.submit(deadline.with_deadline(send_once), method, url, **kwargs)
+	done, _ = concurrent.futures.wait([primary], timeout=hedge_delay)
+	if done:
+		return primary.result()
+	logging.info("No response from {} after {:.3f}s, sending hedged request".format(url, hedge_delay))
+	backup = executor.submit(deadline.with_deadline(send_once), method, url, **kwargs)
+	last_response, last_error = None, None
+	for future in concurrent.futures.as_completed([primary, backup]):
+		try:
+			response = future.result()
+		except (requests.exceptions.RequestException, deadline.DeadlineExceeded) as e:
+			last_error = e  # the other attempt may still succeed
+			continue
+		if response.status_code == 200:
+			for other in (primary, backup):
+				if other is not future:
+					other.add_done_callback(close_response)  # the slower request finishes in the background
+			return response
+		if last_response is not None:
+			last_response.close()
+		last_response = response
+	if last_response is not None:
+		return last_response
+	raise last_error
+
+
+def close_response(future):
+	"""
+	Closes the response of a finished hedge attempt that lost.
+	"""
+	if not future.cancelled() and future.exception() is None:
+		future.result().close()
+
+
+def get_hedge_executor():
+	global _hedge_executor
+	if _hedge_executor is None:
+		_hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGE_WORKERS)
+	return _hedge_executor
+
+
+def post(url, data=None, headers=None, timeout=None, **kwargs):
+	return send('POST', url, data=data, headers=headers, timeout=timeout, **kwargs)
+
+
+def get(url, headers=None, timeout=None, **kwargs):
+	return send('GET', url, headers=headers, timeout=timeout, **kwargs)
+
+
+if WARM_UP:
+	warm_up()
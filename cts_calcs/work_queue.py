@@ -0,0 +1,386 @@
+"""
+Queue-backed batch executor for sharding p-chem calculations across nodes.
+
+A BatchProducer enqueues (chemical, calc, props) tasks onto a broker and
+BatchWorkers on any number of hosts reserve tasks, run the calculator
+(SparcCalc.data_request_handler or JchemProperty.getJchemPropData) and
+write the result to a ResultCache before acknowledging. Delivery is
+at-least-once: a reserved task that isn't acked within the visibility
+timeout is redelivered. Task ids are derived from the request itself,
+so resubmitting or redelivering a task never computes it twice once a
+result is stored.
+
+LocalBroker is an in-process broker stand-in; RedisBroker shares the
+queue through the same Redis used by the result cache. Failed tasks are
+stored with their error for progress reporting, and are queued again
+if the same request is submitted later. The pending marker that keeps
+two producers from queueing the same task expires after pending_ttl,
+so a lost message only blocks resubmission that long; the worst case
+after it expires is a task queued twice, which the worker skips once
+a result is stored.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from .cache import get_result_cache, DEFAULT_NAMESPACE
+from .scheduler import priority, PRIORITY_BATCH
+
+
+DEFAULT_VISIBILITY_TIMEOUT = 300  # seconds before an unacked task is redelivered
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_PENDING_TTL = 900  # seconds a queued task blocks resubmitting the same request
+
+
+
+def make_task_id(chemical, calc, props, ph=7.0, method=None):
+	"""
+	Idempotent task key from the request's contents.
+	"""
+	key_obj = {
+		'chemical': chemical,
+		'calc': calc,
+		'props': sorted(props),
+		'ph': float(ph) if ph is not None else None,
+		'method': method
+	}
+	return hashlib.sha1(json.dumps(key_obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+
+class LocalBroker(object):
+	"""
+	In-process broker with visibility timeouts, for local runs
+	and as a stand-in for RedisBroker.
+	"""
+
+	def __init__(self, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+		self.visibility_timeout = visibility_timeout
+		self._queue = collections.deque()
+		self._inflight = {}  # receipt: (task, deadline)
+		self._cond = threading.Condition()
+
+	def put(self, task):
+		with self._cond:
+			self._queue.append(json.dumps(task))
+			self._cond.notify()
+
+	def reserve(self, timeout=None):
+		"""
+		Returns (receipt, task) or (None, None) if nothing arrives in time.
+		"""
+		end_time = time.time() + timeout if timeout is not None else None
+		with self._cond:
+			while True:
+				self._requeue_expired()
+				if self._queue:
+					raw_task = self._queue.popleft()
+					receipt = uuid.uuid4().hex
+					self._inflight[receipt] = (raw_task, time.time() + self.visibility_timeout)
+					return receipt, json.loads(raw_task)
+				wait_time = 1.0
+				if end_time is not None:
+					wait_time = min(wait_time, end_time - time.time())
+					if wait_time <= 0:
+						return None, None
+				self._cond.wait(wait_time)
+
+	def ack(self, receipt):
+		with self._cond:
+			return self._inflight.pop(receipt, None) is not None
+
+	def nack(self, receipt, task):
+		"""
+		Returns task to the queue (e.g., with bumped attempt count).
+		"""
+		with self._cond:
+			self._inflight.pop(receipt, None)
+			self._queue.append(json.dumps(task))
+			self._cond.notify()
+
+	def depth(self):
+		with self._cond:
+			return len(self._queue), len(self._inflight)
+
+	def _requeue_expired(self):
+		now = time.time()
+		for receipt, (raw_task, deadline) in list(self._inflight.items()):
+			if deadline < now:
+				logging.warning("Task not acked before visibility timeout, redelivering.")
+				del self._inflight[receipt]
+				self._queue.append(raw_task)
+
+
+
+class RedisBroker(object):
+	"""
+	Redis list broker. reserve() moves a task from the queue to a
+	processing list in one BLMOVE, so a task is always in one of the
+	two lists. Each put() gives the message its own id; a reserved
+	message's visibility deadline is kept in a sorted set under that id
+	until acked. Whichever worker next finds a deadline passed moves the
+	message back to the queue, and a message left in the processing list
+	with no deadline (its worker died right after BLMOVE) gets one.
+	"""
+
+	def __init__(self, client, name='cts:batch', visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+		self.client = client
+		self.queue_key = name + ':queue'
+		self.processing_key = name + ':processing'
+		self.inflight_key = name + ':inflight'
+		self.visibility_timeout = visibility_timeout
+		self._reserved = {}  # receipt (message id): raw message, for this worker's ack/nack
+
+	def put(self, task):
+		self.client.lpush(self.queue_key, self.encode(task))
+
+	@staticmethod
+	def encode(task):
+		return json.dumps({'message_id': uuid.uuid4().hex, 'task': task})
+
+	def reserve(self, timeout=None):
+		self._requeue_expired()
+		raw_message = self.client.blmove(self.queue_key, self.processing_key, timeout or 0, 'RIGHT', 'LEFT')
+		if not raw_message:
+			return None, None
+		message = json.loads(raw_message)
+		self.client.zadd(self.inflight_key, {message['message_id']: time.time() + self.visibility_timeout})
+		self._reserved[message['message_id']] = raw_message
+		return message['message_id'], message['task']
+
+	def ack(self, receipt):
+		raw_message = self._reserved.pop(receipt, None)
+		if raw_message is None:
+			return False
+		pipe = self.client.pipeline(transaction=True)
+		pipe.lrem(self.processing_key, 1, raw_message)
+		pipe.zrem(self.inflight_key, receipt)
+		removed, _ = pipe.execute()
+		return bool(removed)
+
+	def nack(self, receipt, task):
+		"""
+		Returns task to the queue (e.g., with bumped attempt count).
+		"""
+		raw_message = self._reserved.pop(receipt, None)
+		pipe = self.client.pipeline(transaction=True)
+		if raw_message is not None:
+			pipe.lrem(self.processing_key, 1, raw_message)
+		pipe.zrem(self.inflight_key, receipt)
+		pipe.lpush(self.queue_key, self.encode(task))
+		pipe.execute()
+
+	def depth(self):
+		return self.client.llen(self.queue_key), self.client.llen(self.processing_key)
+
+	def _requeue_expired(self):
+		now = time.time()
+		for raw_message in self.client.lrange(self.processing_key, 0, -1):
+			message_id = json.loads(raw_message)['message_id']
+			deadline = self.client.zscore(self.inflight_key, message_id)
+			if deadline is None:
+				# reserved by a worker that hasn't recorded (or died before recording) a deadline
+				self.client.zadd(self.inflight_key, {message_id: now + self.visibility_timeout}, nx=True)
+			elif deadline < now and self.client.zrem(self.inflight_key, message_id):
+				# only the worker that removed it requeues it
+				logging.warning("Task not acked before visibility timeout, redelivering.")
+				pipe = self.client.pipeline(transaction=True)
+				pipe.lrem(self.processing_key, 1, raw_message)
+				pipe.lpush(self.queue_key, raw_message)
+				pipe.execute()
+
+
+
+class BatchProducer(object):
+	"""
+	Enqueues batch p-chem requests and reports job progress.
+	"""
+
+	def __init__(self, broker, result_store=None, pending_ttl=DEFAULT_PENDING_TTL):
+		self.broker = broker
+		self.result_store = result_store or get_result_cache()
+		self.pending_ttl = pending_ttl
+
+	def submit(self, requests_list, job_id=None):
+		"""
+		Inputs: list of request dicts with keys chemical, calc, props,
+		and optional ph, method.
+		Returns: job dict with keys job_id, task_ids
+		"""
+		job_id = job_id or uuid.uuid4().hex
+		task_ids = []
+		for request_dict in requests_list:
+			props = request_dict.get('props') or [request_dict.get('prop')]
+			ph = request_dict.get('ph', 7.0)
+			task_id = make_task_id(request_dict['chemical'], request_dict['calc'], props, ph, request_dict.get('method'))
+			if task_id in task_ids:
+				continue
+			task_ids.append(task_id)
+			result = self.result_store.get(self.result_key(task_id))
+			if result is not None:
+				if not result.get('error'):
+					continue  # already computed by an earlier job
+				self.result_store.delete(self.result_key(task_id))  # failed before, run it again
+			if not self.result_store.client.set(self.pending_key(task_id), job_id, ex=self.pending_ttl, nx=True):
+				continue  # already queued by another producer
+			try:
+				self.broker.put({
+					'task_id': task_id,
+					'chemical': request_dict['chemical'],
+					'calc': request_dict['calc'],
+					'props': props,
+					'ph': ph,
+					'method': request_dict.get('method'),
+					'attempts': 0
+				})
+			except Exception:
+				self.result_store.delete(self.pending_key(task_id))  # never queued, let a resubmit queue it
+				raise
+		self.result_store.set(self.job_key(job_id), task_ids)
+		return {'job_id': job_id, 'task_ids': task_ids}
+
+	def progress(self, job_id):
+		"""
+		Returns dict with keys total, done, failed, pending.
+		"""
+		task_ids = self.result_store.get(self.job_key(job_id)) or []
+		done, failed = 0, 0
+		for task_id in task_ids:
+			result = self.result_store.get(self.result_key(task_id))
+			if result is None:
+				continue
+			if result.get('error'):
+				failed += 1
+			else:
+				done += 1
+		return {'total': len(task_ids), 'done': done, 'failed': failed, 'pending': len(task_ids) - done - failed}
+
+	def results(self, job_id):
+		"""
+		Returns {task_id: result} for job's finished tasks.
+		"""
+		task_ids = self.result_store.get(self.job_key(job_id)) or []
+		job_results = {}
+		for task_id in task_ids:
+			result = self.result_store.get(self.result_key(task_id))
+			if result is not None:
+				job_results[task_id] = result
+		return job_results
+
+	@staticmethod
+	def result_key(task_id):
+		return DEFAULT_NAMESPACE + ':batch:result:' + task_id
+
+	@staticmethod
+	def pending_key(task_id):
+		return DEFAULT_NAMESPACE + ':batch:pending:' + task_id
+
+	@staticmethod
+	def job_key(job_id):
+		return DEFAULT_NAMESPACE + ':batch:job:' + job_id
+
+
+
+class BatchWorker(object):
+	"""
+	Reserves tasks from a broker, runs the calculator and
+	stores results. Run one per process on as many nodes as needed.
+	"""
+
+	def __init__(self, broker, result_store=None, max_attempts=DEFAULT_MAX_ATTEMPTS, sink=None,
+			priority_class=PRIORITY_BATCH):
+		self.broker = broker
+		self.result_store = result_store or get_result_cache()
+		self.max_attempts = max_attempts
+		self.sink = sink  # optional result_sink.ResultSink, written as tasks finish
+		self.priority_class = priority_class  # yields backend slots to interactive requests
+		self.processed = 0
+
+	def run(self, max_tasks=None, idle_timeout=None):
+		"""
+		Processes tasks until max_tasks are done or no task
+		arrives within idle_timeout seconds.
+		"""
+		while max_tasks is None or self.processed < max_tasks:
+			receipt, task = self.broker.reserve(timeout=idle_timeout)
+			if task is None:
+				break
+			with priority(self.priority_class):
+				self.handle_task(receipt, task)
+		return self.processed
+
+	def handle_task(self, receipt, task):
+		result_key = BatchProducer.result_key(task['task_id'])
+		stored = self.result_store.get(result_key)
+		if stored is not None and not stored.get('error'):
+			# redelivered task that already finished elsewhere
+			self.broker.ack(receipt)
+			return
+		start_time = time.time()
+		result = {
+			'task_id': task['task_id'],
+			'calc': task['calc'],
+			'chemical': task['chemical'],
+			'props': task.get('props'),
+			'ph': task.get('ph'),
+			'method': task.get('method')
+		}
+		try:
+			result['data'] = self.run_task(task)
+		except Exception as e:
+			logging.warning("Exception running batch task {}: {}".format(task['task_id'], e))
+			task['attempts'] = task.get('attempts', 0) + 1
+			if task['attempts'] < self.max_attempts:
+				self.broker.nack(receipt, task)
+				return
+			result.update(data=None, error=str(e))
+		# stores result before ack, a crash in between only means redelivery:
+		self.result_store.set(result_key, result)
+		self.result_store.delete(BatchProducer.pending_key(task['task_id']))
+		self.broker.ack(receipt)
+		self.processed += 1
+		if self.sink is not None:
+			try:
+				self.sink.write_task_result(result, task, time.time() - start_time)
+			except Exception as e:
+				# the result is stored and acked, the export just misses it
+				logging.warning("Exception writing batch task {} to result sink: {}".format(task['task_id'], e))
+
+	def run_task(self, task):
+		"""
+		Runs task's calculator, returns list of {calc, prop, data} objects.
+		Raises if the calculator returns nothing, so the task is retried.
+		"""
+		request_dict = {
+			'chemical': task['chemical'],
+			'calc': task['calc'],
+			'props': list(task['props']),
+			'ph': task.get('ph', 7.0),
+			'method': task.get('method')
+		}
+		if task['calc'] == 'sparc':
+			from .calculator_sparc import SparcCalc
+			data = []
+			multi_props = [prop for prop in task['props'] if not prop in ['ion_con', 'kow_wph']]
+			if multi_props:
+				response = SparcCalc(task['chemical']).data_request_handler(dict(request_dict, props=multi_props))
+				if response is None:
+					raise Exception("no sparc data for {}".format(multi_props))
+				data.extend(response if isinstance(response, list) else [response])
+			for prop in ['ion_con', 'kow_wph']:
+				if prop in task['props']:
+					response = SparcCalc(task['chemical']).data_request_handler(dict(request_dict, prop=prop))
+					if response is None:
+						raise Exception("no sparc data for {}".format(prop))
+					data.append({'calc': 'sparc', 'prop': prop, 'data': response.get('data')})
+			return data
+		elif task['calc'] == 'chemaxon':
+			from .jchem_properties import JchemProperty
+			return [JchemProperty().getJchemPropData(dict(request_dict, prop=prop)) for prop in task['props']]
+		else:
+			raise ValueError("Batch calc {} not supported".format(task['calc']))
@@ -0,0 +1,314 @@
+"""
+Minimal Redis-compatible (RESP2) server for tests: enough of the
+command set for a redis.StrictRedis client talking to cache.ResultCache
+and work_queue.RedisBroker, kept in memory and run in a thread.
+"""
+
+import socketserver
+import threading
+import time
+
+
+class RespError(Exception):
+	pass
+
+
+
+class RedisStandin(object):
+	"""
+	In-memory keyspace: strings (with expiry), lists and sorted sets.
+	"""
+
+	def __init__(self):
+		self.data = {}
+		self.expires = {}
+		self.commands = []  # (name, args) of every command received
+		self.lock = threading.Condition()
+
+	def alive(self, key):
+		expires_at = self.expires.get(key)
+		if expires_at is not None and expires_at <= time.time():
+			self.data.pop(key, None)
+			self.expires.pop(key, None)
+		return key in self.data
+
+	def execute(self, name, args):
+		handler = getattr(self, 'cmd_' + name.lower(), None)
+		if handler is None:
+			raise RespError("ERR unknown command '{}'".format(name))
+		with self.lock:
+			self.commands.append((name.upper(), args))
+			result = handler(*args)
+			self.lock.notify_all()
+			return result
+
+	def wait_for(self, predicate, timeout):
+		"""
+		Waits (lock held) up to timeout seconds (0: forever) for predicate().
+		"""
+		deadline = time.time() + timeout if timeout else None
+		while True:
+			result = predicate()
+			if result is not None:
+				return result
+			remaining = deadline - time.time() if deadline else None
+			if remaining is not None and remaining <= 0:
+				return None
+			self.lock.wait(remaining if remaining is not None else 0.1)
+
+	# connection
+	def cmd_hello(self, *args):
+		return {'server': b'redis', 'version': b'7.2.0', 'proto': int(args[0]) if args else 2, 'mode': b'standalone', 'role': b'master', 'modules': []}
+
+	def cmd_ping(self, *args):
+		return 'PONG'
+
+	def cmd_client(self, *args):
+		return 'OK'
+
+	def cmd_select(self, db):
+		return 'OK'
+
+	# strings
+	def cmd_get(self, key):
+		return self.data.get(key) if self.alive(key) else None
+
+	def cmd_set(self, key, value, *options):
+		options = [option.upper() if isinstance(option, bytes) else option for option in options]
+		if b'NX' in options and self.alive(key):
+			return None
+		self.data[key] = value
+		self.expires.pop(key, None)
+		if b'EX' in options:
+			self.expires[key] = time.time() + int(options[options.index(b'EX') + 1])
+		if b'PX' in options:
+			self.expires[key] = time.time() + int(options[options.index(b'PX') + 1]) / 1000.0
+		return 'OK'
+
+	def cmd_del(self, *keys):
+		deleted = 0
+		for key in keys:
+			if self.alive(key):
+				del self.data[key]
+				self.expires.pop(key, None)
+				deleted += 1
+		return deleted
+
+	def cmd_exists(self, *keys):
+		return sum(1 for key in keys if self.alive(key))
+
+	def cmd_ttl(self, key):
+		if not self.alive(key):
+			return -2
+		if key not in self.expires:
+			return -1
+		return int(round(self.expires[key] - time.time()))
+
+	def cmd_flushdb(self, *args):
+		self.data.clear()
+		self.expires.clear()
+		return 'OK'
+
+	def cmd_incrby(self, key, amount):
+		value = int(self.data.get(key, b'0') if self.alive(key) else b'0') + int(amount)
+		self.data[key] = str(value).encode()
+		return value
+
+	def cmd_incr(self, key):
+		return self.cmd_incrby(key, b'1')
+
+	# lists (head is index 0)
+	def list_at(self, key):
+		if not self.alive(key):
+			self.data[key] = []
+		return self.data[key]
+
+	def cmd_lpush(self, key, *values):
+		items = self.list_at(key)
+		for value in values:
+			items.insert(0, value)
+		return len(items)
+
+	def cmd_rpush(self, key, *values):
+		items = self.list_at(key)
+		items.extend(values)
+		return len(items)
+
+	def cmd_llen(self, key):
+		return len(self.data[key]) if self.alive(key) else 0
+
+	def cmd_lrange(self, key, start, stop):
+		items = self.data.get(key, []) if self.alive(key) else []
+		start, stop = int(start), int(stop)
+		stop = len(items) if stop == -1 else stop + 1
+		return list(items[start:stop])
+
+	def cmd_lrem(self, key, count, value):
+		if not self.alive(key):
+			return 0
+		items = self.data[key]
+		count = int(count)
+		removed = 0
+		for index in range(len(items) - 1, -1, -1) if count < 0 else range(len(items)):
+			if index < len(items) and items[index] == value and (not count or removed < abs(count)):
+				removed += 1
+				items[index] = None
+		self.data[key] = [item for item in items if item is not None]
+		return removed
+
+	def pop_move(self, source, destination, wherefrom, whereto):
+		if not self.alive(source) or not self.data[source]:
+			return None
+		value = self.data[source].pop(0 if wherefrom == b'LEFT' else -1)
+		items = self.list_at(destination)
+		if whereto == b'LEFT':
+			items.insert(0, value)
+		else:
+			items.append(value)
+		return value
+
+	def cmd_lmove(self, source, destination, wherefrom, whereto):
+		return self.pop_move(source, destination, wherefrom.upper(), whereto.upper())
+
+	def cmd_blmove(self, source, destination, wherefrom, whereto, timeout):
+		return self.wait_for(lambda: self.pop_move(source, destination, wherefrom.upper(), whereto.upper()), float(timeout))
+
+	def cmd_rpoplpush(self, source, destination):
+		return self.pop_move(source, destination, b'RIGHT', b'LEFT')
+
+	def cmd_brpoplpush(self, source, destination, timeout):
+		return self.wait_for(lambda: self.pop_move(source, destination, b'RIGHT', b'LEFT'), float(timeout))
+
+	# sorted sets, as {member: score}
+	def zset_at(self, key):
+		if not self.alive(key):
+			self.data[key] = {}
+		return self.data[key]
+
+	def cmd_zadd(self, key, *args):
+		members = self.zset_at(key)
+		args = list(args)
+		nx = False
+		while args and args[0].upper() in (b'NX', b'XX', b'CH', b'GT', b'LT'):
+			nx = nx or args.pop(0).upper() == b'NX'
+		added = 0
+		for index in range(0, len(args), 2):
+			if args[index + 1] in members:
+				if nx:
+					continue
+			else:
+				added += 1
+			members[args[index + 1]] = float(args[index])
+		return added
+
+	def cmd_zrem(self, key, *names):
+		members = self.zset_at(key)
+		return sum(1 for name in names if members.pop(name, None) is not None)
+
+	def cmd_zscore(self, key, name):
+		return self.zset_at(key).get(name)
+
+	def cmd_zcard(self, key):
+		return len(self.zset_at(key))
+
+	def cmd_zrangebyscore(self, key, low, high, *options):
+		low = float('-inf') if low == b'-inf' else float(low)
+		high = float('inf') if high == b'+inf' else float(high)
+		members = sorted((score, name) for name, score in self.zset_at(key).items() if low <= score <= high)
+		return [name for _, name in members]
+
+
+
+def encode(value, protocol=2):
+	if value is None:
+		return b'_\r\n' if protocol == 3 else b'$-1\r\n'
+	if isinstance(value, dict):
+		items = [item for pair in value.items() for item in pair]
+		if protocol == 3:
+			return '%{}\r\n'.format(len(value)).encode() + b''.join(encode(item, protocol) for item in items)
+		value = items
+	if isinstance(value, RespError):
+		return '-{}\r\n'.format(value).encode()
+	if isinstance(value, bool):
+		value = int(value)
+	if isinstance(value, int):
+		return ':{}\r\n'.format(value).encode()
+	if isinstance(value, float):
+		if protocol == 3:
+			return ',{!r}\r\n'.format(value).encode()
+		value = repr(value).encode()
+	if isinstance(value, str):
+		return '+{}\r\n'.format(value).encode()
+	if isinstance(value, list):
+		return '*{}\r\n'.format(len(value)).encode() + b''.join(encode(item, protocol) for item in value)
+	return '${}\r\n'.format(len(value)).encode() + value + b'\r\n'
+
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+	def read_command(self):
+		line = self.rfile.readline()
+		if not line:
+			return None
+		count = int(line[1:].strip())
+		args = []
+		for _ in range(count):
+			length = int(self.rfile.readline()[1:].strip())
+			args.append(self.rfile.read(length + 2)[:-2])
+		return args
+
+	def execute(self, args):
+		try:
+			return self.server.store.execute(args[0].decode(), args[1:])
+		except RespError as e:
+			return e
+		except Exception as e:
+			return RespError("ERR {}".format(e))
+
+	def handle(self):
+		protocol = 2
+		transaction = None  # commands queued since MULTI
+		while True:
+			args = self.read_command()
+			if not args:
+				return
+			name = args[0].upper()
+			if name == b'MULTI':
+				transaction, reply = [], 'OK'
+			elif name == b'EXEC':
+				with self.server.store.lock:
+					reply = [self.execute(queued) for queued in transaction or []]
+				transaction = None
+			elif name == b'DISCARD':
+				transaction, reply = None, 'OK'
+			elif transaction is not None:
+				transaction.append(args)
+				reply = 'QUEUED'
+			else:
+				reply = self.execute(args)
+				if name == b'HELLO' and len(args) > 1:
+					protocol = int(args[1])  # RESP3 replies from here on
+			self.wfile.write(encode(reply, protocol))
+
+
+
+class RedisStandinServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address=('127.0.0.1', 0)):
+		socketserver.ThreadingTCPServer.__init__(self, address, RespHandler)
+		self.store = RedisStandin()
+
+
+
+def start_redis_standin():
+	"""
+	Starts stand-in in a background thread. Returns (server, port).
+	"""
+	server = RedisStandinServer()
+	thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+	thread.daemon = True
+	thread.start()
+	return server, server.server_address[1]
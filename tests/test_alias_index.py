@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from cts_calcs import alias_index as alias_index_module
+from cts_calcs.alias_index import AliasIndex, raw_key
+from cts_calcs.calculator import Calculator
+from cts_calcs.smilesfilter import SMILESFilter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(time, 'time', lambda: now[0])
+	return now
+
+
+@pytest.fixture
+def alias_index(monkeypatch):
+	index = AliasIndex()
+	monkeypatch.setattr(alias_index_module, '_alias_index', index)
+	return index
+
+
+def test_get_put():
+	index = AliasIndex()
+	assert index.get('OCC', 'filterSMILES') is None
+	index.put('OCC', 'filterSMILES', 'CCO')
+	assert index.get('OCC', 'filterSMILES') == 'CCO'
+	assert index.get('OCC', 'filterSMILES:node') is None
+	assert index.stats()['hit_rate'] == 1.0 / 3
+
+
+def test_entries_expire(clock):
+	index = AliasIndex(ttl=60)
+	index.put('OCC', 'filterSMILES', 'CCO')
+	clock[0] += 59
+	assert index.get('OCC', 'filterSMILES') == 'CCO'
+	clock[0] += 2
+	assert index.get('OCC', 'filterSMILES') is None
+
+
+def test_evicts_least_recently_used(clock):
+	index = AliasIndex(max_entries=2, prune_every=1)
+	index.put('a', 'filterSMILES', 'C')
+	clock[0] += 100
+	index.put('b', 'filterSMILES', 'CC')
+	clock[0] += 100
+	assert index.get('a', 'filterSMILES') == 'C'  # a is now the more recently used
+	clock[0] += 100
+	index.put('c', 'filterSMILES', 'CCC')
+	assert index.get('b', 'filterSMILES') is None
+	assert index.get('a', 'filterSMILES') == 'C'
+	assert index.get('c', 'filterSMILES') == 'CCC'
+	assert index.stats()['size'] == 2
+	assert index.stats()['evictions'] == 1
+
+
+def test_long_inputs_are_hashed():
+	mrv = '<cml><MDocument><MChemicalStruct>' + 'x' * 1000 + '</MChemicalStruct></MDocument></cml>'
+	index = AliasIndex()
+	index.put(mrv, 'convertToSMILES', 'CCO')
+	assert index.get(mrv, 'convertToSMILES') == 'CCO'
+	(raw, filter_path), = index.aliases('CCO')
+	assert raw == raw_key(mrv) and len(raw) < 100
+
+
+def test_upgrades_old_index_file(tmp_path):
+	import sqlite3
+	path = str(tmp_path / 'alias.db')
+	conn = sqlite3.connect(path)
+	conn.execute("CREATE TABLE alias (raw TEXT NOT NULL, filter_path TEXT NOT NULL, smiles TEXT NOT NULL, PRIMARY KEY (raw, filter_path))")
+	conn.execute("INSERT INTO alias VALUES ('OCC', 'filterSMILES', 'CCO')")
+	conn.commit()
+	conn.close()
+	index = AliasIndex(path)
+	assert index.get('OCC', 'filterSMILES') is None  # old entries count as expired
+	index.put('OCC', 'filterSMILES', 'CCO')
+	assert index.get('OCC', 'filterSMILES') == 'CCO'
+
+
+def test_conversions_are_indexed(alias_index, monkeypatch):
+	monkeypatch.setenv('CTS_RESULT_CACHE', '1')
+	calls = []
+
+	def web_call(self, url, data, headers=None):
+		calls.append(data['structure'])
+		if data['structure'] == 'not a chemical':
+			return {'errorCode': 1, 'errorMessage': "Cannot import"}
+		return {'structure': 'CCO', 'format': 'smiles'}
+
+	monkeypatch.setattr(Calculator, 'web_call', web_call)
+	calc = Calculator()
+	assert calc.get_smiles_from_name('ethanol')['smiles'] == 'CCO'
+	assert calc.get_smiles_from_name('ethanol')['smiles'] == 'CCO'
+	assert calc.convertToSMILES({'chemical': '64-17-5'})['structure'] == 'CCO'
+	assert calc.convertToSMILES({'chemical': '64-17-5'})['structure'] == 'CCO'
+	assert calc.get_smiles_from_name('not a chemical').get('error')
+	assert calc.get_smiles_from_name('not a chemical').get('error')
+	assert calls == ['ethanol', '64-17-5', 'not a chemical', 'not a chemical']
+
+
+def test_index_is_off_without_result_cache(alias_index, monkeypatch):
+	monkeypatch.setenv('CTS_RESULT_CACHE', '0')
+	calls = []
+
+	def web_call(self, url, data, headers=None):
+		calls.append(data['structure'])
+		return {'structure': 'CCO', 'format': 'smiles'}
+
+	monkeypatch.setattr(Calculator, 'web_call', web_call)
+	calc = Calculator()
+	assert calc.get_smiles_from_name('ethanol')['smiles'] == 'CCO'
+	assert calc.get_smiles_from_name('ethanol')['smiles'] == 'CCO'
+	assert calls == ['ethanol', 'ethanol']
+	assert alias_index.stats()['size'] == 0
+
+
+def test_identity_filtering_is_not_indexed(alias_index, monkeypatch):
+	monkeypatch.setenv('CTS_RESULT_CACHE', '1')
+	monkeypatch.setenv('CTS_EFS_SERVER', 'http://ctsws')
+	filtered, errors = SMILESFilter().parseSmilesByCalculators('CCO', ['chemaxon'])
+	assert (filtered, errors) == ({'chemaxon': 'CCO'}, {})
+	assert alias_index.stats()['size'] == 0
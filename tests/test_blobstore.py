@@ -0,0 +1,136 @@
+import base64
+import gc
+import json
+import multiprocessing
+import tracemalloc
+
+import pytest
+
+import fixtures
+
+from cts_calcs import blobstore
+from cts_calcs.blobstore import DiskBlobStore, ImageHandle, MemoryBlobStore, resolve_images, store_image
+from cts_calcs.jchem_properties import Pka
+
+
+def image(seed, size=6000):
+	return fixtures.fake_image(seed, size)
+
+
+@pytest.fixture(autouse=True)
+def jchem_server(monkeypatch):
+	monkeypatch.setenv('CTS_JCHEM_SERVER', 'http://localhost:8080')
+
+
+@pytest.fixture
+def blob_store():
+	def use(store):
+		return blobstore.set_blob_store(store)
+	yield use
+	blobstore.set_blob_store(None)
+
+
+def test_handles_resolve_and_deduplicate():
+	store = MemoryBlobStore()
+	first, second = store_image(store, image('a')), store_image(store, image('a'))
+	assert isinstance(first, ImageHandle) and first == second
+	assert len(store) == 1
+	assert str(first) == image('a')
+	assert resolve_images({'images': [first, {'image': second}]}) == {'images': [image('a'), {'image': image('a')}]}
+	assert store_image(None, image('a')) == image('a')
+
+
+def test_full_memory_store_keeps_images_inline():
+	size = len(base64.b64decode(image('a')))
+	store = MemoryBlobStore(max_bytes=2 * size)
+	handles = [store_image(store, image(seed)) for seed in 'abc']
+	assert isinstance(handles[0], ImageHandle) and isinstance(handles[1], ImageHandle)
+	assert handles[2] == image('c')  # didn't fit: stays a string
+	assert [str(handle) for handle in handles] == [image(seed) for seed in 'abc']
+
+
+def test_full_memory_store_spills_to_overflow():
+	size = len(base64.b64decode(image('a')))
+	overflow = MemoryBlobStore()
+	store = MemoryBlobStore(max_bytes=2 * size, overflow=overflow)
+	handles = [store_image(store, image(seed)) for seed in 'abc']
+	assert all(isinstance(handle, ImageHandle) for handle in handles)
+	assert len(store) == 2 and len(overflow) == 1
+	assert [str(handle) for handle in handles] == [image(seed) for seed in 'abc']
+
+
+def write_blob(path, seed, queue):
+	store = DiskBlobStore(path)
+	handle = store_image(store, image(seed))
+	queue.put(str(handle) == image(seed))
+	store.close()
+
+
+def test_disk_store_is_shared_without_truncating(tmp_path):
+	path = str(tmp_path / 'images.blob')
+	store = DiskBlobStore(path)
+	handle = store_image(store, image('a'))
+	assert str(handle) == image('a')
+
+	# another process (and another store in this one) opening the file leaves these blobs alone:
+	context = multiprocessing.get_context('fork')
+	queue = context.Queue()
+	process = context.Process(target=write_blob, args=(path, 'b', queue))
+	process.start()
+	assert queue.get(timeout=10)
+	process.join(10)
+	other = DiskBlobStore(path)
+	other_handle = store_image(other, image('c'))
+	assert str(handle) == image('a')
+	assert str(other_handle) == image('c')
+	assert str(store_image(store, image('d'))) == image('d')
+	assert str(handle) == image('a')
+	store.close()
+	other.close()
+
+
+def test_store_image_leaves_raw_results(blob_store):
+	blob_store(MemoryBlobStore())
+	pka = Pka()
+	pka.results = fixtures.jchem_pka_response(2)
+	raw = json.dumps(pka.results)
+	parent = pka.getParent(test=True)
+	microspecies = pka.getMicrospecies(test=True)
+	assert isinstance(parent['image'], ImageHandle)
+	assert all(isinstance(ms['image'], ImageHandle) for ms in microspecies)
+	assert json.dumps(pka.results) == raw
+
+
+def retained_memory(texts):
+	"""
+	Bytes retained by speciation results for response texts, after
+	the raw responses are dropped.
+	"""
+	gc.collect()
+	tracemalloc.start()
+	try:
+		results = []
+		for text in texts:
+			pka = Pka()
+			pka.results = json.loads(text)
+			results.append((pka.getParent(test=True), pka.getMicrospecies(test=True)))
+		gc.collect()
+		retained, _ = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	assert len(results) == len(texts)
+	return retained
+
+
+def test_blob_store_reduces_retained_memory(blob_store, tmp_path):
+	# same microspecies for every chemical, as for a batch of related chemicals:
+	texts = [json.dumps(fixtures.jchem_pka_response(8))] * 20
+	blob_store(None)
+	inline = retained_memory(texts)
+	blob_store(MemoryBlobStore())
+	in_memory = retained_memory(texts)
+	store = blob_store(DiskBlobStore(str(tmp_path / 'images.blob')))
+	on_disk = retained_memory(texts)
+	store.close()
+	assert in_memory < 0.3 * inline
+	assert on_disk < 0.3 * inline
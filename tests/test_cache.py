@@ -0,0 +1,175 @@
+import sys
+import time
+import zlib
+
+import pytest
+
+from cts_calcs.cache import ResultCache, LocalCache, get_redis_client
+from cts_calcs.calculator import Calculator
+
+from redis_standin import start_redis_standin
+
+
+RESULT = {'calculationResults': [{'type': 'SOLUBILITY', 'result': 1200.5}], 'smiles': 'CCO'}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	"""
+	Controllable time.time() for TTL tests.
+	"""
+	now = [1000.0]
+	monkeypatch.setattr(time, 'time', lambda: now[0])
+	return now
+
+
+@pytest.fixture
+def redis_standin():
+	server, port = start_redis_standin()
+	yield server, port
+	server.shutdown()
+	server.server_close()
+
+
+def test_make_key_is_namespaced_and_stable():
+	result_cache = ResultCache(LocalCache(), namespace='test')
+	key = result_cache.make_key('sparc', 'http://sparc/multiProperty', {'smiles': 'CCO', 'temperature': 25.0})
+	assert key.startswith('test:sparc:')
+	assert len(key.split(':')[-1]) == 40
+	# dict key order doesn't matter, request contents do:
+	assert key == result_cache.make_key('sparc', 'http://sparc/multiProperty', {'temperature': 25.0, 'smiles': 'CCO'})
+	assert key != result_cache.make_key('sparc', 'http://sparc/multiProperty', {'smiles': 'CCC', 'temperature': 25.0})
+	assert key != result_cache.make_key('chemaxon', 'http://sparc/multiProperty', {'smiles': 'CCO', 'temperature': 25.0})
+
+
+def test_make_key_separates_parts():
+	result_cache = ResultCache(LocalCache())
+	assert result_cache.make_key('web', 'ab', 'c') != result_cache.make_key('web', 'a', 'bc')
+
+
+def test_round_trip_is_compressed():
+	client = LocalCache()
+	result_cache = ResultCache(client)
+	key = result_cache.make_key('sparc', 'url', RESULT)
+	assert result_cache.set(key, RESULT)
+	assert isinstance(client.get(key), bytes)
+	assert result_cache.get(key) == RESULT
+	assert (result_cache.hits, result_cache.misses) == (1, 0)
+
+
+def test_ttl_expiry(clock):
+	result_cache = ResultCache(LocalCache(), ttl=60)
+	result_cache.set('cts:sparc:a', RESULT)
+	result_cache.set('cts:sparc:b', RESULT, ttl=600)
+	clock[0] += 59
+	assert result_cache.get('cts:sparc:a') == RESULT
+	clock[0] += 2
+	assert result_cache.get('cts:sparc:a') is None
+	assert result_cache.get('cts:sparc:b') == RESULT
+	clock[0] += 600
+	assert result_cache.get('cts:sparc:b') is None
+
+
+def test_local_cache_evicts_least_recently_used():
+	client = LocalCache(max_entries=2)
+	client.set('a', b'1')
+	client.set('b', b'2')
+	client.get('a')
+	client.set('c', b'3')
+	assert client.get('b') is None
+	assert client.get('a') == b'1'
+	assert client.get('c') == b'3'
+
+
+def test_local_cache_nx_and_delete():
+	client = LocalCache()
+	assert client.set('a', b'1', nx=True)
+	assert client.set('a', b'2', nx=True) is None
+	assert client.get('a') == b'1'
+	assert client.delete('a', 'missing') == 1
+	assert not client.exists('a')
+
+
+def test_falls_back_to_local_cache_without_redis(monkeypatch):
+	monkeypatch.delenv('REDIS_HOSTNAME', raising=False)
+	assert get_redis_client() is None
+	monkeypatch.setenv('REDIS_HOSTNAME', 'localhost')
+	monkeypatch.setitem(sys.modules, 'redis', None)  # redis package not installed
+	assert get_redis_client() is None
+	assert isinstance(ResultCache().client, LocalCache)
+
+
+def test_backend_errors_count_as_misses():
+
+	class BrokenClient(object):
+		def get(self, name):
+			raise ConnectionError("redis down")
+
+		def set(self, name, value, ex=None, nx=False):
+			raise ConnectionError("redis down")
+
+	result_cache = ResultCache(BrokenClient())
+	assert result_cache.set('cts:sparc:a', RESULT) is False
+	assert result_cache.get('cts:sparc:a') is None
+	assert result_cache.misses == 1
+
+
+def test_calculators_cache_only_when_enabled(monkeypatch):
+	monkeypatch.delenv('CTS_RESULT_CACHE', raising=False)
+	assert not Calculator().use_cache
+	monkeypatch.setenv('CTS_RESULT_CACHE', '1')
+	assert Calculator().use_cache
+
+
+def test_redis_path(monkeypatch, redis_standin):
+	pytest.importorskip('redis')
+	server, port = redis_standin
+	monkeypatch.setenv('REDIS_HOSTNAME', '127.0.0.1')
+	monkeypatch.setenv('REDIS_PORT', str(port))
+	client = get_redis_client()
+	assert client is not None
+	result_cache = ResultCache(client, ttl=120)
+	key = result_cache.make_key('sparc', 'url', {'smiles': 'CCO'})
+	assert result_cache.get(key) is None
+	assert result_cache.set(key, RESULT)
+	assert result_cache.get(key) == RESULT
+	assert 0 < client.ttl(key) <= 120
+	assert result_cache.delete(key) == 1
+	assert result_cache.get(key) is None
+	assert (result_cache.hits, result_cache.misses) == (1, 2)
+
+
+def test_redis_ttl_expiry(monkeypatch, redis_standin):
+	pytest.importorskip('redis')
+	server, port = redis_standin
+	monkeypatch.setenv('REDIS_HOSTNAME', '127.0.0.1')
+	monkeypatch.setenv('REDIS_PORT', str(port))
+	result_cache = ResultCache(get_redis_client(), ttl=1)
+	result_cache.set('cts:sparc:a', RESULT)
+	assert result_cache.get('cts:sparc:a') == RESULT
+	server.store.expires[b'cts:sparc:a'] = time.time() - 1  # expire it without sleeping
+	assert result_cache.get('cts:sparc:a') is None
+
+
+def test_redis_down_counts_as_miss(redis_standin):
+	redis = pytest.importorskip('redis')
+	from redis.backoff import NoBackoff
+	from redis.retry import Retry
+	server, port = redis_standin
+	result_cache = ResultCache(redis.StrictRedis(host='127.0.0.1', port=port, retry=Retry(NoBackoff(), 0)))
+	server.shutdown()
+	server.server_close()
+	assert result_cache.get('cts:sparc:a') is None
+	assert result_cache.set('cts:sparc:a', RESULT) is False
+
+
+def test_corrupt_entries_count_as_misses():
+	client = LocalCache()
+	result_cache = ResultCache(client)
+	client.set('cts:sparc:a', b'not zlib')
+	client.set('cts:sparc:b', zlib.compress(b'{"truncated'))
+	client.set('cts:sparc:c', zlib.compress(b'\xff\xfe'))
+	for key in ('cts:sparc:a', 'cts:sparc:b', 'cts:sparc:c'):
+		assert result_cache.get(key) is None
+		assert not client.exists(key)  # dropped, so the next set replaces it
+	assert (result_cache.hits, result_cache.misses) == (0, 3)
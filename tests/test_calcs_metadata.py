@@ -0,0 +1,56 @@
+import datetime
+
+import pytz
+
+from cts_calcs.calcs_metadata import CalcRouter, MetaData, build_capabilities, is_supported
+
+
+CUSTOM_CAPABILITIES = build_capabilities({
+	'epi': [
+		{'endpoint': '/rest/episuite/estimated', 'props': ['water_sol', 'melting_point'], 'ph': False, 'methods': None},
+		{'endpoint': '/rest/episuite/kow', 'props': ['kow_no_ph'], 'ph': False, 'methods': ['WSKOWWIN']},
+	],
+})
+
+
+def test_route_groups_props_by_endpoint():
+	calls, rejected = CalcRouter().route({'sparc': ['water_sol', 'ion_con', 'vapor_press', 'kow_wph', 'water_sol']})
+	assert [(call['endpoint'].split('/')[-1], call['props']) for call in calls] == [
+		('multiProperty', ['water_sol', 'vapor_press']),
+		('fullSpeciation', ['ion_con']),
+		('logd', ['kow_wph']),
+	]
+	assert rejected == []
+
+
+def test_route_rejects_unsupported_props_and_methods():
+	calls, rejected = CalcRouter().route({'sparc': ['water_sol', 'melting_point'], 'chemaxon': ['kow_no_ph']}, method='WSKOWWIN')
+	assert [call['calc'] for call in calls] == ['sparc']
+	assert rejected == [
+		{'calc': 'sparc', 'prop': 'melting_point', 'data': "prop not supported"},
+		{'calc': 'chemaxon', 'prop': 'kow_no_ph', 'data': "prop not supported"},
+	]
+	calls, rejected = CalcRouter().route({'chemaxon': ['kow_no_ph', 'ion_con']}, method='KLOP')
+	assert [(call['props'], call['method']) for call in calls] == [(['kow_no_ph'], 'KLOP'), (['ion_con'], None)]
+
+
+def test_route_uses_its_own_capabilities():
+	router = CalcRouter(CUSTOM_CAPABILITIES)
+	calls, rejected = router.route({'epi': ['water_sol', 'melting_point', 'kow_no_ph']}, method='WSKOWWIN')
+	assert [(call['endpoint'], call['props']) for call in calls] == [
+		('/rest/episuite/estimated', ['water_sol', 'melting_point']),
+		('/rest/episuite/kow', ['kow_no_ph']),
+	]
+	assert rejected == []
+	assert not is_supported('epi', 'melting_point')
+	assert is_supported('epi', 'melting_point', capabilities=CUSTOM_CAPABILITIES)
+	calls, rejected = router.route({'sparc': ['water_sol']})
+	assert calls == [] and rejected[0]['prop'] == 'water_sol'
+
+
+def test_metadata_timestamp_is_us_eastern():
+	metadata = MetaData().create_metadata_object('sparc')['metaInfo']
+	assert 'water_sol' in metadata['props']
+	eastern = datetime.datetime.now(pytz.UTC).astimezone(pytz.timezone('US/Eastern'))
+	timestamp = datetime.datetime.strptime(metadata['timestamp'], '%Y%m%d%H%M%S%f')
+	assert abs((timestamp - eastern.replace(tzinfo=None)).total_seconds()) < 60
@@ -0,0 +1,137 @@
+import gzip
+import json
+import socket
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from cts_calcs import compression, endpoints, transport
+from cts_calcs.compression import get_wire_stats
+from cts_calcs.limiter import backend_key
+
+import fixtures
+from standin_server import start_standin
+
+
+LOGD_PATH = '/sparc-integration/rest/calc/logd'
+
+
+@pytest.fixture
+def standin():
+	server, base_url = start_standin(latency=0, jitter=0)
+	yield base_url
+	server.shutdown()
+	server.server_close()
+
+
+def serve_once(response_bytes):
+	"""
+	Answers one request with response_bytes, then closes the connection.
+	Returns base url.
+	"""
+	listener = socket.socket()
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+
+	def answer():
+		connection, _ = listener.accept()
+		connection.recv(65536)
+		connection.sendall(response_bytes)
+		connection.close()
+		listener.close()
+
+	thread = threading.Thread(target=answer)
+	thread.daemon = True
+	thread.start()
+	return "http://127.0.0.1:{}".format(listener.getsockname()[1])
+
+
+def post(url):
+	return transport.post(url, data='{}', headers={'Content-Type': 'application/json'}, timeout=5)
+
+
+def test_requests_decodes_unless_wire_stats_on(standin):
+	response = post(standin + LOGD_PATH)
+	assert response.json() == fixtures.sparc_logd_response()
+	assert backend_key(standin) not in get_wire_stats().stats()
+
+
+def test_wire_stats(monkeypatch, standin):
+	monkeypatch.setattr(compression, 'WIRE_STATS', True)
+	response = post(standin + LOGD_PATH)
+	assert response.json() == fixtures.sparc_logd_response()
+	stats = get_wire_stats().stats()[backend_key(standin)]
+	assert stats['response_bytes'] == len(response.content)
+	assert 0 < stats['response_wire_bytes'] < stats['response_bytes']
+
+
+@pytest.mark.parametrize('wire_stats', [False, True])
+def test_truncated_body_raises(monkeypatch, wire_stats):
+	monkeypatch.setattr(compression, 'WIRE_STATS', wire_stats)
+	body = gzip.compress(json.dumps(fixtures.sparc_logd_response()).encode('utf-8'))
+	url = serve_once(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Encoding: gzip\r\n"
+		b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body[:len(body) // 2])
+	with pytest.raises(requests.exceptions.ChunkedEncodingError):
+		post(url + LOGD_PATH)
+
+
+def test_corrupt_body_raises(monkeypatch):
+	monkeypatch.setattr(compression, 'WIRE_STATS', True)
+	body = b'not gzip at all'
+	url = serve_once(b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: " + str(len(body)).encode() +
+		b"\r\nConnection: close\r\n\r\n" + body)
+	with pytest.raises(requests.exceptions.ContentDecodingError):
+		post(url + LOGD_PATH)
+
+
+def start_gzip_refusing_server(encodings):
+	"""
+	Answers 415 to gzipped request bodies, 200 otherwise,
+	appending each request's Content-Encoding to encodings.
+	"""
+	class Handler(BaseHTTPRequestHandler):
+
+		def do_POST(self):
+			self.rfile.read(int(self.headers.get('Content-Length') or 0))
+			encodings.append(self.headers.get('Content-Encoding'))
+			status = 415 if self.headers.get('Content-Encoding') else 200
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', '2')
+			self.end_headers()
+			self.wfile.write(b'{}')
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def test_compression_is_keyed_on_primary_url_across_replicas(monkeypatch):
+	monkeypatch.setattr(endpoints, '_pools', {})
+	monkeypatch.setattr(compression, '_compress_backends', set())
+	monkeypatch.setattr(compression, '_unsupported_backends', set())
+	monkeypatch.setattr(compression, 'COMPRESS_MIN_BYTES', 0)
+	primary_encodings, replica_encodings = [], []
+	primary_server, primary = start_gzip_refusing_server(primary_encodings)
+	replica_server, replica = start_gzip_refusing_server(replica_encodings)
+	try:
+		pool = endpoints.register_pool('sparc', [primary, replica], health_interval=0)
+		pool.replicas[0].ejected_until = time.time() + 60  # every request goes to the replica
+		compression.enable_request_compression(primary)
+		assert post(primary + LOGD_PATH).status_code == 200
+		assert post(primary + LOGD_PATH).status_code == 200
+		assert replica_encodings == ['gzip', None, None]  # the 415 turned compression off for the pool
+		assert primary_encodings == []
+	finally:
+		for server in (primary_server, replica_server):
+			server.shutdown()
+			server.server_close()
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from cts_calcs import deadline
+from cts_calcs.calculator import Calculator
+from cts_calcs.calculator_sparc import SparcCalc
+
+
+@pytest.fixture
+def no_snapshot(monkeypatch):
+	monkeypatch.delenv('CTS_SNAPSHOT_PATH', raising=False)
+	monkeypatch.setenv('CTS_SPARC_SERVER', 'http://127.0.0.1:9')  # never reached
+
+
+def test_nested_deadline_only_shortens():
+	with deadline.deadline(10) as outer:
+		with deadline.deadline(60) as inner:
+			assert inner is outer
+		with deadline.deadline(1) as inner:
+			assert inner.remaining() <= 1
+		assert deadline.current_deadline() is outer
+	assert deadline.remaining_time() is None
+
+
+def test_web_call_returns_error_once_deadline_passed():
+	with deadline.deadline(expires_at=time.time() - 1):
+		response = Calculator().web_call('http://127.0.0.1:9/ctsws/rest/standardizer', {'structure': 'CCO'})
+	assert response['valid'] is False
+	assert 'deadline exceeded' in response['error']
+
+
+def test_sparc_multiprop_returns_errors_once_deadline_passed(no_snapshot):
+	request_dict = {'chemical': 'CCCO', 'calc': 'sparc', 'props': ['water_sol', 'vapor_press', 'ion_con'], 'ph': 7.0,
+		'deadline': time.time() - 1}
+	data_objs = SparcCalc('CCCO').data_request_handler(request_dict)
+	assert [data_obj['prop'] for data_obj in data_objs] == ['water_sol', 'vapor_press', 'ion_con']
+	assert [data_obj['data'] for data_obj in data_objs[:2]] == ["calc server not found"] * 2
+	assert data_objs[2]['data'] not in (None, '')
@@ -0,0 +1,56 @@
+import socket
+import time
+
+import pytest
+
+from cts_calcs import endpoints
+from cts_calcs.endpoints import register_pool, find_pool
+
+from standin_server import start_standin
+
+
+@pytest.fixture(autouse=True)
+def pools(monkeypatch):
+	monkeypatch.setattr(endpoints, '_pools', {})
+
+
+def closed_port_url():
+	sock = socket.socket()
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return "http://127.0.0.1:{}".format(port)
+
+
+def test_pools_sharing_a_primary_match_on_backend_path():
+	jchem = register_pool('jchem', 'http://shared:8080,http://jchem2:8080', health_interval=0)
+	efs = register_pool('efs', 'http://shared:8080,http://efs2:8080', health_interval=0)
+	assert find_pool('http://shared:8080/webservices/rest-v0/util/calculate/logP') is jchem
+	assert find_pool('http://shared:8080/ctsws/rest/standardizer') is efs
+	assert find_pool('http://shared:8080/other') is None
+	assert efs.resolve('http://shared:8080/ctsws/rest/standardizer', efs.replicas[1]) == 'http://efs2:8080/ctsws/rest/standardizer'
+
+
+def test_single_replica_is_not_balanced():
+	register_pool('sparc', 'http://sparc:8080', health_interval=0)
+	assert find_pool('http://sparc:8080/sparc-integration/rest/calc/logd') is None
+
+
+def test_health_checks_start_with_first_request_and_eject_dead_replica():
+	server, live_url = start_standin(latency=0, jitter=0)
+	dead_url = closed_port_url()
+	try:
+		pool = register_pool('sparc', [live_url, dead_url], health_interval=0.05)
+		assert pool._health_thread is None
+		assert find_pool(live_url + '/sparc-integration/rest/calc/logd') is pool
+		assert pool._health_thread.is_alive()
+		for _ in range(100):
+			if pool.stats()[1]['ejected']:
+				break
+			time.sleep(0.02)
+		live, dead = pool.stats()
+		assert dead['ejected'] and not live['ejected']
+		pool.stop_health_checks()
+	finally:
+		server.shutdown()
+		server.server_close()
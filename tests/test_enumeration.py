@@ -0,0 +1,109 @@
+import json
+import tracemalloc
+
+import pytest
+
+from cts_calcs import jchem_properties
+from cts_calcs.jchem_properties import Tautomerization, Stereoisomer
+
+from bench_enumeration import start_standin_process
+
+
+STRUCTURES = 500
+SMILES = 'CC(O)=CC'
+
+
+@pytest.fixture(scope='module')
+def jchem_server():
+	# in a subprocess, so tracemalloc only sees the client's allocations
+	process, base_url = start_standin_process(STRUCTURES)
+	yield base_url
+	process.terminate()
+	process.wait()
+
+
+@pytest.fixture
+def posts(jchem_server, monkeypatch):
+	"""
+	Records the parameters of each request made to the stand-in.
+	"""
+	monkeypatch.setenv('CTS_JCHEM_SERVER', jchem_server)
+	recorded = []
+	post = jchem_properties.transport.post
+
+	def recording_post(url, data=None, **kwargs):
+		recorded.append(json.loads(data)['parameters'])
+		return post(url, data=data, **kwargs)
+
+	monkeypatch.setattr(jchem_properties.transport, 'post', recording_post)
+	return recorded
+
+
+def prop(prop_class):
+	prop_obj = prop_class()
+	prop_obj.use_cache = False
+	return prop_obj
+
+
+def consume(structures):
+	count = 0
+	for _ in structures:
+		count += 1
+	return count
+
+
+def peak_memory(func):
+	tracemalloc.start()
+	try:
+		count = func()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak, count
+
+
+def test_cap_applies_to_one_request(posts):
+	taut = prop(Tautomerization)
+	assert consume(taut.iterTautomers(SMILES, max_count=5, test=True)) == 5
+	assert posts[-1]['maxStructureCount'] == 5
+	assert taut.postData['maxStructureCount'] == 1000
+	assert consume(taut.iterTautomers(SMILES, test=True)) == STRUCTURES
+	assert posts[-1]['maxStructureCount'] == 1000
+
+	stereo = prop(Stereoisomer)
+	assert consume(stereo.iterStereoisomers(SMILES, max_count=5, test=True)) == 5
+	assert posts[-1]['maxStructureCount'] == 5
+	assert stereo.postData['maxStructureCount'] == 100
+
+
+def test_streamed_tautomers_peak_memory(posts):
+
+	def whole_response():
+		taut = prop(Tautomerization)
+		taut.make_data_request(SMILES, taut)
+		return len(taut.getTautomers(test=True))
+
+	whole_response()  # warms up the connection
+	whole, count = peak_memory(whole_response)
+	assert count == STRUCTURES
+	streamed, count = peak_memory(lambda: consume(prop(Tautomerization).iterTautomers(SMILES, test=True)))
+	assert count == STRUCTURES
+	capped, count = peak_memory(lambda: consume(prop(Tautomerization).iterTautomers(SMILES, max_count=10, test=True)))
+	assert count == 10
+	assert streamed < 0.25 * whole
+	assert capped < 0.25 * whole
+
+
+def test_streamed_stereoisomers_peak_memory(posts):
+
+	def whole_response():
+		stereo = prop(Stereoisomer)
+		stereo.make_data_request(SMILES, stereo)
+		return len(stereo.getStereoisomers(test=True))
+
+	whole_response()
+	whole, count = peak_memory(whole_response)
+	assert count == STRUCTURES
+	streamed, count = peak_memory(lambda: consume(prop(Stereoisomer).iterStereoisomers(SMILES, test=True)))
+	assert count == STRUCTURES
+	assert streamed < 0.25 * whole
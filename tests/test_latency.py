@@ -0,0 +1,49 @@
+import pytest
+import requests
+
+from cts_calcs import transport
+from cts_calcs.latency import LatencyTracker, get_latency_tracker
+
+from standin_server import start_standin
+
+
+URL = 'http://sparc:8080/sparc-integration/rest/calc/logd'
+
+
+def tracker_with(latencies, **kwargs):
+	tracker = LatencyTracker(min_samples=len(latencies), **kwargs)
+	for latency in latencies:
+		tracker.record(URL, latency)
+	return tracker
+
+
+def test_caller_timeout_unless_enabled():
+	assert tracker_with([0.1] * 20).timeout_for(URL, 10) == 10
+
+
+def test_timeout_from_p99_between_floor_and_ceiling():
+	assert tracker_with([1.0] * 20, adaptive=True, multiplier=3.0).timeout_for(URL, 10) == 3.0
+	assert tracker_with([0.1] * 20, adaptive=True, floor=0.25).timeout_for(URL, 10) == 2.5
+	assert tracker_with([9.0] * 20, adaptive=True).timeout_for(URL, 10) == 10
+
+
+def test_timed_out_requests_raise_the_timeout():
+	tracker = tracker_with([0.5] * 100, adaptive=True, multiplier=3.0, floor=0.1)
+	assert tracker.timeout_for(URL, 10) == 1.5
+	for _ in range(5):
+		tracker.record(URL, 1.5)  # slower requests hit the learned timeout
+	assert tracker.timeout_for(URL, 10) == 4.5
+
+
+def test_transport_records_timeouts():
+	server, base_url = start_standin(latency=0.3, jitter=0)
+	url = base_url + '/sparc-integration/rest/calc/logd'
+	try:
+		with pytest.raises(requests.exceptions.Timeout):
+			transport.post(url, data='{}', headers={'Content-Type': 'application/json'}, timeout=0.05)
+		endpoint = get_latency_tracker().get_endpoint(url)
+		assert endpoint.count() == 1
+		assert endpoint.percentile(50) >= 0.05
+	finally:
+		server.shutdown()
+		server.server_close()
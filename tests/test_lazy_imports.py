@@ -0,0 +1,98 @@
+import subprocess
+import sys
+import textwrap
+import types
+
+import pytest
+
+from cts_calcs.calculator import Calculator, TemplateCopy, thaw
+from cts_calcs.lazy_imports import LazyModule, is_loaded, lazy_import
+
+
+def run_fresh(code):
+	"""
+	Runs code in a new interpreter (nothing imported yet), returns stdout.
+	"""
+	result = subprocess.run([sys.executable, '-c', textwrap.dedent(code)], capture_output=True, text=True, timeout=60)
+	assert result.returncode == 0, result.stderr
+	return result.stdout
+
+
+def test_first_access_from_many_threads():
+	output = run_fresh("""
+		import sys, threading
+		from cts_calcs.lazy_imports import lazy_import, is_loaded
+		assert not is_loaded('requests')
+		requests = lazy_import('requests')
+		assert 'requests' not in sys.modules
+		barrier = threading.Barrier(16)
+		errors = []
+
+		def touch():
+			barrier.wait()
+			try:
+				requests.exceptions.Timeout
+				requests.adapters.HTTPAdapter
+			except Exception as e:
+				errors.append(repr(e))
+
+		threads = [threading.Thread(target=touch) for _ in range(16)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		print(len(errors), is_loaded('requests'), type(sys.modules['requests']).__name__)
+	""")
+	assert output.split() == ['0', 'True', 'module']
+
+
+def test_import_cts_calcs_defers_requests():
+	output = run_fresh("""
+		import sys
+		import cts_calcs.calculator, cts_calcs.calculator_sparc, cts_calcs.smilesfilter
+		print('requests' in sys.modules)
+	""")
+	assert output.strip() == 'False'
+
+
+def test_lazy_import():
+	assert lazy_import('json') is sys.modules['json']  # already imported: the module itself
+	with pytest.raises(ImportError):
+		lazy_import('cts_no_such_module')
+	module = LazyModule('colorsys')
+	assert 'not' not in repr(module) and 'loaded' not in repr(module)
+	assert module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+	assert 'loaded' in repr(module)
+	assert is_loaded('colorsys')
+
+
+def test_thaw_copies_templates():
+	template = types.MappingProxyType({'a': (1, types.MappingProxyType({'b': 2})), 'c': 'd'})
+	thawed = thaw(template)
+	assert thawed == {'a': [1, {'b': 2}], 'c': 'd'}
+	thawed['a'][1]['b'] = 3
+	assert template['a'][1]['b'] == 2
+
+
+
+class Templated(object):
+	settings = TemplateCopy(types.MappingProxyType({'props': ('water_sol',)}))
+
+
+def test_template_copy_per_instance():
+	first, second = Templated(), Templated()
+	first.settings['props'].append('ion_con')
+	assert first.settings == {'props': ['water_sol', 'ion_con']}
+	assert second.settings == {'props': ['water_sol']}
+	assert Templated.settings['props'] == ('water_sol',)  # class attribute stays read-only
+	with pytest.raises(TypeError):
+		Templated.settings['props'] = ()
+
+
+def test_calculator_templates_are_not_shared():
+	first, second = Calculator(), Calculator()
+	first.pchem_request['chemical'] = 'CCO'
+	first.pchem_props.append('new_prop')
+	assert second.pchem_request.get('chemical') != 'CCO'
+	assert not 'new_prop' in second.pchem_props
+	assert not 'new_prop' in Calculator().pchem_props
@@ -0,0 +1,46 @@
+from cts_calcs import limiter
+from cts_calcs.limiter import AIMDLimiter, OUTCOME_TIMEOUT
+
+
+def release_many(aimd, latencies, endpoint):
+	for latency in latencies:
+		aimd.acquire(timeout=0)
+		aimd.release(latency, endpoint=endpoint)
+
+
+def test_limit_grows_while_endpoints_answer_at_their_usual_latency():
+	aimd = AIMDLimiter(initial_limit=4, max_limit=64)
+	for _ in range(20):
+		release_many(aimd, [0.02, 0.03, 0.025], '/sparc-integration/rest/calc/multiProperty')
+		release_many(aimd, [0.8, 1.0, 0.9], '/sparc-integration/rest/calc/logd')
+	assert aimd.limit > 4
+
+
+def test_single_slow_response_is_not_congestion():
+	aimd = AIMDLimiter(initial_limit=8)
+	release_many(aimd, [0.02] * limiter.RECENT_SAMPLES, '/logP')
+	limit = aimd.limit
+	release_many(aimd, [2.0], '/logP')
+	assert aimd.limit >= limit
+
+
+def test_sustained_slowdown_cuts_limit():
+	aimd = AIMDLimiter(initial_limit=8)
+	release_many(aimd, [0.02] * 64, '/logP')
+	limit = aimd.limit
+	release_many(aimd, [0.2] * limiter.RECENT_SAMPLES, '/logP')
+	assert aimd.limit < limit
+
+
+def test_baseline_recovers_from_fast_outlier():
+	aimd = AIMDLimiter(initial_limit=8)
+	release_many(aimd, [0.001] + [0.05] * limiter.BASELINE_WINDOW, '/detail')
+	assert aimd.baselines['/detail'].baseline == 0.05
+	assert not aimd.baselines['/detail'].congested(aimd.latency_tolerance)
+
+
+def test_timeouts_cut_limit():
+	aimd = AIMDLimiter(initial_limit=8)
+	aimd.acquire(timeout=0)
+	aimd.release(10.0, OUTCOME_TIMEOUT, '/logd')
+	assert aimd.limit == 4
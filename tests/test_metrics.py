@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import requests
+
+from cts_calcs import metrics
+from cts_calcs.metrics import MetricsRegistry, CONTENT_TYPE, format_value
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def registry():
+	metrics.enable_metrics()
+	return MetricsRegistry()
+
+
+def test_counter_lines_with_escaped_labels(registry):
+	requests_total = registry.counter('cts_test_requests_total', "Test requests.", ['calc', 'result'])
+	requests_total.inc('sparc', 'ok')
+	requests_total.inc('sparc', 'ok', amount=2)
+	requests_total.inc('we"ird\\calc\n', 'error')
+	assert registry.exposition().splitlines() == [
+		'# HELP cts_test_requests_total Test requests.',
+		'# TYPE cts_test_requests_total counter',
+		'cts_test_requests_total{calc="sparc",result="ok"} 3',
+		'cts_test_requests_total{calc="we\\"ird\\\\calc\\n",result="error"} 1',
+	]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+	seconds = registry.histogram('cts_test_seconds', "Test latency.", ['calc'], buckets=(0.1, 1.0))
+	for value in (0.05, 0.1, 0.5, 3.0):
+		seconds.observe(value, 'chemaxon')
+	assert registry.exposition().splitlines() == [
+		'# HELP cts_test_seconds Test latency.',
+		'# TYPE cts_test_seconds histogram',
+		'cts_test_seconds_bucket{calc="chemaxon",le="0.1"} 2',  # le is inclusive
+		'cts_test_seconds_bucket{calc="chemaxon",le="1"} 3',
+		'cts_test_seconds_bucket{calc="chemaxon",le="+Inf"} 4',
+		'cts_test_seconds_sum{calc="chemaxon"} 3.65',
+		'cts_test_seconds_count{calc="chemaxon"} 4',
+	]
+	assert seconds.count('chemaxon') == 4
+
+
+def test_format_value():
+	assert format_value(float('inf')) == '+Inf'
+	assert format_value(2.0) == '2'
+	assert format_value(0.005) == '0.005'
+	assert format_value(1e20) == '1e+20'
+	assert format_value(7) == '7'
+
+
+def test_disabled_metrics_record_nothing(registry):
+	calls = registry.counter('cts_test_calls_total', "Test calls.")
+	metrics.disable_metrics()
+	try:
+		calls.inc()
+	finally:
+		metrics.enable_metrics()
+	assert calls.value() == 0
+	assert registry.exposition().splitlines() == ['# HELP cts_test_calls_total Test calls.', '# TYPE cts_test_calls_total counter']
+
+
+def test_collectors_skip_missing_values_and_failures(registry):
+	def slots():
+		return [('cts_test_slots', 'gauge', "Free slots.", ['backend'], [(('sparc',), 3), (('epi',), None)])]
+
+	def broken():
+		raise Exception("cache unreachable")
+
+	registry.add_collector(broken)
+	registry.add_collector(slots)
+	assert registry.exposition().splitlines() == [
+		'# HELP cts_test_slots Free slots.',
+		'# TYPE cts_test_slots gauge',
+		'cts_test_slots{backend="sparc"} 3',
+	]
+
+
+def test_write_textfile(registry, tmp_path):
+	registry.counter('cts_test_calls_total', "Test calls.").inc()
+	path = metrics.write_textfile(str(tmp_path / 'cts.prom'), registry)
+	with open(path) as textfile:
+		assert textfile.read() == registry.exposition()
+	assert os.listdir(str(tmp_path)) == ['cts.prom']  # temp file renamed into place
+
+
+def test_http_server_serves_metrics(registry):
+	registry.counter('cts_test_calls_total', "Test calls.").inc()
+	server = metrics.start_http_server(0, '127.0.0.1', registry)
+	try:
+		base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+		response = requests.get(base_url + '/metrics', timeout=5)
+		assert response.status_code == 200
+		assert response.headers['Content-Type'] == CONTENT_TYPE
+		assert response.text == registry.exposition()
+		assert requests.get(base_url + '/other', timeout=5).status_code == 404
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def test_import_starts_no_exporters(tmp_path):
+	env = dict(os.environ, CTS_METRICS_PORT='1', CTS_METRICS_TEXTFILE=str(tmp_path / 'cts.prom'))
+	script = (
+		"import threading\n"
+		"import cts_calcs.metrics\n"
+		"print(sorted(thread.name for thread in threading.enumerate() if thread.name.startswith('cts-metrics')))\n"
+	)
+	output = subprocess.check_output([sys.executable, '-c', script], cwd=REPO_ROOT, env=env, timeout=60)
+	assert output.decode().strip() == '[]'
+	assert not os.path.exists(str(tmp_path / 'cts.prom'))
+
+
+def test_start_exporters_once_per_process(monkeypatch, tmp_path):
+	monkeypatch.setattr(metrics, '_exporters', None)
+	monkeypatch.setattr(metrics, 'METRICS_PORT', 0)
+	path = str(tmp_path / 'cts.prom')
+	server, thread = metrics.start_exporters(textfile=path, interval=60)
+	assert server is None
+	assert thread.name == 'cts-metrics-textfile'
+	assert metrics.start_exporters(textfile=path) == (server, thread)
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from cts_calcs import orchestrator
+from cts_calcs.smilesfilter import SMILESFilter
+
+
+@pytest.fixture
+def calcs(monkeypatch):
+	"""
+	Stubs filtering and the calculator calls. Delays and failures
+	are set per prop in calcs['delay'] and calcs['fail'].
+	"""
+	state = {'delay': {}, 'fail': set(), 'filter_errors': {}, 'calls': [], 'running': 0, 'max_running': 0}
+	lock = threading.Lock()
+
+	def parse(self, structure, calculators):
+		errors = dict((calc, {'data': state['filter_errors'][calc]}) for calc in calculators if calc in state['filter_errors'])
+		return dict((calc, structure) for calc in calculators if calc not in errors), errors
+
+	def run(calc, props):
+		with lock:
+			state['calls'].append((calc, tuple(props)))
+			state['running'] += 1
+			state['max_running'] = max(state['max_running'], state['running'])
+		try:
+			time.sleep(max(state['delay'].get(prop, 0.0) for prop in props))
+			if state['fail'] & set(props):
+				raise Exception("calc server not found")
+			return [{'calc': calc, 'prop': prop, 'data': 1.0} for prop in props]
+		finally:
+			with lock:
+				state['running'] -= 1
+
+	monkeypatch.setenv('CTS_EFS_SERVER', 'http://ctsws')
+	monkeypatch.setattr(SMILESFilter, 'parseSmilesByCalculators', parse)
+	monkeypatch.setattr(orchestrator, 'run_chemaxon', lambda smiles, prop, ph, method, expires_at: run('chemaxon', [prop]))
+	monkeypatch.setattr(orchestrator, 'run_sparc', lambda smiles, props, ph, expires_at: run('sparc', props))
+	monkeypatch.setattr(orchestrator, '_executors', {})
+	return state
+
+
+def test_results_arrive_in_completion_order(calcs):
+	calcs['delay'] = {'vapor_press': 0.2}
+	results = list(orchestrator.fan_out('CCO', {'chemaxon': ['water_sol', 'bogus'], 'sparc': ['water_sol', 'vapor_press']}))
+	assert results[0] == {'calc': 'chemaxon', 'prop': 'bogus', 'data': "prop not supported"}  # rejections come first
+	assert results[1] == {'calc': 'chemaxon', 'prop': 'water_sol', 'data': 1.0}  # before the slow SPARC call
+	assert [(data_obj['calc'], data_obj['prop']) for data_obj in results[2:]] == [('sparc', 'water_sol'), ('sparc', 'vapor_press')]
+
+
+def test_chemaxon_runs_one_call_per_method(calcs):
+	results = list(orchestrator.fan_out('CCO', {'chemaxon': ['kow_no_ph']}))
+	assert calcs['calls'] == [('chemaxon', ('kow_no_ph',))] * 3
+	assert len(results) == 3
+	calcs['calls'][:] = []
+	list(orchestrator.fan_out('CCO', {'chemaxon': ['kow_no_ph']}, method='KLOP'))
+	assert len(calcs['calls']) == 1
+
+
+def test_errors_stay_with_their_calc(calcs):
+	calcs['fail'] = {'ion_con'}
+	calcs['filter_errors'] = {'sparc': "structure too large"}
+	results = list(orchestrator.fan_out('CCO', {'chemaxon': ['water_sol', 'ion_con'], 'sparc': ['water_sol', 'boiling_point']}))
+	by_prop = dict(((data_obj['calc'], data_obj['prop']), data_obj['data']) for data_obj in results)
+	assert by_prop == {
+		('sparc', 'water_sol'): "structure too large",
+		('sparc', 'boiling_point'): "structure too large",
+		('chemaxon', 'water_sol'): 1.0,
+		('chemaxon', 'ion_con'): "request timed out",
+	}
+	assert all(calc == 'chemaxon' for calc, _ in calcs['calls'])
+
+
+def test_filter_exception_fails_every_calc(calcs, monkeypatch):
+	def parse(self, structure, calculators):
+		raise Exception("ctsws down")
+
+	monkeypatch.setattr(SMILESFilter, 'parseSmilesByCalculators', parse)
+	results = list(orchestrator.fan_out('CCO', {'chemaxon': ['water_sol'], 'sparc': ['water_sol']}))
+	assert sorted(data_obj['data'] for data_obj in results) == ["error filtering chemical"] * 2
+	assert calcs['calls'] == []
+
+
+def test_calc_executors_are_shared_and_bounded_across_calls(calcs, monkeypatch):
+	monkeypatch.setattr(orchestrator, 'CALC_WORKERS', {'chemaxon': 2, 'sparc': 1})
+	calcs['delay'] = {'water_sol': 0.05, 'ion_con': 0.05, 'water_sol_ph': 0.05}
+	calc_props = {'chemaxon': ['water_sol', 'ion_con', 'water_sol_ph']}
+	threads = [threading.Thread(target=lambda: list(orchestrator.fan_out('CCO', calc_props))) for _ in range(3)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(10)
+	assert len(calcs['calls']) == 9
+	assert calcs['max_running'] == 2  # one pool for every fan_out in the process
+	assert list(orchestrator._executors) == ['chemaxon']
+	executor = orchestrator.get_calc_executor('chemaxon')
+	list(orchestrator.fan_out('CCO', {'chemaxon': ['water_sol']}))
+	assert orchestrator.get_calc_executor('chemaxon') is executor
+
+
+def test_stopping_early_drops_queued_calls(calcs, monkeypatch):
+	monkeypatch.setattr(orchestrator, 'CALC_WORKERS', {'chemaxon': 1})
+	calcs['delay'] = {'water_sol': 0.05, 'ion_con': 0.05, 'water_sol_ph': 0.05, 'kow_no_ph': 0.05}
+	results = orchestrator.fan_out('CCO', {'chemaxon': ['water_sol', 'ion_con', 'water_sol_ph', 'kow_no_ph']}, method='KLOP')
+	next(results)
+	results.close()
+	orchestrator.get_calc_executor('chemaxon').submit(lambda: None).result(5)  # waits out the running call
+	assert len(calcs['calls']) < 4
@@ -0,0 +1,76 @@
+import os
+import threading
+
+import pytest
+
+from cts_calcs import profiler
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+	monkeypatch.setattr(profiler, '_sample_rate', profiler._sample_rate)
+	monkeypatch.setattr(profiler, '_output_dir', profiler._output_dir)
+	profiler.reset_aggregate()
+	profiler.enable_profiling(sample_rate=1.0, output_dir=str(tmp_path))
+	yield tmp_path
+	profiler.disable_profiling()
+	profiler.reset_aggregate()
+
+
+def profiles(profile_dir):
+	return sorted(name for name in os.listdir(str(profile_dir)) if name.endswith('.prof'))
+
+
+def test_profiles_sampled_call(profile_dir):
+
+	@profiler.profiled('outer')
+	def outer():
+		return inner() + 1
+
+	@profiler.profiled('inner')
+	def inner():
+		return 1
+
+	assert outer() == 2
+	names = profiles(profile_dir)
+	assert len(names) == 1 and names[0].startswith('outer-')  # nested call is part of outer's profile
+	assert 'inner' in profiler.hot_function_report()
+
+
+def test_concurrent_calls_profile_one_at_a_time(profile_dir):
+	started = threading.Event()
+	release = threading.Event()
+
+	@profiler.profiled('slow')
+	def slow():
+		started.set()
+		release.wait(5)
+		return 'slow'
+
+	@profiler.profiled('other')
+	def other():
+		return 'other'
+
+	results = []
+	thread = threading.Thread(target=lambda: results.append(slow()))
+	thread.start()
+	assert started.wait(5)
+	assert other() == 'other'  # runs unprofiled while slow() is being profiled
+	release.set()
+	thread.join()
+	assert results == ['slow']
+	names = profiles(profile_dir)
+	assert len(names) == 1 and names[0].startswith('slow-')
+	assert other() == 'other'
+	assert len(profiles(profile_dir)) == 2
+
+
+def test_disabled_skips_profiling(profile_dir):
+	profiler.disable_profiling()
+
+	@profiler.profiled()
+	def func():
+		return 1
+
+	assert func() == 1
+	assert profiles(profile_dir) == []
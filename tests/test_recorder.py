@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+import requests
+
+from cts_calcs import recorder, transport
+from cts_calcs.recorder import Recorder, note_wire_time, MODE_RECORD, MODE_REPLAY
+
+from standin_server import start_standin
+
+
+LOGD_PATH = '/sparc-integration/rest/calc/logd'
+TAUTOMER_PATH = '/webservices/rest-v0/util/calculate/tautomerization'
+
+
+@pytest.fixture
+def standin():
+	server, base_url = start_standin(latency=0, jitter=0)
+	yield server, base_url
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def archive_path(tmp_path):
+	yield str(tmp_path / 'exchanges.sqlite')
+	recorder.set_mode(recorder.MODE_PASSTHROUGH)
+
+
+def test_record_then_replay_without_network(standin, archive_path):
+	server, base_url = standin
+	recorder.set_mode(MODE_RECORD, archive_path)
+	recorded = transport.post(base_url + LOGD_PATH, data=json.dumps({'smiles': 'CCO'}), timeout=5)
+	assert recorded.status_code == 200
+	assert recorder.get_recorder().archive.count() == 1
+	server.shutdown()
+	server.server_close()
+	recorder.set_mode(MODE_REPLAY, archive_path, speed='fast')
+	replayed = transport.post('http://moved-host:8080' + LOGD_PATH, data=json.dumps({'smiles': 'CCO'}), timeout=5)
+	assert replayed.status_code == 200
+	assert replayed.json() == recorded.json()
+	with pytest.raises(requests.exceptions.ConnectionError):
+		transport.post(base_url + LOGD_PATH, data=json.dumps({'smiles': 'CCC'}), timeout=5)  # never recorded
+
+
+def test_streamed_body_is_teed_not_read_up_front(standin, archive_path):
+	_, base_url = standin
+	recorder.set_mode(MODE_RECORD, archive_path)
+	response = transport.post(base_url + TAUTOMER_PATH, data=json.dumps({'structure': 'CCO'}), timeout=5, stream=True)
+	assert response._content is False  # the caller reads it, not the recorder
+	assert recorder.get_recorder().archive.count() == 0
+	body = b''.join(response.iter_content(1024))
+	assert recorder.get_recorder().archive.count() == 1
+	recorder.set_mode(MODE_REPLAY, archive_path, speed='fast')
+	replayed = transport.post(base_url + TAUTOMER_PATH, data=json.dumps({'structure': 'CCO'}), timeout=5, stream=True)
+	assert b''.join(replayed.iter_content(1024)) == body
+	assert json.loads(body)['result']
+
+
+def test_recorded_elapsed_is_wire_time_only(archive_path):
+	def send(method, url, data, headers, **kwargs):
+		time.sleep(0.1)  # e.g., waiting for a backend slot
+		note_wire_time(0.01)
+		response = requests.models.Response()
+		response.status_code = 200
+		response._content = b'{}'
+		return response
+
+	http = Recorder(MODE_RECORD, archive_path)
+	http.send(send, 'POST', 'http://sparc' + LOGD_PATH, data='{}')
+	assert http.archive.next_exchange('POST', 'http://sparc' + LOGD_PATH, '{}')[4] == 0.01
+
+
+def test_errors_replay_as_the_same_exception(archive_path):
+	def send(method, url, data, headers, **kwargs):
+		raise requests.exceptions.Timeout("read timed out")
+
+	http = Recorder(MODE_RECORD, archive_path)
+	with pytest.raises(requests.exceptions.Timeout):
+		http.send(send, 'POST', 'http://sparc' + LOGD_PATH, data='{}')
+	http.set_mode(MODE_REPLAY, archive_path, speed='fast')
+	with pytest.raises(requests.exceptions.Timeout):
+		http.send(send, 'POST', 'http://sparc' + LOGD_PATH, data='{}')
@@ -0,0 +1,106 @@
+import pytest
+
+from cts_calcs.cache import ResultCache, LocalCache
+from cts_calcs.result_sink import ResultSink, normalize, export_job
+from cts_calcs.work_queue import LocalBroker, BatchProducer, BatchWorker
+
+
+RESULTS = [
+	{'calc': 'sparc', 'prop': 'water_sol', 'data': 1200.5},
+	{'calc': 'sparc', 'prop': 'ion_con', 'data': {'pKa': [4.2, 9.1], 'pKb': []}},
+	{'calc': 'chemaxon', 'prop': 'kow_wph', 'data': [[7.0, 1.1], [7.1, 1.2]]},
+	{'calc': 'sparc', 'prop': 'vapor_press', 'data': "request timed out"},
+]
+
+
+def test_normalize_flattens_results():
+	rows = [row for result_obj in RESULTS for row in normalize(result_obj, 'CCO', ph=7.0)]
+	assert [(row['prop'], row['ph'], row['value'], row['error']) for row in rows] == [
+		('water_sol', 7.0, 1200.5, None),
+		('ion_con.pKa', 7.0, 4.2, None),
+		('ion_con.pKa', 7.0, 9.1, None),
+		('kow_wph', 7.0, 1.1, None),
+		('kow_wph', 7.1, 1.2, None),
+		('vapor_press', 7.0, None, "request timed out"),
+	]
+	assert all(row['chemical'] == 'CCO' for row in rows)
+
+
+def test_normalize_makes_error_rows_for_non_results():
+	row, = normalize(None, 'CCO')
+	assert (row['chemical'], row['value'], row['error']) == ('CCO', None, "no result")
+	row, = normalize("calc server not found", 'CCO', ph=7.0)
+	assert (row['ph'], row['error']) == (7.0, "calc server not found")
+
+
+
+class RecordingSink(object):
+
+	def __init__(self, fail=False):
+		self.fail = fail
+		self.results = []
+
+	def write_task_result(self, result, task=None, elapsed=None):
+		if self.fail:
+			raise IOError("disk full")
+		self.results.append(result)
+
+
+
+class NoneWorker(BatchWorker):
+
+	def run_task(self, task):
+		return None
+
+
+def test_worker_survives_sink_errors():
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit([{'chemical': chemical, 'calc': 'chemaxon', 'props': ['kow_no_ph']} for chemical in ('CCO', 'CCC')])
+	worker = NoneWorker(broker, store, sink=RecordingSink(fail=True))
+	assert worker.run(idle_timeout=0.1) == 2
+	assert producer.progress(job['job_id'])['done'] == 2
+
+
+def test_sink_writes_error_rows(tmp_path):
+	pytest.importorskip('pyarrow')
+	import pyarrow.parquet
+	path = str(tmp_path / 'results.parquet')
+	with ResultSink(path, row_group_size=4) as sink:
+		sink.write('CCO', RESULTS, ph=7.0)
+		sink.write('CCC', None)
+		sink.write('CCCC', "calc server not found")
+		sink.write_task_result(None)
+		sink.write_task_result({'task_id': 'a', 'calc': 'sparc', 'chemical': 'CCO', 'data': None, 'error': "calc server not found"},
+			{'props': ['water_sol'], 'ph': 7.0})
+	table = pyarrow.parquet.read_table(path).to_pydict()
+	assert len(table['chemical']) == 10
+	assert table['error'][6:] == ["no result", "calc server not found", "no result", "calc server not found"]
+	assert sink.row_groups == 3
+
+
+def test_export_job_writes_ph_and_method(tmp_path):
+	pytest.importorskip('pyarrow')
+	import pyarrow.parquet
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit([
+		{'chemical': 'CCO', 'calc': 'chemaxon', 'props': ['kow_no_ph'], 'ph': 5.0, 'method': 'KLOP'},
+		{'chemical': 'CCC', 'calc': 'chemaxon', 'props': ['kow_no_ph'], 'ph': 5.0, 'method': 'PHYS'},
+	])
+	NoneWorker(broker, store).run(idle_timeout=0.1)
+	path = str(tmp_path / 'job.parquet')
+	export_job(producer, job['job_id'], path)
+	table = pyarrow.parquet.read_table(path).to_pydict()
+	assert table['ph'] == [5.0, 5.0]
+	assert table['method'] == ['KLOP', 'PHYS']
+
+
+def test_arrow_format(tmp_path):
+	pa = pytest.importorskip('pyarrow')
+	path = str(tmp_path / 'results.arrow')
+	with ResultSink(path) as sink:
+		sink.write('CCO', RESULTS[0])
+	with pa.OSFile(path, 'rb') as source:
+		table = pa.ipc.open_file(source).read_all().to_pydict()
+	assert table['value'] == [1200.5]
@@ -0,0 +1,74 @@
+import logging
+
+import pytest
+
+from cts_calcs import scheduler
+from cts_calcs.scheduler import FairQueue, PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_PREFETCH
+
+
+WEIGHTS = {PRIORITY_INTERACTIVE: 8.0, PRIORITY_BATCH: 2.0, PRIORITY_PREFETCH: 1.0}
+
+
+def admit_next(queue, tickets, inflight, limit):
+	"""
+	Admits and returns the waiting ticket due the next slot, or None.
+	"""
+	for ticket in tickets:
+		if not ticket.admitted and queue.can_admit(ticket, inflight, limit):
+			queue.admit(ticket)
+			return ticket
+	return None
+
+
+def test_invalid_default_priority_falls_back_to_interactive(caplog):
+	with caplog.at_level(logging.WARNING):
+		assert scheduler.parse_default_priority('urgent') == PRIORITY_INTERACTIVE
+	assert 'urgent' in caplog.text
+	assert scheduler.parse_default_priority(None) == PRIORITY_INTERACTIVE
+	assert scheduler.parse_default_priority(PRIORITY_BATCH) == PRIORITY_BATCH
+
+
+def test_unknown_class_is_queued_at_default_priority():
+	queue = FairQueue(WEIGHTS, interactive_reserve=0)
+	assert queue.enqueue('urgent').priority == scheduler.DEFAULT_PRIORITY
+
+
+def test_admission_is_weighted_fair():
+	queue = FairQueue(WEIGHTS, interactive_reserve=0)
+	batch = [queue.enqueue(PRIORITY_BATCH) for _ in range(4)]
+	interactive = [queue.enqueue(PRIORITY_INTERACTIVE) for _ in range(4)]
+	order = [admit_next(queue, batch + interactive, 0, 1) for _ in range(8)]
+	# starts: batch 0, 0.5, 1, 1.5; interactive 0, 0.125, 0.25, 0.375
+	assert order == [batch[0]] + interactive + batch[1:]
+	assert queue.waiting() == 0
+	assert queue.stats()[PRIORITY_BATCH]['admitted'] == 4
+
+
+def test_idle_class_gets_no_credit():
+	queue = FairQueue(WEIGHTS, interactive_reserve=0)
+	batch = [queue.enqueue(PRIORITY_BATCH) for _ in range(3)]
+	for _ in range(3):
+		admit_next(queue, batch, 0, 1)
+	assert queue.virtual_time == 1.0
+	# prefetch sent nothing so far, it starts now rather than at 0:
+	assert queue.enqueue(PRIORITY_PREFETCH).start == 1.0
+
+
+def test_interactive_reserve_is_kept_from_other_classes():
+	queue = FairQueue(WEIGHTS, interactive_reserve=0.25)
+	batch = queue.enqueue(PRIORITY_BATCH)
+	assert queue.reserved_slots(4) == 1
+	assert not queue.can_admit(batch, 3, 4)  # the last slot is interactive only
+	interactive = queue.enqueue(PRIORITY_INTERACTIVE)
+	assert admit_next(queue, [batch, interactive], 3, 4) is interactive
+	assert admit_next(queue, [batch], 2, 4) is batch
+
+
+def test_priority_context_sets_thread_class():
+	assert scheduler.current_priority() == scheduler.DEFAULT_PRIORITY
+	with scheduler.priority(PRIORITY_BATCH):
+		assert scheduler.current_priority() == PRIORITY_BATCH
+		assert scheduler.with_priority(scheduler.current_priority)() == PRIORITY_BATCH
+	with pytest.raises(ValueError):
+		with scheduler.priority('urgent'):
+			pass
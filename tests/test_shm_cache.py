@@ -0,0 +1,129 @@
+import multiprocessing
+
+import pytest
+
+from cts_calcs.shm_cache import SharedMemoryCache, SLOT, SLOT_HEADER_SIZE, SEQ, key_hash
+
+
+PROCESSES = 8
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+	path = str(tmp_path / 'cts-result-cache')
+	SharedMemoryCache(path, size=64 * 1024, slot_size=256).close()  # lays out the file before workers map it
+	return path
+
+
+def race_set_nx(path, barrier, results):
+	cache = SharedMemoryCache(path)
+	barrier.wait()
+	results.put(cache.set('lock:CCO', str(multiprocessing.current_process().pid), ex=60, nx=True))
+	cache.close()
+
+
+def churn_key(path, barrier, rounds):
+	cache = SharedMemoryCache(path)
+	barrier.wait()
+	for i in range(rounds):
+		cache.set('CCO', 'value-{}'.format(i), ex=60)
+		if i % 3 == 0:
+			cache.delete('CCO')
+	cache.close()
+
+
+def run_processes(target, path, *args):
+	context = multiprocessing.get_context('fork')
+	barrier = context.Barrier(PROCESSES)
+	processes = [context.Process(target=target, args=(path, barrier) + args) for _ in range(PROCESSES)]
+	for process in processes:
+		process.start()
+	for process in processes:
+		process.join(30)
+		assert process.exitcode == 0
+
+
+def slots_holding(cache, name):
+	key = name.encode('utf-8')
+	hashed = key_hash(key)
+	found = []
+	for index in cache.window(hashed):
+		offset = cache.slot_offset(index)
+		_, slot_hash, _, _, key_len = SLOT.unpack_from(cache.mm, offset)
+		if slot_hash == hashed and cache.mm[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + key_len] == key:
+			found.append(index)
+	return found
+
+
+def test_get_set_delete_and_ttl(cache_path):
+	cache = SharedMemoryCache(cache_path)
+	assert cache.get('CCO') is None
+	assert cache.set('CCO', 'ethanol') is True
+	assert cache.get('CCO') == b'ethanol'
+	assert cache.exists('CCO')
+	assert cache.set('CCO', 'other', nx=True) is None
+	assert cache.delete('CCO', 'missing') == 1
+	assert cache.get('CCO') is None
+	cache.set('CCC', 'propane', ex=-1)  # already expired
+	assert cache.get('CCC') is None
+	assert cache.set('CCC', 'propane', nx=True) is True  # expired records don't block nx
+	cache.close()
+
+
+def test_set_nx_has_one_winner_across_processes(cache_path):
+	context = multiprocessing.get_context('fork')
+	results = context.Queue()
+	run_processes(race_set_nx, cache_path, results)
+	outcomes = [results.get(timeout=5) for _ in range(PROCESSES)]
+	assert outcomes.count(True) == 1
+	assert outcomes.count(None) == PROCESSES - 1
+
+
+def test_key_stays_in_one_slot_across_processes(cache_path):
+	run_processes(churn_key, cache_path, 200)
+	cache = SharedMemoryCache(cache_path)
+	assert len(slots_holding(cache, 'CCO')) <= 1
+	cache.set('CCO', 'final')
+	assert len(slots_holding(cache, 'CCO')) == 1
+	assert cache.get('CCO') == b'final'
+	cache.delete('CCO')
+	assert cache.get('CCO') is None
+	assert slots_holding(cache, 'CCO') == []
+	cache.close()
+
+
+def test_torn_slot_reads_as_miss_and_is_reclaimed(cache_path):
+	cache = SharedMemoryCache(cache_path)
+	cache.set('CCO', 'ethanol')
+	index = slots_holding(cache, 'CCO')[0]
+	offset = cache.slot_offset(index)
+	SEQ.pack_into(cache.mm, offset, SEQ.unpack_from(cache.mm, offset)[0] + 1)  # writer died mid-write
+	assert cache.get('CCO') is None
+	assert cache.torn_reads == 0  # odd seq isn't copied at all
+	assert cache.set('CCO', 'ethanol', nx=True) is True
+	assert cache.get('CCO') == b'ethanol'
+	assert SEQ.unpack_from(cache.mm, offset)[0] % 2 == 0
+	cache.close()
+
+
+def test_flushdb_clears_records_and_torn_slots(cache_path):
+	cache = SharedMemoryCache(cache_path)
+	for i in range(20):
+		cache.set('key-{}'.format(i), 'value', ex=60)
+	torn = cache.slot_offset(0)
+	SEQ.pack_into(cache.mm, torn, SEQ.unpack_from(cache.mm, torn)[0] | 1)
+	assert cache.occupancy() > 0
+	cache.flushdb()
+	assert cache.occupancy() == 0
+	assert all(SEQ.unpack_from(cache.mm, cache.slot_offset(i))[0] % 2 == 0 for i in range(cache.slot_count))
+	assert cache.get('key-3') is None
+	cache.close()
+
+
+def test_instances_in_one_process_share_a_writer_lock(cache_path):
+	first, second = SharedMemoryCache(cache_path), SharedMemoryCache(cache_path)
+	assert first._lock is second._lock
+	first.set('CCO', 'ethanol')
+	assert second.get('CCO') == b'ethanol'
+	first.close()
+	second.close()
@@ -0,0 +1,189 @@
+import json
+import time
+
+import pytest
+
+from cts_calcs import deadline, smilesfilter
+from cts_calcs.cache import ResultCache, LocalCache
+from cts_calcs.negative_cache import NegativeCache, set_negative_cache, get_negative_cache
+from cts_calcs.smilesfilter import SMILESFilter
+
+
+class Response(object):
+
+	def __init__(self, status_code, content):
+		self.status_code = status_code
+		self.content = content
+
+
+
+class FreshIndex(object):
+
+	def get(self, raw, filter_path):
+		return None
+
+	def put(self, raw, filter_path, smiles):
+		pass
+
+
+
+@pytest.fixture
+def ctsws(monkeypatch):
+	"""
+	Replies to isvalidchemical with the (status, body) in responses[0].
+	"""
+	responses = []
+	posts = []
+
+	def post(url, data=None, **kwargs):
+		posts.append(url)
+		return Response(*responses[0])
+
+	monkeypatch.setenv('CTS_EFS_SERVER', 'http://ctsws')
+	monkeypatch.setenv('CTS_RESULT_CACHE', '1')
+	monkeypatch.setattr(smilesfilter.transport, 'post', post)
+	monkeypatch.setattr(smilesfilter, 'get_alias_index', lambda: FreshIndex())
+	previous = get_negative_cache()
+	negative_cache = set_negative_cache(NegativeCache(ResultCache(LocalCache())))
+	yield responses, posts, negative_cache
+	set_negative_cache(previous)
+
+
+
+def test_check_valid_smiles(ctsws):
+	responses, _, _ = ctsws
+	responses[:] = [(200, json.dumps({'result': "true"}))]
+	assert SMILESFilter().check_valid_smiles('CCO') == (True, 200)
+	assert SMILESFilter().is_valid_smiles('CCO')
+	responses[:] = [(200, json.dumps({'result': "false"}))]
+	assert SMILESFilter().check_valid_smiles('CC[Hg]') == (False, 200)
+	responses[:] = [(502, "<html>Bad Gateway</html>")]
+	assert SMILESFilter().check_valid_smiles('CCO') == (None, 502)
+	assert not SMILESFilter().is_valid_smiles('CCO')
+	responses[:] = [(500, json.dumps({'error': "server error"}))]
+	assert SMILESFilter().check_valid_smiles('CCO') == (None, 500)
+
+
+def test_metals_rejection_is_cached(ctsws):
+	responses, posts, negative_cache = ctsws
+	responses[:] = [(200, json.dumps({'result': "false"}))]
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "Chemical cannot contain metals"}
+	assert negative_cache.stored == 1
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "Chemical cannot contain metals"}
+	assert len(posts) == 1
+
+
+def test_rejections_are_not_cached_without_result_cache(ctsws, monkeypatch):
+	responses, posts, negative_cache = ctsws
+	monkeypatch.setenv('CTS_RESULT_CACHE', '0')
+	responses[:] = [(200, json.dumps({'result': "false"}))]
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "Chemical cannot contain metals"}
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "Chemical cannot contain metals"}
+	assert negative_cache.stored == 0
+	assert len(posts) == 2
+
+
+def test_ctsws_errors_are_not_cached(ctsws):
+	responses, posts, negative_cache = ctsws
+	responses[:] = [(503, "Service Unavailable")]
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "error filtering chemical"}
+	assert negative_cache.stored == 0
+	SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True)
+	assert len(posts) == 2
+
+
+def test_deadline_passed_before_filtering_is_an_error(ctsws):
+	responses, posts, negative_cache = ctsws
+	responses[:] = [(200, json.dumps({'result': "true"}))]
+	with deadline.deadline(expires_at=time.time() - 1):
+		assert SMILESFilter().filterSMILES('CCOc1ccccc1') == {'error': "error filtering chemical"}
+	assert posts == []
+	assert negative_cache.stored == 0
+
+
+def test_deadline_passed_during_filtering_is_an_error(ctsws, monkeypatch):
+	responses, posts, negative_cache = ctsws
+	responses[:] = [(200, json.dumps({'result': "true"}))]
+
+	def post(url, data=None, **kwargs):
+		posts.append(url)
+		if url.endswith('/standardizer'):
+			raise deadline.DeadlineExceeded("deadline exceeded before {}".format(url))
+		return Response(*responses[0])
+
+	monkeypatch.setattr(smilesfilter.transport, 'post', post)
+	assert SMILESFilter().filterSMILES('CCOc1ccccc1', is_node=True) == {'error': "error filtering chemical"}
+	assert len(posts) == 2
+	assert negative_cache.stored == 0
+
+
+@pytest.fixture
+def filter_steps(monkeypatch):
+	"""
+	Stubs the mass check and stereo clearing, counting calls.
+	"""
+	steps = {'mass': 100.0, 'stereoless': 'CC[N+](=O)O', 'calls': []}
+
+	def check_mass(self, structure):
+		steps['calls'].append('mass')
+		if isinstance(steps['mass'], Exception):
+			raise steps['mass']
+		return steps['mass'] < 1500
+
+	def stereoless(self, structure):
+		steps['calls'].append('stereoless')
+		if isinstance(steps['stereoless'], Exception):
+			raise steps['stereoless']
+		return steps['stereoless']
+
+	monkeypatch.setenv('CTS_EFS_SERVER', 'http://ctsws')
+	monkeypatch.setenv('CTS_RESULT_CACHE', '0')
+	monkeypatch.setattr(SMILESFilter, 'checkMass', check_mass)
+	monkeypatch.setattr(SMILESFilter, 'getStereolessSMILES', stereoless)
+	monkeypatch.setattr(smilesfilter, '_filter_executor', None)
+	return steps
+
+
+def test_chemaxon_only_runs_no_steps(filter_steps):
+	assert SMILESFilter().parseSmilesByCalculators('C[C@H](O)CC', ['chemaxon']) == ({'chemaxon': 'C[C@H](O)CC'}, {})
+	assert filter_steps['calls'] == []
+	assert smilesfilter._filter_executor is None
+
+
+def test_shared_steps_run_once_for_all_calcs(filter_steps):
+	filtered, errors = SMILESFilter().parseSmilesByCalculators('C[C@H](O)CC', ['chemaxon', 'test', 'sparc', 'epi', 'measured'])
+	assert sorted(filter_steps['calls']) == ['mass', 'stereoless']
+	assert filtered == {'chemaxon': 'C[C@H](O)CC', 'test': 'C[C@H](O)CC', 'sparc': 'CC[N+](=O)O'}
+	assert errors == {'epi': {'data': "cannot process metals or charges"}, 'measured': {'data': "cannot process metals or charges"}}
+
+
+def test_mass_check_runs_inline_without_stereo_step(filter_steps):
+	filter_steps['mass'] = 2000.0
+	assert SMILESFilter().parseSmilesByCalculators('CCO', ['chemaxon', 'test']) == ({'chemaxon': 'CCO'}, {'test': {'data': "structure too large"}})
+	assert filter_steps['calls'] == ['mass']
+	assert smilesfilter._filter_executor is None
+
+
+def test_step_failures_only_fail_the_calcs_needing_them(filter_steps):
+	filter_steps['stereoless'] = Exception("calc server not found")
+	filtered, errors = SMILESFilter().parseSmilesByCalculators('CCO', ['chemaxon', 'test', 'sparc'])
+	assert filtered == {'chemaxon': 'CCO', 'test': 'CCO'}
+	assert errors == {'sparc': {'data': "error filtering chemical"}}
+	filter_steps['mass'] = Exception("calc server not found")
+	filtered, errors = SMILESFilter().parseSmilesByCalculators('CCO', ['chemaxon', 'test'])
+	assert filtered == {'chemaxon': 'CCO'}
+	assert errors == {'test': {'data': "error filtering chemical"}}
+
+
+def test_rejections_are_cached_with_result_cache(filter_steps, monkeypatch):
+	monkeypatch.setenv('CTS_RESULT_CACHE', '1')
+	monkeypatch.setattr(smilesfilter, 'get_alias_index', lambda: FreshIndex())
+	previous = get_negative_cache()
+	set_negative_cache(NegativeCache(ResultCache(LocalCache())))
+	try:
+		filter_steps['mass'] = 2000.0
+		for _ in range(2):
+			assert SMILESFilter().parseSmilesByCalculators('CCO', ['test'])[1] == {'test': {'data': "structure too large"}}
+		assert filter_steps['calls'] == ['mass']
+	finally:
+		set_negative_cache(previous)
@@ -0,0 +1,60 @@
+import pytest
+
+from cts_calcs import snapshot
+from cts_calcs.calculator_sparc import SparcCalc
+from cts_calcs.snapshot import SnapshotReader, export_snapshot, storable_result
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+	path = str(tmp_path / 'snapshot.bin')
+	export_snapshot([
+		{'chemical': 'CCO', 'calc': 'sparc', 'prop': 'water_sol', 'data': 1200.5},
+		{'chemical': 'CCO', 'calc': 'sparc', 'prop': 'vapor_press', 'data': 59.3},
+	], path)
+	monkeypatch.setenv('CTS_SNAPSHOT_PATH', path)
+	monkeypatch.setattr(snapshot, '_snapshot', None)
+	yield path
+	if snapshot._snapshot is not None:
+		snapshot._snapshot.close()
+
+
+def test_export_skips_errors():
+	assert storable_result({'data': 1.5})
+	assert storable_result({'data': '1.5'})
+	assert storable_result({'data': {'pKa': [4.2], 'pKb': []}})
+	assert not storable_result({'data': None})
+	assert not storable_result({'data': "request timed out"})
+	assert not storable_result({'data': "Cannot filter SMILES"})
+	assert not storable_result({'data': {'error': "Error processing calc results"}})
+	assert not storable_result({'data': 1.5, 'error': "Not a valid name"})
+	assert not storable_result({'data': 1.5, 'valid': False})
+
+
+def test_export_skips_other_conditions(tmp_path):
+	assert storable_result({'data': 1.5, 'temperature': 25, 'pressure': 760.0, 'meltingPoint': 0.0})
+	assert not storable_result({'data': 1.5, 'temperature': 37.0})
+	assert not storable_result({'data': 1.5, 'meltingPoint': None})
+	path = str(tmp_path / 'snapshot.bin')
+	count = export_snapshot([
+		{'chemical': 'CCO', 'calc': 'sparc', 'prop': 'water_sol', 'data': 1200.5},
+		{'chemical': 'CCC', 'calc': 'sparc', 'prop': 'water_sol', 'data': "request timed out"},
+		{'chemical': 'CCCC', 'calc': 'sparc', 'prop': 'water_sol', 'data': 61.0, 'temperature': 37.0},
+	], path)
+	assert count == 1
+	reader = SnapshotReader(path)
+	try:
+		assert reader.get('CCO', 'sparc', 'water_sol') == 1200.5
+		assert reader.get('CCC', 'sparc', 'water_sol') is None
+		assert reader.get('CCCC', 'sparc', 'water_sol') is None
+	finally:
+		reader.close()
+
+
+def test_sparc_uses_snapshot_only_for_default_conditions(snapshot_path):
+	assert SparcCalc('CCO').getSnapshotData(['water_sol', 'vapor_press']) == {'water_sol': 1200.5, 'vapor_press': 59.3}
+	assert SparcCalc('CCO').getSnapshotData(['water_sol', 'henrys_law_con']) is None
+	assert SparcCalc('CCO', temperature=37.0).getSnapshotData(['water_sol']) is None
+	assert SparcCalc('CCO', pressure=700.0).getSnapshotData(['water_sol']) is None
+	assert SparcCalc('CCO', melting_point=-114.1).getSnapshotData(['water_sol']) is None
+	assert SparcCalc('CCO', melting_point=None).getSnapshotData(['water_sol']) is None
@@ -0,0 +1,40 @@
+import pytest
+
+from cts_calcs.calcs_metadata import CalcRouter
+from cts_calcs.calculator_sparc import SparcCalc
+
+from standin_server import start_standin
+
+
+PROPS = ['water_sol', 'vapor_press', 'ion_con', 'kow_wph']
+
+
+@pytest.fixture
+def sparc_server(monkeypatch):
+	server, base_url = start_standin(latency=0.02, jitter=0)
+	monkeypatch.setenv('CTS_SPARC_SERVER', base_url)
+	monkeypatch.delenv('CTS_SNAPSHOT_PATH', raising=False)
+	yield base_url
+	server.shutdown()
+	server.server_close()
+
+
+def test_combined_request_calls_do_not_share_results(sparc_server):
+	calc = SparcCalc('CCCO')
+	assert calc.base_url == sparc_server
+	request_dict = {'chemical': 'CCCO', 'calc': 'sparc', 'props': PROPS, 'ph': 7.0}
+	calls, rejected = CalcRouter().route({'sparc': PROPS})
+	data_objs = calc.combinedRequest(request_dict, calls, rejected)
+	assert [data_obj['prop'] for data_obj in data_objs] == PROPS
+	for data_obj in data_objs:
+		assert data_obj['data'] not in (None, "request timed out", "prop not found")
+	assert isinstance(data_objs[2]['data'], dict) and 'pKa' in data_objs[2]['data']
+	assert isinstance(data_objs[3]['data'], float)
+	assert calc.results == ''  # request_logic returns results instead of keeping them
+
+
+def test_request_logic_returns_results(sparc_server):
+	calc = SparcCalc('CCCO')
+	results = calc.makeCallForLogD()
+	assert isinstance(results, dict)
+	assert calc.results == ''
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from cts_calcs import deadline, transport
+
+
+class FakeResponse(object):
+
+	def __init__(self, status_code):
+		self.status_code = status_code
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+	"""
+	Makes send_once run attempts[n](), in turn, for the n-th attempt.
+	"""
+	plan = []
+	lock = threading.Lock()
+
+	def send_once(method, url, **kwargs):
+		with lock:
+			attempt = plan.pop(0)
+		return attempt()
+
+	monkeypatch.setattr(transport, 'send_once', send_once)
+	return plan
+
+
+def slow(response, delay):
+	def attempt():
+		time.sleep(delay)
+		return response
+	return attempt
+
+
+def raises(exception, delay=0):
+	def attempt():
+		time.sleep(delay)
+		raise exception
+	return attempt
+
+
+def test_backup_deadline_error_does_not_abort_primary(attempts):
+	primary = FakeResponse(200)
+	attempts[:] = [slow(primary, 0.2), raises(deadline.DeadlineExceeded("deadline exceeded before backup"))]
+	assert transport.send_hedged(0.05, 'POST', 'http://sparc/logd') is primary
+
+
+def test_losing_response_is_closed(attempts):
+	primary, backup = FakeResponse(200), FakeResponse(200)
+	attempts[:] = [slow(primary, 0.2), slow(backup, 0)]
+	assert transport.send_hedged(0.05, 'POST', 'http://sparc/logd') is backup
+	for _ in range(50):
+		if primary.closed:
+			break
+		time.sleep(0.02)
+	assert primary.closed and not backup.closed
+
+
+def test_error_response_loses_to_success(attempts):
+	primary, backup = FakeResponse(200), FakeResponse(503)
+	attempts[:] = [slow(primary, 0.2), slow(backup, 0)]
+	assert transport.send_hedged(0.05, 'POST', 'http://sparc/logd') is primary
+	assert backup.closed
+
+
+def test_last_error_raised_when_both_attempts_fail(attempts):
+	attempts[:] = [raises(requests.exceptions.ConnectionError("refused"), 0.2), raises(requests.exceptions.Timeout("timed out"))]
+	with pytest.raises(requests.exceptions.ConnectionError):
+		transport.send_hedged(0.05, 'POST', 'http://sparc/logd')
+	assert attempts == []
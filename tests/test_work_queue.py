@@ -0,0 +1,210 @@
+import json
+import time
+
+import pytest
+
+from cts_calcs.cache import ResultCache, LocalCache
+from cts_calcs.work_queue import make_task_id, LocalBroker, RedisBroker, BatchProducer, BatchWorker, DEFAULT_PENDING_TTL
+
+from redis_standin import start_redis_standin
+
+
+REQUESTS = [
+	{'chemical': 'CCO', 'calc': 'sparc', 'props': ['water_sol', 'vapor_press']},
+	{'chemical': 'CCC', 'calc': 'chemaxon', 'props': ['kow_no_ph'], 'method': 'KLOP'},
+	{'chemical': 'CCO', 'calc': 'sparc', 'props': ['vapor_press', 'water_sol']},  # same task as the first
+]
+
+
+
+class StubWorker(BatchWorker):
+	"""
+	Worker whose calculator returns canned data, or raises while failures > 0.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		self.failures = kwargs.pop('failures', 0)
+		self.calls = 0
+		BatchWorker.__init__(self, *args, **kwargs)
+
+	def run_task(self, task):
+		self.calls += 1
+		if self.failures:
+			self.failures -= 1
+			raise Exception("calc server not found")
+		return [{'calc': task['calc'], 'prop': prop, 'data': 1.0} for prop in task['props']]
+
+
+
+@pytest.fixture
+def redis_client():
+	redis = pytest.importorskip('redis')
+	server, port = start_redis_standin()
+	yield redis.StrictRedis(host='127.0.0.1', port=port)
+	server.shutdown()
+	server.server_close()
+
+
+def test_task_ids_are_idempotent():
+	assert make_task_id('CCO', 'sparc', ['water_sol', 'vapor_press']) == make_task_id('CCO', 'sparc', ['vapor_press', 'water_sol'])
+	assert make_task_id('CCO', 'sparc', ['water_sol'], ph=7) == make_task_id('CCO', 'sparc', ['water_sol'], ph=7.0)
+	assert make_task_id('CCO', 'sparc', ['water_sol']) != make_task_id('CCO', 'sparc', ['water_sol'], ph=5.0)
+
+
+def test_batch_runs_each_task_once_and_reports_progress():
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit(REQUESTS)
+	assert len(job['task_ids']) == 2
+	assert producer.progress(job['job_id']) == {'total': 2, 'done': 0, 'failed': 0, 'pending': 2}
+	worker = StubWorker(broker, store)
+	assert worker.run(idle_timeout=0.1) == 2
+	assert producer.progress(job['job_id']) == {'total': 2, 'done': 2, 'failed': 0, 'pending': 0}
+	assert len(producer.results(job['job_id'])) == 2
+	# resubmitting finished work queues nothing:
+	producer.submit(REQUESTS)
+	assert broker.depth() == (0, 0)
+
+
+def test_failed_task_is_retried_then_stored_and_resubmittable():
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit(REQUESTS[:1])
+	worker = StubWorker(broker, store, max_attempts=2, failures=2)
+	worker.run(idle_timeout=0.1)
+	assert worker.calls == 2
+	assert producer.progress(job['job_id'])['failed'] == 1
+	job = producer.submit(REQUESTS[:1])
+	assert producer.progress(job['job_id']) == {'total': 1, 'done': 0, 'failed': 0, 'pending': 1}
+	worker.run(idle_timeout=0.1)
+	assert producer.progress(job['job_id'])['done'] == 1
+
+
+def test_failed_put_clears_pending_key():
+	class DownBroker(LocalBroker):
+		def put(self, task):
+			raise ConnectionError("broker unreachable")
+	store = ResultCache(LocalCache())
+	with pytest.raises(ConnectionError):
+		BatchProducer(DownBroker(), store).submit(REQUESTS[:1])
+	broker = LocalBroker()
+	BatchProducer(broker, store).submit(REQUESTS[:1])
+	assert broker.depth() == (1, 0)
+
+
+def test_pending_key_expires_long_before_results():
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	job = BatchProducer(broker, store).submit(REQUESTS[:1])
+	_, expires_at = store.client._data[BatchProducer.pending_key(job['task_ids'][0])]
+	assert expires_at - time.time() <= DEFAULT_PENDING_TTL < store.ttl
+	# once it expires (e.g., the message was lost), the request can be queued again:
+	store.client.delete(BatchProducer.pending_key(job['task_ids'][0]))
+	BatchProducer(broker, store).submit(REQUESTS[:1])
+	assert broker.depth() == (2, 0)
+
+
+def test_results_carry_ph_and_method():
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit(REQUESTS[1:2])
+	StubWorker(broker, store).run(idle_timeout=0.1)
+	result = producer.results(job['job_id'])[job['task_ids'][0]]
+	assert (result['ph'], result['method'], result['props']) == (7.0, 'KLOP', ['kow_no_ph'])
+
+
+def test_unacked_task_is_redelivered():
+	broker = LocalBroker(visibility_timeout=0.1)
+	broker.put({'task_id': 'a'})
+	receipt, task = broker.reserve(timeout=0)
+	assert task == {'task_id': 'a'}
+	assert broker.reserve(timeout=0) == (None, None)
+	time.sleep(0.15)
+	receipt, task = broker.reserve(timeout=0.1)
+	assert task == {'task_id': 'a'}
+	assert broker.ack(receipt)
+
+
+def test_sparc_without_data_is_retried(monkeypatch):
+	from cts_calcs.calculator_sparc import SparcCalc
+	monkeypatch.setattr(SparcCalc, 'data_request_handler', lambda self, request_dict: None)
+	broker, store = LocalBroker(), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit([{'chemical': 'CCO', 'calc': 'sparc', 'props': ['water_sol', 'ion_con']}])
+	BatchWorker(broker, store, max_attempts=2).run(idle_timeout=0.1)
+	result = list(producer.results(job['job_id']).values())[0]
+	assert result['data'] is None
+	assert 'no sparc data' in result['error']
+
+
+def test_redis_broker_ack(redis_client):
+	broker = RedisBroker(redis_client, name='test')
+	broker.put({'task_id': 'a'})
+	assert broker.depth() == (1, 0)
+	receipt, task = broker.reserve(timeout=0.1)
+	assert task == {'task_id': 'a'}
+	assert broker.depth() == (0, 1)
+	assert broker.ack(receipt)
+	assert broker.depth() == (0, 0)
+	assert redis_client.zcard('test:inflight') == 0
+	assert broker.reserve(timeout=0.1) == (None, None)
+
+
+def test_redis_broker_identical_tasks_are_separate_deliveries(redis_client):
+	broker = RedisBroker(redis_client, name='test')
+	broker.put({'task_id': 'a'})
+	broker.put({'task_id': 'a'})
+	first, _ = broker.reserve(timeout=0.1)
+	second, _ = broker.reserve(timeout=0.1)
+	assert first != second
+	assert redis_client.zcard('test:inflight') == 2
+	assert broker.ack(first)
+	assert broker.depth() == (0, 1)
+	assert broker.ack(second)
+	assert broker.depth() == (0, 0)
+
+
+def test_redis_broker_redelivers_after_visibility_timeout(redis_client):
+	broker = RedisBroker(redis_client, name='test', visibility_timeout=0.1)
+	broker.put({'task_id': 'a'})
+	broker.reserve(timeout=0.1)  # worker never acks
+	time.sleep(0.15)
+	other = RedisBroker(redis_client, name='test', visibility_timeout=0.1)
+	receipt, task = other.reserve(timeout=0.1)
+	assert task == {'task_id': 'a'}
+	assert other.ack(receipt)
+	assert other.depth() == (0, 0)
+
+
+def test_redis_broker_recovers_task_of_worker_that_died_after_reserving(redis_client):
+	broker = RedisBroker(redis_client, name='test', visibility_timeout=0.1)
+	broker.put({'task_id': 'a'})
+	# the worker's BLMOVE went through, then it died before recording a deadline:
+	redis_client.blmove('test:queue', 'test:processing', 0.1, 'RIGHT', 'LEFT')
+	assert broker.reserve(timeout=0.05) == (None, None)  # gives the orphan a deadline
+	assert redis_client.zcard('test:inflight') == 1
+	time.sleep(0.15)
+	receipt, task = broker.reserve(timeout=0.1)
+	assert task == {'task_id': 'a'}
+	assert broker.ack(receipt)
+	assert broker.depth() == (0, 0)
+
+
+def test_redis_broker_nack_requeues(redis_client):
+	broker = RedisBroker(redis_client, name='test')
+	broker.put({'task_id': 'a', 'attempts': 0})
+	receipt, task = broker.reserve(timeout=0.1)
+	broker.nack(receipt, dict(task, attempts=1))
+	assert broker.depth() == (1, 0)
+	assert redis_client.zcard('test:inflight') == 0
+	receipt, task = broker.reserve(timeout=0.1)
+	assert task['attempts'] == 1
+	assert json.loads(redis_client.lrange('test:processing', 0, -1)[0])['message_id'] == receipt
+
+
+def test_batch_over_redis_broker(redis_client):
+	broker, store = RedisBroker(redis_client, name='test'), ResultCache(LocalCache())
+	producer = BatchProducer(broker, store)
+	job = producer.submit(REQUESTS)
+	StubWorker(broker, store).run(idle_timeout=0.1)
+	assert producer.progress(job['job_id'])['done'] == 2
+	assert broker.depth() == (0, 0)